@@ -0,0 +1,173 @@
+"""
+Concurrency scaling of the sync vs async LLM-bound views.
+
+Starts a local stand-in for the OpenRouter chat-completions endpoint that
+answers every request after a fixed delay, then fires N concurrent
+GET /api/generate-quiz/ requests in a fresh Django process per view mode
+and reports the wall-clock time of each batch.
+
+The sync views are driven through the WSGI handler by a fixed pool of
+worker threads, as a threaded WSGI server would, so a batch takes about
+N / workers * delay. The async views are driven through the ASGI
+application from one event loop and keep the whole batch in flight.
+
+Usage (from backend/):
+    python benchmarks/async_concurrency.py --delay 2 --concurrency 1 10 50 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUIZ = [
+    {
+        "question": f"Question {i}",
+        "options": ["A) one", "B) two", "C) three", "D) four"],
+        "answer": "B",
+        "difficulty": "medium",
+        "concept": f"Concept {i % 3}",
+    }
+    for i in range(10)
+]
+
+
+def start_upstream(delay):
+    body = json.dumps({"id": "bench", "choices": [{"message": {"content": json.dumps(QUIZ)}}]}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_worker(mode, upstream, concurrency_levels, wsgi_workers):
+    """Runs inside the child process: one Django instance per view mode."""
+    os.environ["LEARNING_ASYNC_VIEWS"] = "1" if mode == "async" else "0"
+    os.environ["OPENROUTER_BASE_URL"] = upstream
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sals_backend.settings")
+    sys.path.insert(0, BACKEND_DIR)
+
+    from django.conf import settings
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    settings.DATABASES["default"]["NAME"] = db_path
+    settings.QUIZ_POOL = {"ENABLED": False}
+    settings.LOGGING_CONFIG = None
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+
+    if mode == "sync":
+        results = [sync_batch(n, wsgi_workers) for n in concurrency_levels]
+    else:
+        results = asyncio.run(async_batches(concurrency_levels))
+    print(json.dumps(results))
+
+
+def _ok(status, body):
+    return status == 200 and "quiz_id" in json.loads(body)
+
+
+def sync_batch(n, wsgi_workers):
+    """N requests through the WSGI handler with a fixed pool of worker threads."""
+    from concurrent.futures import ThreadPoolExecutor
+    from django.test import Client
+
+    local = threading.local()
+
+    def request(i):
+        client = getattr(local, "client", None) or Client()
+        local.client = client
+        response = client.get("/api/generate-quiz/", {"topic": f"Topic {i}"}, HTTP_HOST="localhost")
+        return _ok(response.status_code, response.content)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=wsgi_workers) as pool:
+        ok = sum(pool.map(request, range(n)))
+    return {"concurrency": n, "seconds": round(time.perf_counter() - started, 3), "ok": ok}
+
+
+async def async_batches(concurrency_levels):
+    """N concurrent requests through the ASGI application in one event loop."""
+    import httpx
+    from django.core.asgi import get_asgi_application
+
+    app = get_asgi_application()
+    results = []
+    for n in concurrency_levels:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost", timeout=None) as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.get("/api/generate-quiz/", params={"topic": f"Topic {i}"}) for i in range(n)
+            ])
+            elapsed = time.perf_counter() - started
+        ok = sum(1 for r in responses if _ok(r.status_code, r.content))
+        results.append({"concurrency": n, "seconds": round(elapsed, 3), "ok": ok})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delay", type=float, default=2.0, help="Upstream latency in seconds.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--wsgi-workers", type=int, default=4, help="Worker threads serving the sync views.")
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--worker", choices=["sync", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.upstream, args.concurrency, args.wsgi_workers)
+        return
+
+    upstream = start_upstream(args.delay)
+    base_url = f"http://127.0.0.1:{upstream.server_port}"
+    print(f"upstream delay {args.delay}s, {args.wsgi_workers} WSGI worker threads for sync views")
+    print(f"{'mode':<6} {'concurrency':>11} {'seconds':>9} {'req/s':>8} {'ok':>5}")
+    for mode in args.modes:
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", mode, "--upstream", base_url,
+             "--wsgi-workers", str(args.wsgi_workers), "--concurrency", *map(str, args.concurrency)],
+            capture_output=True, text=True, check=True, cwd=BACKEND_DIR,
+        ).stdout
+        for row in json.loads(output.strip().splitlines()[-1]):
+            rate = row["concurrency"] / row["seconds"] if row["seconds"] else 0
+            print(f"{mode:<6} {row['concurrency']:>11} {row['seconds']:>9.3f} {rate:>8.1f} {row['ok']:>5}")
+    upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main()
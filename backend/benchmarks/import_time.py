@@ -0,0 +1,119 @@
+"""
+Start-up import budget of the backend.
+
+Runs a fresh interpreter with ``-X importtime`` several times, each doing
+what a worker does before it can serve its first request: django.setup()
+and loading the URLconf (which imports every view module). Reports the
+median total import time, the packages it goes to and the slowest modules,
+and exits non-zero when
+
+- the median exceeds the budget (--budget-ms), or
+- a dependency that must only load on first use (LangChain, LangSmith, the
+  HTTP clients, tokenizers) is imported during start-up.
+
+Usage (from backend/):
+    python benchmarks/import_time.py --runs 7 --budget-ms 500
+    python benchmarks/import_time.py --target asgi --show 25
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    "urls": (
+        "import django; django.setup(); "
+        "from django.urls import get_resolver; get_resolver().url_patterns"
+    ),
+    "setup": "import django; django.setup()",
+    "asgi": "import sals_backend.asgi",
+    "wsgi": "import sals_backend.wsgi",
+}
+
+# Top-level packages that are imported and constructed on first use only
+LAZY_PACKAGES = (
+    "langchain", "langchain_core", "langchain_community", "langsmith",
+    "requests", "httpx", "tiktoken", "openai",
+)
+
+DEFAULT_BUDGET_MS = 500
+
+
+def parse_importtime(stderr):
+    """``[(module, self_us, cumulative_us)]`` from ``-X importtime`` output, in import order."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def run_once(code):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="sals_backend.settings")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, cwd=BACKEND_DIR, env=env)
+    wall = time.perf_counter() - started
+    if result.returncode:
+        sys.stderr.write(result.stderr[-2000:])
+        sys.exit(result.returncode)
+    return parse_importtime(result.stderr), wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=sorted(TARGETS), default="urls", help="What the measured start-up does.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure; the median is reported.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Median import time allowed.")
+    parser.add_argument("--show", type=int, default=15, help="Number of packages and modules to list.")
+    args = parser.parse_args()
+
+    code = TARGETS[args.target]
+    run_once(code)  # warm the bytecode cache so every measured run loads .pyc files
+    runs = [run_once(code) for _ in range(args.runs)]
+    totals = [sum(self_us for _, self_us, _ in modules) / 1000 for modules, _ in runs]
+    median_index = totals.index(statistics.median_low(totals))
+    modules, _ = runs[median_index]
+    median = totals[median_index]
+
+    by_package = Counter()
+    for name, self_us, _ in modules:
+        by_package[name.split(".")[0]] += self_us
+    print(f"target '{args.target}': {len(modules)} modules, import time median {median:.1f} ms "
+          f"(min {min(totals):.1f}, max {max(totals):.1f}), process wall median "
+          f"{statistics.median(wall for _, wall in runs) * 1000:.1f} ms over {args.runs} runs")
+
+    print(f"\n{'package':<30} {'self ms':>8}")
+    for package, self_us in by_package.most_common(args.show):
+        print(f"{package:<30} {self_us / 1000:>8.1f}")
+
+    print(f"\n{'module':<50} {'self ms':>8} {'cumulative ms':>14}")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[1], reverse=True)[:args.show]:
+        print(f"{name:<50} {self_us / 1000:>8.1f} {cumulative_us / 1000:>14.1f}")
+
+    failures = []
+    eager = sorted({name.split(".")[0] for name, _, _ in modules} & set(LAZY_PACKAGES))
+    if eager:
+        failures.append(f"imported at start-up but should load on first use: {', '.join(eager)}")
+    if median > args.budget_ms:
+        failures.append(f"median import time {median:.1f} ms is over the {args.budget_ms:g} ms budget")
+
+    print()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"OK: within the {args.budget_ms:g} ms budget and no lazy dependency imported")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Correctness, fuzzing and speed of learning.llm_json.
+
+Runs every reply in llm_json_corpus.json through parse_llm_json and
+through the per-view cleanup that preceded it, reports which replies each
+one accepts, then times both on the corpus. The fuzz pass mutates corpus
+replies at random (truncation, deleted or duplicated characters, injected
+commas, comments and brackets) and checks that the extractor only ever
+raises LLMOutputError.
+
+Usage (from backend/):
+    python benchmarks/llm_json.py --fuzz 20000 --repeat 200
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_json_corpus.json")
+
+
+def legacy_parse(endpoint, raw):
+    """The cleanup each view did before learning.llm_json existed."""
+    from learning.llm_json import SCHEMAS
+
+    if endpoint == "quiz":
+        value = json.loads(re.sub(r"^```json\n|```$", "", raw.strip()))
+    elif endpoint == "learning_path":
+        cleaned = re.sub(r'^```json\s*|\s*```$', '', raw.strip())
+        cleaned = re.sub(r',(\s*[}\]])', r'\1', cleaned)
+        cleaned = re.sub(r'([{,])\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*:', r'\1"\2":', cleaned)
+        value = json.loads(cleaned)
+    else:
+        value = json.loads(raw.strip().replace("```json", "").replace("```", ""))
+    return SCHEMAS[endpoint].validate(value)
+
+
+def accepts(parse, endpoint, raw):
+    try:
+        parse(endpoint, raw)
+        return True
+    except ValueError:
+        return False
+
+
+def check_corpus(corpus):
+    from learning.llm_json import parse_llm_json
+
+    def current(endpoint, raw):
+        return parse_llm_json(raw, endpoint)
+
+    print(f"{'case':<45} {'expected':>8} {'legacy':>7} {'new':>5}")
+    mismatches = 0
+    totals = {"legacy": 0, "new": 0}
+    for case in corpus:
+        old = accepts(legacy_parse, case["endpoint"], case["reply"])
+        new = accepts(current, case["endpoint"], case["reply"])
+        totals["legacy"] += old
+        totals["new"] += new
+        mismatches += new != case["ok"]
+        flag = "" if new == case["ok"] else "  <-- unexpected"
+        print(f"{case['name']:<45} {str(case['ok']):>8} {str(old):>7} {str(new):>5}{flag}")
+    expected = sum(case["ok"] for case in corpus)
+    print(f"accepted: legacy {totals['legacy']}/{expected}, new {totals['new']}/{expected} valid replies")
+    return mismatches
+
+
+def mutate(text, rng):
+    if not text:
+        return rng.choice(["[", "{", "//", "```"])
+    pos = rng.randrange(len(text))
+    choice = rng.randrange(6)
+    if choice == 0:
+        return text[:pos]
+    if choice == 1:
+        return text[:pos] + text[pos + 1:]
+    if choice == 2:
+        return text[:pos] + text[pos] * rng.randint(2, 5) + text[pos:]
+    if choice == 3:
+        return text[:pos] + rng.choice([",", ",,", ":", '"', "'", "\\"]) + text[pos:]
+    if choice == 4:
+        return text[:pos] + rng.choice(["// note\n", "/* x */", "/*", "```json\n", "<think>"]) + text[pos:]
+    return text[:pos] + rng.choice("[]{}") * rng.randint(1, 50) + text[pos:]
+
+
+def fuzz(corpus, iterations, seed):
+    from learning.llm_json import LLMOutputError, parse_llm_json
+
+    rng = random.Random(seed)
+    accepted = 0
+    slowest = 0.0
+    for _ in range(iterations):
+        case = rng.choice(corpus)
+        reply = case["reply"]
+        for _ in range(rng.randint(1, 4)):
+            reply = mutate(reply, rng)
+        started = time.perf_counter()
+        try:
+            parse_llm_json(reply, case["endpoint"])
+            accepted += 1
+        except LLMOutputError:
+            pass
+        except Exception as e:
+            print(f"fuzz: {type(e).__name__}: {e} for reply {reply[:200]!r}")
+            return False
+        slowest = max(slowest, time.perf_counter() - started)
+    print(f"fuzz: {iterations} mutated replies, {accepted} accepted, slowest {slowest * 1000:.2f} ms, no crashes")
+    return True
+
+
+def time_parsers(corpus, repeat):
+    from learning.llm_json import parse_llm_json
+
+    valid = [case for case in corpus if case["ok"] and accepts(legacy_parse, case["endpoint"], case["reply"])]
+    for label, parse in (("legacy", legacy_parse), ("new", lambda e, r: parse_llm_json(r, e))):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for case in valid:
+                parse(case["endpoint"], case["reply"])
+        per_call = (time.perf_counter() - started) / (repeat * len(valid)) * 1e6
+        print(f"{label:<6} {per_call:8.1f} us/reply over {len(valid)} replies both parsers accept")
+
+    broken = [case for case in corpus if case["ok"] and not accepts(legacy_parse, case["endpoint"], case["reply"])]
+    if broken:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for case in broken:
+                parse_llm_json(case["reply"], case["endpoint"])
+        per_call = (time.perf_counter() - started) / (repeat * len(broken)) * 1e6
+        print(f"new    {per_call:8.1f} us/reply over {len(broken)} replies only the tolerant path accepts")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=5000, help="Number of mutated replies to try.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=100, help="Timing repetitions over the corpus.")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sals_backend.settings")
+    import django
+    django.setup()
+
+    with open(CORPUS) as f:
+        corpus = json.load(f)
+
+    mismatches = check_corpus(corpus)
+    ok = fuzz(corpus, args.fuzz, args.seed)
+    time_parsers(corpus, args.repeat)
+    sys.exit(1 if mismatches or not ok else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+"""
+Offline load test of the full /api/ learning flow.
+
+Starts the OpenRouter stand-in (learning.standin) with the requested
+latency distribution, error rate and streaming pace, then runs a fresh
+Django process on a temporary database that plays N learner journeys with
+U of them in flight at once. Each journey is the frontend's sequence:
+
+    generate-quiz -> analyze-quiz -> learning-path (or learning-path/stream)
+    -> final-quiz -> submit-final-quiz
+
+A journey stops at the first failed step. The report gives, per endpoint,
+the number of requests, failures, throughput and p50/p95/p99 latency, plus
+the upstream calls the stand-in served. Runs are repeatable for a given
+--seed; --save writes the results as JSON and --compare prints the change
+against a saved run, so every performance change can be measured against
+the same baseline.
+
+The sync views are driven through the WSGI handler by U threads; --asgi
+drives the async views through the ASGI application from one event loop.
+--url drives an already running server over HTTP instead (start it with
+OPENROUTER_BASE_URL pointing at `manage.py openrouter_standin`).
+
+Usage (from backend/):
+    python benchmarks/load_test.py --journeys 200 --users 20 --latency lognormal:1,0.5
+    python benchmarks/load_test.py --asgi --stream --error-rate 0.05 --save baseline.json
+    python benchmarks/load_test.py --compare baseline.json
+    python benchmarks/load_test.py --upstream-rate 60 --users 30   # overload a rate-limited upstream
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+ENDPOINTS = ["generate-quiz", "analyze-quiz", "learning-path", "learning-path/stream", "final-quiz", "submit-final-quiz"]
+
+# One HTTP request of a journey; ``expect`` is the response key (or SSE
+# event) that marks it successful.
+Request = namedtuple("Request", ["name", "method", "path", "data", "expect"])
+
+
+def journey(topic, rng, stream):
+    """
+    One learner's pass through the flow, as a generator of Requests.
+
+    The driver sends back each successful response body and closes the
+    generator after a failed one.
+    """
+    quiz = yield Request("generate-quiz", "GET", "/api/generate-quiz/", {"topic": topic}, "quiz_id")
+    analysis = yield Request("analyze-quiz", "POST", "/api/analyze-quiz/", {
+        "quiz_id": quiz["quiz_id"],
+        "user_answers": [rng.choice("ABCD") for _ in quiz["quiz"]],
+    }, "quiz_attempt_id")
+
+    path_request = {
+        "quiz_attempt_id": analysis["quiz_attempt_id"],
+        "weak_concepts": analysis["weak_concepts"],
+        "all_concepts": analysis["all_concepts"],
+    }
+    if stream:
+        yield Request("learning-path/stream", "POST", "/api/learning-path/stream/", path_request, "event: done")
+    else:
+        yield Request("learning-path", "POST", "/api/learning-path/", path_request, "learning_path_id")
+
+    final = yield Request("final-quiz", "POST", "/api/final-quiz/", {
+        "topic": topic,
+        "weak_concepts": analysis["weak_concepts"],
+    }, "quiz_id")
+    questions = final["quiz"]["questions"] if isinstance(final["quiz"], dict) else final["quiz"]
+    yield Request("submit-final-quiz", "POST", "/api/submit-final-quiz/", {
+        "quiz_id": final["quiz_id"],
+        "user_answers": [rng.choice("ABCD") for _ in questions],
+    }, "quiz_attempt_id")
+
+
+def check(request, status, content):
+    """Decode a response; returns the body, or None if the step failed."""
+    if status != 200:
+        return None
+    if request.expect.startswith("event:"):
+        text = content.decode() if isinstance(content, bytes) else content
+        return text if request.expect in text else None
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(body, dict) or "error" in body or request.expect not in body:
+        return None
+    return body
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []  # (endpoint, seconds, ok, status)
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, ok, status=None):
+        with self.lock:
+            self.samples.append((name, seconds, ok, status))
+
+    def finish(self):
+        with self.lock:
+            self.completed += 1
+
+
+def play(flow, send, recorder):
+    """Drive one journey with a blocking ``send(request) -> (status, content)``."""
+    body = None
+    while True:
+        try:
+            request = flow.send(body)
+        except StopIteration:
+            recorder.finish()
+            return
+        started = time.perf_counter()
+        try:
+            status, content = send(request)
+        except Exception:
+            status, content = None, b""
+        body = check(request, status, content)
+        recorder.add(request.name, time.perf_counter() - started, body is not None, status)
+        if body is None:
+            flow.close()
+            return
+
+
+async def aplay(flow, asend, recorder):
+    """Coroutine version of play()."""
+    body = None
+    while True:
+        try:
+            request = flow.send(body)
+        except StopIteration:
+            recorder.finish()
+            return
+        started = time.perf_counter()
+        try:
+            status, content = await asend(request)
+        except Exception:
+            status, content = None, b""
+        body = check(request, status, content)
+        recorder.add(request.name, time.perf_counter() - started, body is not None, status)
+        if body is None:
+            flow.close()
+            return
+
+
+def journeys(args):
+    rng = random.Random(args.seed)
+    topics = [f"Load Topic {i}" for i in range(args.topics)]
+    for i in range(args.journeys):
+        yield journey(topics[i % len(topics)], random.Random(rng.random()), args.stream)
+
+
+def run_threads(args, make_send):
+    """U worker threads, each with its own transport, working through the journeys."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    recorder = Recorder()
+    local = threading.local()
+
+    def run(flow):
+        send = getattr(local, "send", None)
+        if send is None:
+            send = local.send = make_send()
+        play(flow, send, recorder)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(run, journeys(args)))
+    return recorder, time.perf_counter() - started
+
+
+def user_address(number):
+    """A client address per simulated user, since the rate limiter tells clients apart by it."""
+    return f"10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}"
+
+
+def wsgi_send():
+    from django.test import Client
+
+    client = Client(HTTP_X_FORWARDED_FOR=user_address(threading.get_native_id()))
+
+    def send(request):
+        if request.method == "GET":
+            response = client.get(request.path, request.data, HTTP_HOST="localhost")
+        else:
+            response = client.post(request.path, json.dumps(request.data),
+                                   content_type="application/json", HTTP_HOST="localhost")
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, content
+
+    return send
+
+
+def http_send(base_url):
+    import requests
+
+    def make_send():
+        session = requests.Session()
+
+        def send(request):
+            url = base_url.rstrip("/") + request.path
+            if request.method == "GET":
+                response = session.get(url, params=request.data, timeout=600)
+            else:
+                response = session.post(url, json=request.data, timeout=600)
+            return response.status_code, response.content
+
+        return send
+
+    return make_send
+
+
+async def run_asgi(args):
+    import httpx
+    from django.core.asgi import get_asgi_application
+
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=get_asgi_application())
+    semaphore = asyncio.Semaphore(args.users)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost", timeout=None) as client:
+
+        def make_asend(number):
+            headers = {"X-Forwarded-For": user_address(number)}
+
+            async def asend(request):
+                if request.method == "GET":
+                    response = await client.get(request.path, params=request.data, headers=headers)
+                else:
+                    response = await client.post(request.path, json=request.data, headers=headers)
+                return response.status_code, response.content
+
+            return asend
+
+        async def run(number, flow):
+            async with semaphore:
+                await aplay(flow, make_asend(number), recorder)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[run(number, flow) for number, flow in enumerate(journeys(args))])
+        elapsed = time.perf_counter() - started
+    return recorder, elapsed
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(recorder, elapsed, args):
+    endpoints = {}
+    for name in ENDPOINTS:
+        samples = [(seconds, ok, status) for endpoint, seconds, ok, status in recorder.samples if endpoint == name]
+        if not samples:
+            continue
+        latencies = [seconds for seconds, ok, _ in samples if ok]
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, ok, _ in samples if not ok),
+            "busy": sum(1 for _, _, status in samples if status == 503),
+            "rps": round(len(samples) / elapsed, 2),
+            **{
+                key: round(percentile(latencies, fraction) * 1000, 1) if latencies else None
+                for key, fraction in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99), ("max_ms", 1.0))
+            },
+        }
+    return {
+        "config": {
+            key: getattr(args, key)
+            for key in ("journeys", "users", "topics", "latency", "error_rate", "bad_reply_rate",
+                        "upstream_rate", "no_limiter", "stream", "asgi", "pool", "no_cache", "seed", "url")
+        },
+        "seconds": round(elapsed, 3),
+        "journeys_completed": recorder.completed,
+        "journeys_per_second": round(recorder.completed / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def run_worker(args):
+    """Runs inside the child process: a fresh Django instance on a temporary database."""
+    os.environ["LEARNING_ASYNC_VIEWS"] = "1" if args.asgi else "0"
+    os.environ["OPENROUTER_BASE_URL"] = args.upstream
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sals_backend.settings")
+
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = os.path.join(tempfile.mkdtemp(), "load.sqlite3")
+    settings.DATABASES["default"].setdefault("OPTIONS", {})["timeout"] = 60
+    if not args.pool:
+        settings.QUIZ_POOL = {**settings.QUIZ_POOL, "ENABLED": False}
+    if args.no_cache:
+        settings.LLM_CACHE = {**settings.LLM_CACHE, "ENDPOINT_TTLS": {}}
+        settings.LEARNING_MATERIALS = {**settings.LEARNING_MATERIALS, "ENABLED": False}
+    # The stand-in has no rate limit unless --upstream-rate gives it one
+    settings.LLM_RATE_LIMIT = {
+        **settings.LLM_RATE_LIMIT,
+        "ENABLED": bool(args.upstream_rate) and not args.no_limiter,
+        "RATE": (args.upstream_rate or 60) / 60,
+        "BURST": 5,
+        "CLIENT_HEADER": "HTTP_X_FORWARDED_FOR",
+    }
+    settings.LOGGING_CONFIG = None
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+
+    if args.asgi:
+        recorder, elapsed = asyncio.run(run_asgi(args))
+    else:
+        recorder, elapsed = run_threads(args, wsgi_send)
+    print(json.dumps(summarize(recorder, elapsed, args)))
+
+
+def _ms(value):
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def report(results, upstream_calls=None):
+    config = results["config"]
+    target = config["url"] or ("ASGI (async views)" if config["asgi"] else "WSGI (sync views)")
+    print(f"{target}: {config['journeys']} journeys, {config['users']} concurrent, {config['topics']} topics, "
+          f"upstream latency {config['latency']}, error rate {config['error_rate']}")
+    print(f"{'endpoint':<22} {'requests':>8} {'errors':>6} {'503s':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, row in results["endpoints"].items():
+        print(f"{name:<22} {row['requests']:>8} {row['errors']:>6} {row.get('busy', 0):>6} {row['rps']:>8.2f} "
+              f"{_ms(row['p50_ms'])} {_ms(row['p95_ms'])} {_ms(row['p99_ms'])} {_ms(row['max_ms'])}")
+    print(f"journeys completed: {results['journeys_completed']}/{config['journeys']} in {results['seconds']:.2f}s "
+          f"({results['journeys_per_second']:.2f}/s)")
+    if upstream_calls:
+        print("upstream calls: " + ", ".join(f"{key} {count}" for key, count in sorted(upstream_calls.items())))
+
+
+def compare(results, baseline):
+    print(f"\nagainst baseline ({baseline['journeys_per_second']:.2f} journeys/s):")
+    print(f"{'endpoint':<22} {'req/s':>16} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    for name, row in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        cells = []
+        for key, width in (("rps", 16), ("p50_ms", 18), ("p95_ms", 18), ("p99_ms", 18)):
+            old, new = before[key], row[key]
+            if old is None or new is None:
+                cells.append(f"{'-':>{width}}")
+                continue
+            change = f"{(new - old) / old * 100:+.0f}%" if old else ""
+            cells.append(f"{f'{old:g} -> {new:g} {change}':>{width}}")
+        print(f"{name:<22} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--journeys", type=int, default=50, help="Learner journeys to play.")
+    parser.add_argument("--users", type=int, default=10, help="Journeys in flight at once.")
+    parser.add_argument("--topics", type=int, default=10, help="Distinct topics the journeys spread over.")
+    parser.add_argument("--stream", action="store_true", help="Use learning-path/stream instead of learning-path.")
+    parser.add_argument("--asgi", action="store_true", help="Drive the async views through the ASGI application.")
+    parser.add_argument("--url", help="Drive a running server at this base URL instead of an in-process one.")
+    parser.add_argument("--pool", action="store_true", help="Keep the pre-generated quiz pool enabled.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disable the response cache and the learning-material store.")
+    parser.add_argument("--latency", default="lognormal:0.5,0.4", help="Stand-in latency spec (see learning.standin).")
+    parser.add_argument("--endpoint-latency", action="append", default=[], metavar="ENDPOINT=SPEC",
+                        help="Per-endpoint stand-in latency override (repeatable).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of upstream calls that fail.")
+    parser.add_argument("--bad-reply-rate", type=float, default=0.0, help="Share of upstream replies without JSON.")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Seconds between streamed deltas.")
+    parser.add_argument("--upstream-rate", type=float,
+                        help="Calls per minute the stand-in allows (429 beyond); the limiter is set to match.")
+    parser.add_argument("--no-limiter", action="store_true", help="Leave the rate limiter off under --upstream-rate.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare with results saved by an earlier --save.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    upstream_calls = None
+    if args.url:
+        recorder, elapsed = run_threads(args, http_send(args.url))
+        results = summarize(recorder, elapsed, args)
+    else:
+        from learning.standin import start_standin
+
+        upstream = start_standin(
+            latency=args.latency,
+            endpoint_latency=dict(item.split("=", 1) for item in args.endpoint_latency),
+            error_rate=args.error_rate,
+            bad_reply_rate=args.bad_reply_rate,
+            chunk_delay=args.chunk_delay,
+            rate_limit=args.upstream_rate / 60 if args.upstream_rate else None,
+            rate_burst=5,
+            seed=args.seed,
+        )
+        output = subprocess.run(
+            [sys.executable, __file__, *sys.argv[1:], "--worker", "--upstream", upstream.url],
+            capture_output=True, text=True, cwd=BACKEND_DIR,
+        )
+        if output.returncode:
+            sys.stderr.write(output.stderr)
+            sys.exit(output.returncode)
+        results = json.loads(output.stdout.strip().splitlines()[-1])
+        upstream_calls = upstream.stats()
+        results["upstream_calls"] = upstream_calls
+        upstream.shutdown()
+
+    report(results, upstream_calls)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Async versions of the LLM-bound views, served when running under ASGI.
+
+They share their logic with views.py through learning.flows; the only
+difference is that the model is awaited rather than blocked on, so one
+process can keep hundreds of generations in flight.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from . import flows
+from .batch import arun_batch, parse_batch_request
+from .flows import arun_flow, flow_response
+from .jobs import enqueue_response, wants_job
+from .llm_json import validate_learning_path_entry
+from .openrouter import astream_openrouter
+from .ratelimit import UpstreamBusy
+from .streaming import JSONArrayStreamParser, ndjson_line, ndjson_response, sse_event, sse_response
+
+@csrf_exempt
+async def generate_quiz(request):
+    topic_name = request.GET.get("topic", "Graphs")
+    if wants_job(request):
+        return await sync_to_async(enqueue_response)("generate_quiz", {"topic": topic_name})
+    payload, status = await arun_flow(flows.generate_quiz(topic_name))
+    return flow_response(payload, status)
+
+@csrf_exempt
+async def generate_quiz_batch(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    try:
+        counts = parse_batch_request(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    async def lines():
+        async for result in arun_batch(counts):
+            yield ndjson_line(result)
+
+    return ndjson_response(lines())
+
+@csrf_exempt
+async def analyze_quiz(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        if wants_job(request):
+            return await sync_to_async(enqueue_response)("analyze_quiz", data)
+        payload, status = await arun_flow(flows.analyze_quiz(data))
+        return flow_response(payload, status)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)})
+
+@csrf_exempt
+async def learning_path(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        if wants_job(request):
+            return await sync_to_async(enqueue_response)("learning_path", data)
+        payload, status = await arun_flow(flows.learning_path(data))
+        return flow_response(payload, status)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)})
+
+@csrf_exempt
+async def learning_path_stream(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    try:
+        stream = await sync_to_async(flows.start_learning_path_stream)(json.loads(request.body))
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    async def events():
+        parser = JSONArrayStreamParser(validate_learning_path_entry)
+        concepts, parts = [], []
+        try:
+            # Stored material goes out straight away; only missing concepts are generated
+            for concept in stream["stored"]:
+                yield sse_event("concept", concept)
+            if stream["prompt"]:
+                async for delta in astream_openrouter(stream["prompt"], endpoint="learning_path", topic=stream["topic"]):
+                    parts.append(delta)
+                    for concept in parser.feed(delta):
+                        concepts.append(concept)
+                        yield sse_event("concept", concept)
+                if not concepts:
+                    # The reply was not a streamable array; fall back to a full parse
+                    for concept in flows.parse_learning_path("".join(parts)):
+                        concepts.append(concept)
+                        yield sse_event("concept", concept)
+            done = await sync_to_async(flows.finish_learning_path_stream)(stream, concepts)
+            yield sse_event("done", done)
+        except UpstreamBusy as e:
+            yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return sse_response(events())
+
+@csrf_exempt
+async def final_quiz(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        if wants_job(request):
+            return await sync_to_async(enqueue_response)("final_quiz", data)
+        payload, status = await arun_flow(flows.final_quiz(data))
+        return flow_response(payload, status)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+async def submit_final_quiz(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        if wants_job(request):
+            return await sync_to_async(enqueue_response)("submit_final_quiz", data)
+        payload, status = await arun_flow(flows.submit_final_quiz(data))
+        return flow_response(payload, status)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)})
@@ -0,0 +1,216 @@
+"""
+Batch quiz generation for many topics at once.
+
+A batch is a list of topics, each with a number of quizzes to generate.
+Every quiz is one model call; calls run concurrently, at most
+QUIZ_BATCH["MAX_CONCURRENCY"] at a time (threads for the sync view,
+tasks for the async one), so a syllabus takes about as long as its
+slowest generations rather than their sum. As soon as all quizzes of a
+topic are in, they are saved with one bulk insert and the topic's result
+is yielded, so callers can stream results as they finish.
+
+Batch threads run in a copy of the request's context, so the upstream rate
+limiter counts their calls against the requesting client. A topic whose
+calls the limiter turned away reports ``retry_after`` (in seconds).
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Topic
+from .openrouter import acall_openrouter, call_openrouter
+from .prompts import generate_quiz_prompt
+from .questions import create_quizzes
+from .quiz_pool import parse_quiz_response
+from .ratelimit import UpstreamBusy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SETTINGS = {
+    "MAX_CONCURRENCY": 8,
+    "MAX_TOPICS": 50,
+    "MAX_COUNT": 5,
+}
+
+
+def get_batch_settings():
+    config = dict(DEFAULT_BATCH_SETTINGS)
+    config.update(getattr(settings, "QUIZ_BATCH", {}))
+    return config
+
+
+class BatchRequestError(ValueError):
+    """Raised when a batch request is malformed or over the configured limits."""
+
+
+def parse_batch_request(data):
+    """
+    Turn a request body into ``{topic name: quiz count}``.
+
+    ``topics`` holds names or ``{"topic": name, "count": n}`` objects; a
+    top-level ``count`` is the default for bare names.
+    """
+    config = get_batch_settings()
+    if not isinstance(data, dict) or not isinstance(data.get("topics"), list) or not data["topics"]:
+        raise BatchRequestError("'topics' must be a non-empty list")
+    default_count = data.get("count", 1)
+
+    counts = {}
+    for entry in data["topics"]:
+        name, count = (entry.get("topic"), entry.get("count", default_count)) if isinstance(entry, dict) else (entry, default_count)
+        if not isinstance(name, str) or not name.strip():
+            raise BatchRequestError(f"Invalid topic: {entry!r}")
+        if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= config["MAX_COUNT"]:
+            raise BatchRequestError(f"Count for {name!r} must be between 1 and {config['MAX_COUNT']}")
+        counts[name.strip()[:100]] = count
+
+    if len(counts) > config["MAX_TOPICS"]:
+        raise BatchRequestError(f"At most {config['MAX_TOPICS']} topics per batch")
+    return counts
+
+
+def _topics(names):
+    """Get or create the named topics with a fixed number of queries."""
+    existing = {topic.name: topic for topic in Topic.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in existing]
+    if missing:
+        Topic.objects.bulk_create([Topic(name=name, description="") for name in missing], ignore_conflicts=True)
+        existing.update((topic.name, topic) for topic in Topic.objects.filter(name__in=missing))
+    return existing
+
+
+def _jobs(counts):
+    return [(name, variant, count) for name, count in counts.items() for variant in range(1, count + 1)]
+
+
+def _prompt(job):
+    name, variant, count = job
+    return generate_quiz_prompt(name, variant, count)
+
+
+class _Collector:
+    """Gathers finished generations per topic and saves each topic once it is complete."""
+
+    def __init__(self, counts, topics):
+        self.started = time.perf_counter()
+        self.topics = topics
+        self.pending = dict(counts)
+        self.questions = {name: [] for name in counts}
+        self.errors = {name: [] for name in counts}
+        self.retry_after = {}
+        self.saved = 0
+        self.failed = 0
+
+    def add(self, job, questions=None, error=None):
+        """Record one generation; returns the topic name when its last generation is in."""
+        name = job[0]
+        if error is not None:
+            logger.warning(f"Batch quiz generation for {name} failed: {error}")
+            self.errors[name].append(str(error))
+            if isinstance(error, UpstreamBusy):
+                self.retry_after[name] = max(self.retry_after.get(name, 0), error.retry_after)
+        else:
+            self.questions[name].append(questions)
+        self.pending[name] -= 1
+        return name if self.pending[name] == 0 else None
+
+    def save(self, name):
+        """Persist a completed topic and build its result record."""
+        quizzes = []
+        if self.questions[name]:
+            quizzes = create_quizzes(self.topics[name], self.questions[name], served_at=timezone.now())
+        self.saved += len(quizzes)
+        errors = self.errors[name]
+        status = "error" if not quizzes else ("partial" if errors else "ok")
+        self.failed += status == "error"
+        result = {
+            "topic": name,
+            "status": status,
+            "quizzes": [{"quiz_id": quiz.pk, "quiz": quiz.questions} for quiz in quizzes],
+            "elapsed_ms": self.elapsed_ms(),
+        }
+        if errors:
+            result["errors"] = errors
+        if name in self.retry_after:
+            result["retry_after"] = self.retry_after[name]
+        return result
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def summary(self):
+        return {
+            "done": True,
+            "topics": len(self.pending),
+            "quizzes": self.saved,
+            "failed_topics": self.failed,
+            "elapsed_ms": self.elapsed_ms(),
+        }
+
+
+def _generate(job):
+    try:
+        return parse_quiz_response(call_openrouter(_prompt(job), endpoint="quiz", topic=job[0]))
+    finally:
+        close_old_connections()
+
+
+def run_batch(counts):
+    """
+    Generate quizzes for ``{topic name: count}``; yields one result per
+    topic as it completes, then a summary.
+    """
+    collector = _Collector(counts, _topics(list(counts)))
+    jobs = _jobs(counts)
+    executor = ThreadPoolExecutor(
+        max_workers=min(get_batch_settings()["MAX_CONCURRENCY"], len(jobs)),
+        thread_name_prefix="quiz-batch",
+    )
+    try:
+        # Each job gets its own copy: a context cannot be entered by two threads at once
+        futures = {executor.submit(contextvars.copy_context().run, _generate, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                finished = collector.add(job, questions=future.result())
+            except Exception as e:
+                finished = collector.add(job, error=e)
+            if finished:
+                yield collector.save(finished)
+    finally:
+        # A client that goes away stops the generations not yet started
+        executor.shutdown(wait=False, cancel_futures=True)
+    yield collector.summary()
+
+
+async def arun_batch(counts):
+    """Async counterpart of run_batch for the ASGI view."""
+    collector = _Collector(counts, await sync_to_async(_topics)(list(counts)))
+    semaphore = asyncio.Semaphore(get_batch_settings()["MAX_CONCURRENCY"])
+
+    async def generate(job):
+        async with semaphore:
+            try:
+                result = await acall_openrouter(_prompt(job), endpoint="quiz", topic=job[0])
+                return job, parse_quiz_response(result), None
+            except Exception as e:
+                return job, None, e
+
+    tasks = [asyncio.ensure_future(generate(job)) for job in _jobs(counts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            job, questions, error = await next_done
+            finished = collector.add(job, questions=questions, error=error)
+            if finished:
+                yield await sync_to_async(collector.save)(finished)
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield collector.summary()
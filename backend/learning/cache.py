@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import LLMCacheEntry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SETTINGS = {
+    "MEMORY_MAX_ENTRIES": 256,
+    "DB_MAX_ENTRIES": 5000,
+    "ENDPOINT_TTLS": {},
+}
+
+# How many stores happen between two size/TTL prunes of the durable tier
+PRUNE_EVERY = 50
+
+
+def get_cache_settings():
+    config = dict(DEFAULT_CACHE_SETTINGS)
+    config.update(getattr(settings, "LLM_CACHE", {}))
+    return config
+
+
+def make_cache_key(model, messages, params=None):
+    """
+    Stable hash of everything that determines an upstream completion.
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params or {}},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU with per-entry expiry.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache:
+    """
+    Two-tier cache for OpenRouter responses.
+
+    Lookups hit the in-process LRU first and fall back to the LLMCacheEntry
+    table, so cached completions survive restarts and are shared between
+    worker processes. Only endpoints listed in LLM_CACHE["ENDPOINT_TTLS"]
+    are cached.
+    """
+
+    def __init__(self, config=None):
+        config = config or get_cache_settings()
+        self.endpoint_ttls = dict(config["ENDPOINT_TTLS"])
+        self.db_max_entries = config["DB_MAX_ENTRIES"]
+        self.memory = LRUCache(config["MEMORY_MAX_ENTRIES"])
+        self._lock = threading.Lock()
+        self._stores_since_prune = 0
+        self._counters = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    def _incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def ttl_for(self, endpoint):
+        """Return the TTL in seconds for an endpoint, or None if it is not cached."""
+        if endpoint is None:
+            return None
+        ttl = self.endpoint_ttls.get(endpoint)
+        return ttl if ttl and ttl > 0 else None
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._incr("memory_hits")
+            return value
+
+        try:
+            entry = LLMCacheEntry.objects.filter(
+                key=key, expires_at__gt=timezone.now()
+            ).only("response", "expires_at").first()
+        except DatabaseError as e:
+            logger.warning(f"LLM cache lookup failed: {str(e)}")
+            entry = None
+
+        if entry is None:
+            self._incr("misses")
+            return None
+
+        remaining = (entry.expires_at - timezone.now()).total_seconds()
+        if remaining > 0:
+            self._incr("evictions", self.memory.set(key, entry.response, remaining))
+        self._incr("db_hits")
+        return entry.response
+
+    def set(self, key, value, ttl, model=""):
+        self._incr("evictions", self.memory.set(key, value, ttl))
+        try:
+            LLMCacheEntry.objects.update_or_create(
+                key=key,
+                defaults={
+                    "model": model,
+                    "response": value,
+                    "expires_at": timezone.now() + timedelta(seconds=ttl),
+                },
+            )
+        except DatabaseError as e:
+            logger.warning(f"LLM cache store failed: {str(e)}")
+            return
+
+        self._incr("stores")
+        with self._lock:
+            self._stores_since_prune += 1
+            should_prune = self._stores_since_prune >= PRUNE_EVERY
+            if should_prune:
+                self._stores_since_prune = 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows and trim the durable tier to DB_MAX_ENTRIES."""
+        try:
+            removed, _ = LLMCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+            overflow = LLMCacheEntry.objects.count() - self.db_max_entries
+            if overflow > 0:
+                oldest = LLMCacheEntry.objects.order_by("created_at").values_list("pk", flat=True)[:overflow]
+                extra, _ = LLMCacheEntry.objects.filter(pk__in=list(oldest)).delete()
+                removed += extra
+        except DatabaseError as e:
+            logger.warning(f"LLM cache prune failed: {str(e)}")
+            return 0
+        self._incr("evictions", removed)
+        return removed
+
+    def clear(self):
+        self.memory.clear()
+        LLMCacheEntry.objects.all().delete()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["memory_entries"] = len(self.memory)
+        stats["hit_rate"] = (stats["memory_hits"] + stats["db_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,475 @@
+"""
+Request logic for the LLM-bound endpoints, shared by the sync and async views.
+
+Each flow is a generator: it does its database work, ``yield``s an LLMCall
+whenever it needs a completion, receives the OpenRouter response back, and
+finally returns ``(payload, status)``. run_flow answers the calls with
+call_openrouter; arun_flow answers them with acall_openrouter and runs the
+database steps through sync_to_async, so no thread is held while the model
+is generating.
+
+Flows with independent steps yield a Pipeline instead and receive its
+results, so database work and model calls that do not depend on each
+other overlap (see learning.pipeline).
+
+A call the upstream rate limiter turns away ends the flow with a 503 that
+flow_response sends with Retry-After (see learning.ratelimit).
+"""
+import functools
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .grading import answers_by_index, grade_quiz, question_answer, question_concept, quiz_question_list
+from .llm_json import LLMOutputError, parse_llm_json, response_content
+from .materials import PathPlan
+from .models import LearningPath, Quiz, Topic, UserProgress, UserQuizAttempt
+from .openrouter import acall_openrouter, call_openrouter
+from .pipeline import LLMCall, Pipeline, Step
+from .prompts import (
+    generate_analysis_prompt,
+    generate_final_feedback_prompt,
+    generate_final_quiz_prompt,
+    generate_quiz_prompt,
+)
+from .questions import create_quiz
+from .quiz_pool import QuizGenerationError, get_pool_settings, parse_quiz_response, pop_quiz, request_refill
+from .ratelimit import UpstreamBusy
+from .stats import record_attempt
+
+logger = logging.getLogger(__name__)
+
+
+def _advance(flow, value=None, error=None):
+    """Resume a flow; returns ``(done, next_call_or_result)``."""
+    try:
+        return False, (flow.throw(error) if error is not None else flow.send(value))
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def _busy(flow, error):
+    flow.close()
+    return {"error": str(error), "retry_after": error.retry_after}, 503
+
+
+def flow_response(payload, status):
+    """The JsonResponse for a flow's result."""
+    response = JsonResponse(payload, status=status, safe=False)
+    if status == 503 and isinstance(payload, dict) and "retry_after" in payload:
+        response["Retry-After"] = str(payload["retry_after"])
+    return response
+
+
+def run_flow(flow, stretch=None):
+    """
+    Drive a flow to completion in the calling thread.
+
+    ``stretch``, if given, is called with a function that runs the flow's
+    database work up to its next call (or its result) and returns that
+    ``(done, next_call_or_result)``; background jobs use it to run each
+    stretch in a transaction (see learning.jobs).
+    """
+    value, error = None, None
+    while True:
+        if stretch is None:
+            done, call = _advance(flow, value, error)
+        else:
+            done, call = stretch(functools.partial(_advance, flow, value, error))
+        if done:
+            return call
+        value, error = None, None
+        try:
+            if isinstance(call, Pipeline):
+                value = call.run()
+            else:
+                value = call_openrouter(call.prompt, endpoint=call.endpoint, topic=call.topic)
+        except UpstreamBusy as e:
+            return _busy(flow, e)
+        except Exception as e:
+            error = e
+
+
+async def arun_flow(flow):
+    """Drive a flow from a coroutine, awaiting the model instead of blocking on it."""
+    value, error = None, None
+    while True:
+        done, call = await sync_to_async(_advance)(flow, value, error)
+        if done:
+            return call
+        value, error = None, None
+        try:
+            if isinstance(call, Pipeline):
+                value = await call.arun()
+            else:
+                value = await acall_openrouter(call.prompt, endpoint=call.endpoint, topic=call.topic)
+        except UpstreamBusy as e:
+            return _busy(flow, e)
+        except Exception as e:
+            error = e
+
+
+def _enrichment_call(quiz_questions, user_answers, topic=None):
+    """
+    The LLMCall asking the model to review the locally graded answers.
+
+    Returns None unless settings.LLM_ANALYSIS_ENRICHMENT is set.
+    """
+    if not getattr(settings, "LLM_ANALYSIS_ENRICHMENT", False):
+        return None
+
+    questions = [
+        {
+            "question": q.get("question", ""),
+            "concept": question_concept(q),
+            "answer": question_answer(q)
+        }
+        for q in quiz_question_list(quiz_questions)
+    ]
+    answers = answers_by_index(user_answers, len(questions))
+    return LLMCall(generate_analysis_prompt(questions, answers), "analysis", topic)
+
+
+def _merge_enrichment(result, weak_concepts):
+    """
+    Append the concepts the model added to the local result.
+
+    A missing or unparseable reply falls back to the local result.
+    """
+    if result is None:
+        return weak_concepts
+    try:
+        llm_weak = parse_llm_json(result, "analysis")
+    except LLMOutputError as e:
+        logger.warning(f"LLM analysis enrichment failed: {str(e)}")
+        return weak_concepts
+
+    return weak_concepts + [c for c in llm_weak if isinstance(c, str) and c not in weak_concepts]
+
+
+def _enrich_weak_concepts(quiz_questions, user_answers, weak_concepts, topic=None):
+    """Optionally ask the model to review the locally graded answers."""
+    call = _enrichment_call(quiz_questions, user_answers, topic)
+    if call is None:
+        return weak_concepts
+    try:
+        result = yield call
+    except Exception as e:
+        logger.warning(f"LLM analysis enrichment failed: {str(e)}")
+        return weak_concepts
+    return _merge_enrichment(result, weak_concepts)
+
+
+def generate_quiz(topic_name):
+    topic, _ = Topic.objects.get_or_create(name=topic_name)
+
+    if get_pool_settings()["ENABLED"]:
+        quiz = pop_quiz(topic)
+        request_refill()
+        if quiz is not None:
+            return {
+                "quiz": quiz.questions,
+                "quiz_id": quiz.id
+            }, 200
+
+    try:
+        result = yield LLMCall(generate_quiz_prompt(topic_name), "quiz", topic_name)
+    except Exception as e:
+        return {"error": f"API call failed: {str(e)}"}, 500
+
+    try:
+        quiz_data = parse_quiz_response(result)
+    except QuizGenerationError as e:
+        return {"error": f"Invalid API response or JSON parsing error: {str(e)}", "response": e.response}, 500
+
+    quiz = create_quiz(
+        topic,
+        quiz_data,
+        served_at=timezone.now()
+    )
+
+    return {
+        "quiz": quiz_data,
+        "quiz_id": quiz.id
+    }, 200
+
+
+def analyze_quiz(data):
+    quiz_id = data.get("quiz_id")
+    user_answers = data.get("user_answers", [])
+
+    # Get the existing quiz
+    quiz = Quiz.objects.select_related("topic").get(id=quiz_id)
+    questions = quiz.questions
+
+    # Grade locally; the stored quiz already holds the correct answers
+    grade = grade_quiz(questions, user_answers)
+    all_concepts = grade["all_concepts"]
+    weak_concepts = yield from _enrich_weak_concepts(questions, user_answers, grade["weak_concepts"], quiz.topic.name)
+
+    # Save the quiz attempt using the existing quiz
+    with transaction.atomic():
+        quiz_attempt = UserQuizAttempt.objects.create(
+            quiz=quiz,
+            user_answers=user_answers,
+            score=grade["score"],
+            weak_concepts=weak_concepts,
+            all_concepts=all_concepts  # Store all concepts
+        )
+        record_attempt(quiz.topic_id, grade, weak_concepts)
+
+    # Create or update progress
+    progress, _ = UserProgress.objects.get_or_create(
+        topic=quiz.topic,
+        defaults={'initial_quiz_attempt': quiz_attempt}
+    )
+
+    return {
+        "weak_concepts": weak_concepts,
+        "all_concepts": all_concepts,  # Return all concepts
+        "score": grade["score"],
+        "quiz_attempt_id": quiz_attempt.id
+    }, 200
+
+
+def parse_learning_path(raw):
+    """Parse a learning-path reply, tolerating the usual model formatting slips."""
+    return parse_llm_json(raw, "learning_path")
+
+
+def save_learning_path(quiz_attempt, weak_concepts, all_concepts, learning_path_data, progress=None):
+    """Persist a generated learning path and attach it to the topic's progress."""
+    learning_path = LearningPath.objects.create(
+        weak_concepts=weak_concepts,
+        all_concepts=all_concepts,  # Store all concepts
+        learning_materials=learning_path_data
+    )
+
+    # Update progress
+    if progress is None:
+        progress = UserProgress.objects.get(
+            topic_id=quiz_attempt.quiz.topic_id
+        )
+    progress.learning_path = learning_path
+    progress.save()
+    return learning_path
+
+
+def learning_path(data):
+    quiz_attempt_id = data.get("quiz_attempt_id")
+    weak_concepts = data.get("weak_concepts", [])
+    all_concepts = data.get("all_concepts", [])  # Get all concepts
+
+    # Learning path covering all concepts but emphasizing weak ones; the model
+    # only writes material for concepts missing from the material store
+    plan = PathPlan(weak_concepts, all_concepts)
+
+    def learning_path_call(plan, quiz_attempt):
+        prompt = plan.prompt()
+        return LLMCall(prompt, "learning_path", quiz_attempt.quiz.topic.name) if prompt else None
+
+    # The attempt and its progress load while the model works
+    steps = yield Pipeline("learning_path", [
+        Step("quiz_attempt", lambda: UserQuizAttempt.objects.select_related("quiz__topic").get(id=quiz_attempt_id)),
+        Step("progress", lambda: UserProgress.objects.get(topic__quiz__userquizattempt=quiz_attempt_id)),
+        Step("plan", plan.load),
+        Step("result", learning_path_call, after=("plan", "quiz_attempt")),
+    ])
+
+    fresh = {}
+    result = steps["result"]
+    if result is not None:
+        try:
+            raw = response_content(result)
+        except LLMOutputError as e:
+            return {"error": f"Learning path generation failed: {str(e)}"}, 500
+        try:
+            fresh = plan.save(parse_learning_path(raw))
+        except LLMOutputError as e:
+            return {
+                "error": f"Invalid JSON in learning path response: {str(e)}",
+                "raw_response": raw
+            }, 500
+
+    learning_path_data = plan.assemble(fresh)
+    learning_path = save_learning_path(
+        steps["quiz_attempt"], weak_concepts, all_concepts, learning_path_data, progress=steps["progress"]
+    )
+
+    return {
+        "learning_path": learning_path_data,
+        "learning_path_id": learning_path.id
+    }, 200
+
+
+def start_learning_path_stream(data):
+    """
+    Load the attempt and stored material for the streaming learning-path endpoint.
+
+    ``prompt`` covers only the concepts without stored material and is None
+    when there are none.
+    """
+    weak_concepts = data.get("weak_concepts", [])
+    all_concepts = data.get("all_concepts", [])
+    plan = PathPlan(weak_concepts, all_concepts).load()
+    quiz_attempt = UserQuizAttempt.objects.select_related("quiz__topic").get(id=data.get("quiz_attempt_id"))
+    return {
+        "quiz_attempt": quiz_attempt,
+        "topic": quiz_attempt.quiz.topic.name,
+        "weak_concepts": weak_concepts,
+        "all_concepts": all_concepts,
+        "plan": plan,
+        "stored": plan.stored_entries(),
+        "prompt": plan.prompt(),
+    }
+
+
+def finish_learning_path_stream(stream, concepts):
+    """Persist the streamed concepts and the assembled path; returns the final event payload."""
+    plan = stream["plan"]
+    learning_path_data = plan.assemble(plan.save(concepts))
+    learning_path = save_learning_path(
+        stream["quiz_attempt"], stream["weak_concepts"], stream["all_concepts"], learning_path_data
+    )
+    return {"learning_path_id": learning_path.id, "concepts": len(learning_path_data)}
+
+
+def final_quiz(data):
+    topic_name = data.get("topic", "Graphs")
+    weak_concepts = data.get("weak_concepts", [])
+
+    def final_quiz_call(progress):
+        # Generate a more focused final quiz
+        initial_attempt = progress.initial_quiz_attempt
+        return LLMCall(generate_final_quiz_prompt(
+            topic_name,
+            weak_concepts,
+            initial_attempt.weak_concepts if initial_attempt else []
+        ), "final_quiz", topic_name)
+
+    # The topic is only needed to save the quiz, so it loads alongside the
+    # progress (and the initial quiz attempt to compare with) and the model call
+    steps = yield Pipeline("final_quiz", [
+        Step("topic", lambda: Topic.objects.get(name=topic_name)),
+        Step("progress", lambda: UserProgress.objects.select_related("initial_quiz_attempt").get(topic__name=topic_name)),
+        Step("result", final_quiz_call, after=("progress",)),
+    ])
+    topic, result = steps["topic"], steps["result"]
+    initial_attempt = steps["progress"].initial_quiz_attempt
+
+    try:
+        quiz_data = parse_llm_json(result, "final_quiz")
+
+        # Save the final quiz
+        quiz = create_quiz(
+            topic,
+            quiz_data,
+            is_final_quiz=True,
+            served_at=timezone.now()
+        )
+
+        return {
+            "quiz": quiz_data,
+            "quiz_id": quiz.id,
+            "initial_weak_concepts": initial_attempt.weak_concepts if initial_attempt else []
+        }, 200
+
+    except Exception as inner:
+        return {"error": str(inner), "response": result}, 200
+
+
+def _improvement_metrics(initial_attempt, final_weak_concepts):
+    """Compare the final weak concepts with those of the initial attempt."""
+    initial_weak = set(initial_attempt.weak_concepts) if initial_attempt else set()
+    final_weak = set(final_weak_concepts)
+
+    improved_concepts = initial_weak - final_weak
+    still_weak_concepts = initial_weak.intersection(final_weak)
+    new_weak_concepts = final_weak - initial_weak
+
+    # Calculate overall improvement percentage
+    total_concepts = len(initial_weak.union(final_weak))
+    improvement_percentage = (len(improved_concepts) / total_concepts * 100) if total_concepts > 0 else 0
+
+    return {
+        "initial_weak": initial_weak,
+        "final_weak": final_weak,
+        "improved_concepts": improved_concepts,
+        "still_weak_concepts": still_weak_concepts,
+        "new_weak_concepts": new_weak_concepts,
+        "improvement_percentage": improvement_percentage,
+    }
+
+
+def _final_feedback_call(metrics, quiz):
+    # Generate reinforcement feedback
+    return LLMCall(generate_final_feedback_prompt(metrics), "final_feedback", quiz.topic.name)
+
+
+def submit_final_quiz(data):
+    quiz_id = data.get("quiz_id")
+    user_answers = data.get("user_answers")
+
+    if not quiz_id:
+        return {"error": "Quiz ID is required"}, 400
+
+    user_answers = user_answers if user_answers else []  # Ensure we always have a valid value
+
+    # Grading, enrichment and the progress lookup only need the quiz (or
+    # nothing). Enrichment is optional: if it fails, the local grade stands.
+    steps = yield Pipeline("submit_final_quiz", [
+        Step("quiz", lambda: Quiz.objects.select_related("topic").get(id=quiz_id)),
+        Step("progress", lambda: UserProgress.objects.select_related("initial_quiz_attempt").get(topic__quiz=quiz_id)),
+        Step("grade", lambda quiz: grade_quiz(quiz.questions, user_answers), after=("quiz",)),
+        Step("enrichment", lambda quiz: _enrichment_call(quiz.questions, user_answers, quiz.topic.name),
+             after=("quiz",), optional=True),
+        Step("final_weak_concepts", lambda grade, enrichment: _merge_enrichment(enrichment, grade["weak_concepts"]),
+             after=("grade", "enrichment")),
+        Step("metrics", lambda progress, final_weak_concepts: _improvement_metrics(
+            progress.initial_quiz_attempt, final_weak_concepts
+        ), after=("progress", "final_weak_concepts")),
+        Step("feedback", _final_feedback_call, after=("metrics", "quiz")),
+    ])
+    quiz, progress, grade = steps["quiz"], steps["progress"], steps["grade"]
+    final_weak_concepts, metrics = steps["final_weak_concepts"], steps["metrics"]
+
+    # Saved from the flow rather than a pipeline step, so the writes happen on
+    # the request's own connection once the model calls are done
+    with transaction.atomic():
+        quiz_attempt = UserQuizAttempt.objects.create(
+            quiz=quiz,
+            user_answers=user_answers,
+            score=grade["score"],
+            weak_concepts=final_weak_concepts,
+            all_concepts=grade["all_concepts"]
+        )
+        record_attempt(quiz.topic_id, grade, final_weak_concepts)
+
+    # Update progress
+    progress.final_quiz_attempt = quiz_attempt
+    progress.progress_percentage = metrics["improvement_percentage"]
+    progress.save()
+
+    try:
+        feedback = response_content(steps["feedback"])
+    except LLMOutputError as e:
+        # The attempt is saved either way; report it without the feedback
+        logger.warning(f"Final feedback generation failed: {str(e)}")
+        feedback = None
+
+    return {
+        "message": "Final quiz submitted successfully",
+        "quiz_attempt_id": quiz_attempt.id,
+        "score": grade["score"],
+        "improvement_metrics": {
+            "improvement_percentage": metrics["improvement_percentage"],
+            "improved_concepts": list(metrics["improved_concepts"]),
+            "still_weak_concepts": list(metrics["still_weak_concepts"]),
+            "new_weak_concepts": list(metrics["new_weak_concepts"])
+        },
+        "detailed_feedback": feedback
+    }, 200
@@ -0,0 +1,143 @@
+import re
+
+# A lone option letter ("B", "(B)", "B)", "B.") or one followed by ")" or "."
+# and whitespace ("B) Binary Search"); "B-tree" or "A star" is answer text
+OPTION_PATTERN = re.compile(r"^\(?([A-Da-d])(?:[).]?|[).]\s+(.*))$", re.DOTALL)
+
+
+def _option_text(option):
+    """Strip the "B) " style prefix from an option."""
+    match = OPTION_PATTERN.match(str(option).strip())
+    if match and match.group(2) is not None:
+        return match.group(2).strip()
+    return str(option).strip()
+
+
+def normalize_option(value, options=None):
+    """
+    Reduce an answer to its option letter.
+
+    Accepts "B", "b", "B)", "B.", "(B)", "B) Binary Search", "(B) ..." and
+    "B. ...". Anything else ("Binary Search", "B-tree") is option text and is
+    matched against ``options``. Returns None if the answer cannot be
+    resolved to a letter.
+    """
+    if isinstance(value, dict):
+        value = value.get("answer")
+    if value is None:
+        return None
+
+    text = str(value).strip()
+    match = OPTION_PATTERN.match(text)
+    if match:
+        return match.group(1).upper()
+
+    for index, option in enumerate(options or []):
+        if _option_text(option).casefold() == text.casefold():
+            return "ABCD"[index] if index < 4 else None
+    return None
+
+
+def quiz_question_list(quiz_questions):
+    """Final quizzes wrap their questions in an object; diagnostic quizzes are a bare list."""
+    if isinstance(quiz_questions, dict):
+        return quiz_questions.get("questions") or []
+    return quiz_questions or []
+
+
+def question_concept(question):
+    return question.get("concept") or question.get("concept_tested") or "General"
+
+
+def question_answer(question):
+    return question.get("answer", question.get("correct_answer"))
+
+
+def answers_by_index(user_answers, count):
+    """
+    Align submitted answers with question positions.
+
+    The frontend sends either a list of answers, a list of
+    {"question_id": ..., "answer": ...} objects, or a {"0": answer} mapping.
+    """
+    aligned = [None] * count
+    if isinstance(user_answers, dict):
+        entries = user_answers.items()
+    else:
+        entries = []
+        for index, answer in enumerate(user_answers or []):
+            if isinstance(answer, dict) and "question_id" in answer:
+                entries.append((answer["question_id"], answer.get("answer")))
+            else:
+                entries.append((index, answer))
+
+    for key, answer in entries:
+        try:
+            position = int(key)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= position < count:
+            aligned[position] = answer
+    return aligned
+
+
+def is_answered(answer):
+    if isinstance(answer, dict):
+        answer = answer.get("answer")
+    return answer is not None and str(answer).strip() != ""
+
+
+def is_correct(question, answer):
+    if not is_answered(answer):
+        return False
+    options = question.get("options") or []
+    expected = question_answer(question)
+    expected_letter = normalize_option(expected, options)
+    given_letter = normalize_option(answer, options)
+    if expected_letter and given_letter:
+        return expected_letter == given_letter
+
+    given = answer.get("answer") if isinstance(answer, dict) else answer
+    return _option_text(given).casefold() == _option_text(expected).casefold()
+
+
+def grade_quiz(quiz_questions, user_answers):
+    """
+    Grade a stored quiz locally, without calling the model.
+
+    Returns a dict with the percentage ``score``, ``correct``/``total``
+    counts, ``per_concept`` correctness, per-question ``results`` and the
+    ``weak_concepts``/``all_concepts`` lists (in quiz order). Unanswered
+    questions score nothing, but only a wrong answer makes a concept weak.
+    """
+    questions = quiz_question_list(quiz_questions)
+    answers = answers_by_index(user_answers, len(questions))
+
+    per_concept = {}
+    results = []
+    for question, answer in zip(questions, answers):
+        concept = question_concept(question)
+        answered = is_answered(answer)
+        correct = is_correct(question, answer)
+        stats = per_concept.setdefault(concept, {"correct": 0, "answered": 0, "total": 0})
+        stats["total"] += 1
+        stats["answered"] += int(answered)
+        stats["correct"] += int(correct)
+        results.append({
+            "concept": concept,
+            "difficulty": question.get("difficulty"),
+            "answer": answer,
+            "answered": answered,
+            "correct": correct,
+        })
+
+    correct_count = sum(1 for result in results if result["correct"])
+    return {
+        "score": (correct_count / len(results) * 100) if results else 0.0,
+        "correct": correct_count,
+        "total": len(results),
+        "per_concept": per_concept,
+        "results": results,
+        "weak_concepts": [c for c, stats in per_concept.items() if stats["correct"] < stats["answered"]],
+        "all_concepts": list(per_concept),
+    }
@@ -0,0 +1,356 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import observe_upstream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIENT_SETTINGS = {
+    "BASE_URL": "https://openrouter.ai/api/v1",
+    "CONNECT_TIMEOUT": 5,
+    "READ_TIMEOUT": 120,
+    "MAX_RETRIES": 2,
+    "BACKOFF_BASE": 0.5,
+    "BACKOFF_MAX": 8,
+    "POOL_MAXSIZE": 20,
+    "ASYNC_MAX_CONNECTIONS": 500,
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class StreamError(Exception):
+    """Raised when OpenRouter reports an error inside a streamed completion."""
+
+
+def parse_sse_line(line, usage=None):
+    """
+    Decode one server-sent-events line of a streamed completion.
+
+    Returns the content delta (possibly ""), or None once the stream is done.
+    Comment lines (OpenRouter sends ": OPENROUTER PROCESSING" keep-alives)
+    and blank lines yield "". If ``usage`` is a dict, the token usage that
+    OpenRouter sends in the final chunk is copied into it.
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    if not line.startswith("data:"):
+        return ""
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None
+    chunk = json.loads(data)
+    if chunk.get("error"):
+        raise StreamError(str(chunk["error"]))
+    if usage is not None and chunk.get("usage"):
+        usage.update(chunk["usage"])
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+def get_client_settings():
+    config = dict(DEFAULT_CLIENT_SETTINGS)
+    config.update(getattr(settings, "OPENROUTER", {}))
+    return config
+
+
+class BaseOpenRouterClient:
+    """
+    Timeout, retry and bookkeeping policy shared by the sync and async clients.
+
+    requests and httpx are imported when the first client is built rather
+    than at module import: they are a large share of process start-up, and
+    most management commands and test runs never call OpenRouter.
+    """
+
+    def __init__(self, base_url, connect_timeout, read_timeout, max_retries,
+                 backoff_base, backoff_max, pool_maxsize, api_key=None):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_maxsize = pool_maxsize
+        self.api_key = api_key
+        self.recent_attempts = deque(maxlen=200)
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        config = get_client_settings()
+        kwargs = {
+            "base_url": config["BASE_URL"],
+            "connect_timeout": config["CONNECT_TIMEOUT"],
+            "read_timeout": config["READ_TIMEOUT"],
+            "max_retries": config["MAX_RETRIES"],
+            "backoff_base": config["BACKOFF_BASE"],
+            "backoff_max": config["BACKOFF_MAX"],
+            "pool_maxsize": config["POOL_MAXSIZE"],
+        }
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
+    @property
+    def chat_url(self):
+        return f"{self.base_url}/chat/completions"
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key or os.getenv('OPENROUTER_API_KEY')}",
+            "HTTP-Referer": "http://localhost:8000",
+            "X-Title": "SALS Assistant",
+        }
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, attempts, record, model):
+        if attempts is not None:
+            attempts.append(record)
+        self.recent_attempts.append(record)
+        observe_upstream(model, record)
+
+
+class OpenRouterClient(BaseOpenRouterClient):
+    """
+    Shared, keep-alive client for the OpenRouter chat-completions endpoint.
+
+    One requests.Session backs every call, so connections (and their TLS
+    sessions) are pooled across requests and threads. Calls are bounded by
+    connect/read timeouts and retried with jittered exponential backoff on
+    429, 5xx and connection failures.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.transport_errors = (requests.ConnectionError, requests.Timeout)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def chat_completion(self, payload):
+        """
+        POST a chat-completions payload.
+
+        Returns ``(response_json, attempts)`` where ``attempts`` lists the
+        status, latency and error of every try. The last upstream reply is
+        returned even if it is still an error after all retries; connection
+        failures on the final try are raised.
+        """
+        attempts = []
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            record = {"attempt": attempt + 1, "status": None, "latency": None, "error": None}
+            try:
+                res = self.session.post(self.chat_url, json=payload, headers=self._headers(), timeout=self.timeout)
+            except self.transport_errors as e:
+                record["latency"] = time.perf_counter() - started
+                record["error"] = str(e)
+                self._record(attempts, record, payload.get("model"))
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+
+            record["latency"] = time.perf_counter() - started
+            record["status"] = res.status_code
+            self._record(attempts, record, payload.get("model"))
+            if res.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._backoff(attempt, res.headers.get("Retry-After"))
+                logger.warning(f"OpenRouter returned {res.status_code}, retrying in {delay:.2f}s")
+                res.close()
+                time.sleep(delay)
+                continue
+            return res.json(), attempts
+
+    def stream_chat_completion(self, payload, usage=None):
+        """
+        POST a payload with ``stream: true`` and yield content deltas as they arrive.
+
+        Retries apply only until the upstream starts answering; once the first
+        byte has been streamed to the caller a failure is raised. The token
+        usage reported at the end of the stream is copied into ``usage``.
+        """
+        payload = dict(payload, stream=True)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            record = {"attempt": attempt + 1, "status": None, "latency": None, "error": None}
+            try:
+                res = self.session.post(self.chat_url, json=payload, headers=self._headers(),
+                                        timeout=self.timeout, stream=True)
+            except self.transport_errors as e:
+                record["latency"] = time.perf_counter() - started
+                record["error"] = str(e)
+                self._record(None, record, payload.get("model"))
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+
+            record["latency"] = time.perf_counter() - started
+            record["status"] = res.status_code
+            self._record(None, record, payload.get("model"))
+            if res.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                res.close()
+                time.sleep(self._backoff(attempt, res.headers.get("Retry-After")))
+                continue
+            if res.status_code != 200:
+                raise StreamError(f"OpenRouter returned {res.status_code}: {res.text[:200]}")
+            break
+
+        with res:
+            for line in res.iter_lines():
+                delta = parse_sse_line(line, usage)
+                if delta is None:
+                    return
+                if delta:
+                    yield delta
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncOpenRouterClient(BaseOpenRouterClient):
+    """
+    httpx-based counterpart of OpenRouterClient for the async views.
+
+    Connections are pooled per event loop; the pool is sized by
+    ASYNC_MAX_CONNECTIONS because one process keeps many generations in
+    flight at once.
+    """
+
+    def __init__(self, *args, max_connections=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        import httpx
+
+        self.transport_errors = httpx.TransportError
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections or self.pool_maxsize,
+                max_keepalive_connections=max_connections or self.pool_maxsize,
+            ),
+        )
+
+    async def chat_completion(self, payload):
+        """Async version of OpenRouterClient.chat_completion with the same return value."""
+        attempts = []
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            record = {"attempt": attempt + 1, "status": None, "latency": None, "error": None}
+            try:
+                res = await self.client.post(self.chat_url, json=payload, headers=self._headers())
+            except self.transport_errors as e:
+                record["latency"] = time.perf_counter() - started
+                record["error"] = str(e)
+                self._record(attempts, record, payload.get("model"))
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            record["latency"] = time.perf_counter() - started
+            record["status"] = res.status_code
+            self._record(attempts, record, payload.get("model"))
+            if res.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._backoff(attempt, res.headers.get("Retry-After"))
+                logger.warning(f"OpenRouter returned {res.status_code}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            return res.json(), attempts
+
+    async def stream_chat_completion(self, payload, usage=None):
+        """Async version of OpenRouterClient.stream_chat_completion."""
+        payload = dict(payload, stream=True)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            record = {"attempt": attempt + 1, "status": None, "latency": None, "error": None}
+            request = self.client.build_request("POST", self.chat_url, json=payload, headers=self._headers())
+            try:
+                res = await self.client.send(request, stream=True)
+            except self.transport_errors as e:
+                record["latency"] = time.perf_counter() - started
+                record["error"] = str(e)
+                self._record(None, record, payload.get("model"))
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            record["latency"] = time.perf_counter() - started
+            record["status"] = res.status_code
+            self._record(None, record, payload.get("model"))
+            if res.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                await res.aclose()
+                await asyncio.sleep(self._backoff(attempt, res.headers.get("Retry-After")))
+                continue
+            if res.status_code != 200:
+                body = await res.aread()
+                await res.aclose()
+                raise StreamError(f"OpenRouter returned {res.status_code}: {body[:200]!r}")
+            break
+
+        try:
+            async for line in res.aiter_lines():
+                delta = parse_sse_line(line, usage)
+                if delta is None:
+                    return
+                if delta:
+                    yield delta
+        finally:
+            await res.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide OpenRouterClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenRouterClient.from_settings()
+    return _client
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the AsyncOpenRouterClient for the running event loop.
+
+    httpx connections belong to the loop that opened them, so each loop
+    (one per process under ASGI) gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncOpenRouterClient.from_settings(
+            max_connections=get_client_settings()["ASYNC_MAX_CONNECTIONS"]
+        )
+    return client
@@ -0,0 +1,314 @@
+"""
+Background jobs for the LLM-bound flows.
+
+With ``?async=1`` (or a ``Prefer: respond-async`` header), the LLM-bound
+views do not hold the connection open while the model writes. They store
+an LLMJob and answer 202 with its id, and clients poll /api/jobs/<id>/ for
+the result. Jobs are run by ``manage.py run_llm_jobs`` workers (threads,
+optionally in several processes). Generation capacity therefore scales
+apart from the web workers.
+
+A worker claims a job with a single UPDATE ... RETURNING (like
+quiz_pool.pop_quiz). The claim takes the due pending job with the earliest
+``available_at`` and pushes ``available_at`` out by VISIBILITY_TIMEOUT.
+While the job runs, a lease thread pushes ``available_at`` out again every
+third of that timeout, so a slow job (model calls can take minutes with
+retries and failover) is never claimed twice; if a worker dies mid-job,
+another worker claims the job once the lease runs out.
+
+Each stretch of the flow's database work between model calls runs in a
+transaction that first confirms, and renews, this worker's claim, and the
+stretch that ends the flow records the job's result in that transaction.
+The rows a flow creates therefore commit exactly once, together with its
+result: a worker that lost its claim stops before writing anything, and a
+flow that raises or returns a 5xx status keeps nothing from that attempt
+and is retried with exponential backoff until MAX_ATTEMPTS. New jobs are refused with a 503 once about
+MAX_DEPTH jobs are pending.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from . import flows
+from .flows import run_flow
+from .models import LLMJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_SETTINGS = {
+    "ENABLED": True,
+    "MAX_DEPTH": 1000,
+    "MAX_ATTEMPTS": 3,
+    "VISIBILITY_TIMEOUT": 300,
+    "RETRY_BACKOFF": 5,
+    "POLL_INTERVAL": 1.0,
+    "THREADS": 4,
+    "KEEP_FINISHED": 7 * 24 * 60 * 60,
+    "QUEUE_FULL_RETRY_AFTER": 30,
+}
+
+PENDING = ("queued", "running")
+
+# Job kind -> flow, called with the job's payload
+JOB_FLOWS = {
+    "generate_quiz": lambda payload: flows.generate_quiz(payload.get("topic", "Graphs")),
+    "analyze_quiz": flows.analyze_quiz,
+    "learning_path": flows.learning_path,
+    "final_quiz": flows.final_quiz,
+    "submit_final_quiz": flows.submit_final_quiz,
+}
+
+
+class QueueFull(Exception):
+    """Raised when MAX_DEPTH jobs are already pending."""
+
+
+class LostClaim(Exception):
+    """Raised when another worker has claimed a running job since this worker did."""
+
+
+def get_job_settings():
+    config = dict(DEFAULT_JOB_SETTINGS)
+    config.update(getattr(settings, "LLM_JOBS", {}))
+    return config
+
+
+def wants_job(request):
+    """Whether the client asked for the request to run as a background job."""
+    if not get_job_settings()["ENABLED"]:
+        return False
+    return request.GET.get("async") == "1" or "respond-async" in request.headers.get("Prefer", "")
+
+
+def enqueue_job(kind, payload):
+    """Store a job for the workers; raises QueueFull when too many are pending."""
+    if kind not in JOB_FLOWS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    # Counted before inserting, so concurrent requests can overshoot MAX_DEPTH slightly
+    if LLMJob.objects.filter(status__in=PENDING).count() >= get_job_settings()["MAX_DEPTH"]:
+        raise QueueFull("The job queue is full")
+    return LLMJob.objects.create(kind=kind, payload=payload, available_at=timezone.now())
+
+
+def job_url(job):
+    return f"/api/jobs/{job.id}/"
+
+
+def enqueue_response(kind, payload):
+    """202 pointing at the new job, or 503 with Retry-After when the queue is full."""
+    try:
+        job = enqueue_job(kind, payload)
+    except QueueFull as e:
+        response = JsonResponse({"error": str(e)}, status=503)
+        response["Retry-After"] = str(get_job_settings()["QUEUE_FULL_RETRY_AFTER"])
+        return response
+    response = JsonResponse({"job_id": job.id, "status": job.status, "url": job_url(job)}, status=202)
+    response["Location"] = job_url(job)
+    return response
+
+
+def job_state(job):
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "result": job.result,
+        "result_status": job.result_status,
+        "error": job.error,
+    }
+
+
+def claim_job(worker):
+    """
+    Claim the next due job in a single query.
+
+    Returns None when no job is due.
+    """
+    config = get_job_settings()
+    now = timezone.now()
+    adapt = connection.ops.adapt_datetimefield_value
+    table = LLMJob._meta.db_table
+    skip_locked = " FOR UPDATE SKIP LOCKED" if connection.vendor == "postgresql" else ""
+    due = "status IN ('queued', 'running') AND available_at <= %s"
+    sql = (
+        f"UPDATE {table} SET status = 'running', attempts = attempts + 1, available_at = %s, worker = %s "
+        f"WHERE id = (SELECT id FROM {table} WHERE {due} "
+        f"ORDER BY available_at, id LIMIT 1{skip_locked}) "
+        f"AND {due} "
+        f"RETURNING id, kind, payload, status, attempts, available_at, worker, result, result_status, error, "
+        f"created_at, finished_at"
+    )
+    params = [adapt(now + timedelta(seconds=config["VISIBILITY_TIMEOUT"])), worker, adapt(now), adapt(now)]
+    return next(iter(LLMJob.objects.raw(sql, params)), None)
+
+
+def _update_claimed(job, **fields):
+    """Update a job only while this claim still holds it; returns whether it did."""
+    return LLMJob.objects.filter(
+        id=job.id, status="running", worker=job.worker, attempts=job.attempts
+    ).update(**fields) == 1
+
+
+def _renew_claim(job):
+    """Push a claimed job's available_at out by VISIBILITY_TIMEOUT; returns whether the claim still holds."""
+    timeout = get_job_settings()["VISIBILITY_TIMEOUT"]
+    return _update_claimed(job, available_at=timezone.now() + timedelta(seconds=timeout))
+
+
+class LeaseKeeper(threading.Thread):
+    """Renews a running job's claim every third of VISIBILITY_TIMEOUT until stopped."""
+
+    def __init__(self, job):
+        super().__init__(name=f"llm-job-lease-{job.id}", daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        interval = get_job_settings()["VISIBILITY_TIMEOUT"] / 3
+        try:
+            while not self.stopped.wait(interval):
+                try:
+                    if not _renew_claim(self.job):
+                        logger.warning(f"{self.job} was claimed by another worker while running")
+                        return
+                except DatabaseError as e:
+                    logger.warning(f"Renewing the claim on {self.job} failed: {str(e)}")
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.join()
+
+
+def _finish(job, status, result=None, result_status=None, error=""):
+    return _update_claimed(
+        job, status=status, result=result, result_status=result_status, error=error, finished_at=timezone.now()
+    )
+
+
+def _retry_or_fail(job, result=None, result_status=None, error=""):
+    config = get_job_settings()
+    if job.attempts >= config["MAX_ATTEMPTS"]:
+        logger.warning(f"{job} failed after {job.attempts} attempts: {error or result_status}")
+        return _finish(job, "failed", result, result_status, error)
+    delay = config["RETRY_BACKOFF"] * 2 ** (job.attempts - 1)
+    if isinstance(result, dict):
+        # A 503 from the upstream rate limiter says when capacity is back
+        delay = max(delay, result.get("retry_after", 0))
+    logger.info(f"{job} attempt {job.attempts} failed, retrying in {delay}s: {error or result_status}")
+    return _update_claimed(
+        job, status="queued", available_at=timezone.now() + timedelta(seconds=delay),
+        result=result, result_status=result_status, error=error,
+    )
+
+
+def process_job(job):
+    """Run a claimed job's flow and record its outcome."""
+    if job.attempts > get_job_settings()["MAX_ATTEMPTS"]:
+        # The last attempt's worker died without finishing
+        return _finish(job, "failed", error=job.error or "Visibility timeout expired on the last attempt")
+    flow = JOB_FLOWS.get(job.kind)
+    if flow is None:
+        return _finish(job, "failed", error=f"Unknown job kind: {job.kind}")
+
+    def stretch(advance):
+        with transaction.atomic():
+            if not _renew_claim(job):
+                raise LostClaim(f"{job} was claimed by another worker")
+            done, result = advance()
+            if done:
+                payload, status = result
+                if status >= 500:
+                    transaction.set_rollback(True)
+                else:
+                    _finish(job, "done", payload, status)
+            return done, result
+
+    try:
+        with LeaseKeeper(job):
+            payload, status = run_flow(flow(job.payload), stretch)
+    except LostClaim as e:
+        logger.warning(str(e))
+        return False
+    except ObjectDoesNotExist as e:
+        # Retrying cannot make a missing quiz, attempt or topic appear
+        return _finish(job, "failed", {"error": str(e)}, 404, error=str(e))
+    except Exception as e:
+        return _retry_or_fail(job, {"error": str(e)}, 500, error=str(e))
+    if status >= 500:
+        return _retry_or_fail(job, payload, status, error=str(payload.get("error", "")))
+    return True
+
+
+def purge_finished():
+    """Delete finished jobs older than KEEP_FINISHED seconds."""
+    cutoff = timezone.now() - timedelta(seconds=get_job_settings()["KEEP_FINISHED"])
+    deleted, _ = LLMJob.objects.filter(status__in=("done", "failed"), finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def work(stop, poll_interval=None, burst=False):
+    """
+    Claim and run jobs until ``stop`` is set.
+
+    With ``burst`` the loop also ends as soon as no job is due.
+    """
+    poll_interval = poll_interval or get_job_settings()["POLL_INTERVAL"]
+    worker = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"[:100]
+    while not stop.is_set():
+        try:
+            job = claim_job(worker)
+            if job is not None:
+                process_job(job)
+        except Exception as e:
+            logger.exception(f"Job worker {worker} failed: {str(e)}")
+            job = None
+        finally:
+            close_old_connections()
+        if job is None:
+            if burst:
+                return
+            stop.wait(poll_interval)
+
+
+def run_workers(threads, stop, burst=False, purge_interval=3600):
+    """Run ``threads`` worker threads until ``stop`` is set (or, with ``burst``, the queue is drained)."""
+    pool = [
+        threading.Thread(target=work, args=(stop,), kwargs={"burst": burst}, name=f"llm-job-{i}", daemon=True)
+        for i in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    next_purge = 0
+    while True:
+        alive = [thread for thread in pool if thread.is_alive()]
+        if not alive:
+            return
+        if not burst and time.monotonic() >= next_purge:
+            next_purge = time.monotonic() + purge_interval
+            try:
+                deleted = purge_finished()
+                if deleted:
+                    logger.info(f"Purged {deleted} finished jobs")
+            except Exception as e:
+                logger.warning(f"Purging finished jobs failed: {str(e)}")
+            finally:
+                close_old_connections()
+        alive[0].join(1)
@@ -1,31 +1,17 @@
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_community.chat_models import ChatOpenRouter
+"""
+LangChain chains over OpenRouter.
+
+langchain is only imported, and the chat model only built, when the router
+is first used through get_langchain_router(); importing this module is
+cheap.
+"""
 from typing import List, Dict, Any
 import os
-from dotenv import load_dotenv
 import json
+import threading
+from .router import model_router
 
-load_dotenv()
-
-class LangChainOpenRouter:
-    def __init__(self):
-        self.chat = ChatOpenRouter(
-            api_key=os.getenv('OPENROUTER_API_KEY'),
-            model="deepseek/deepseek-r1-0528-qwen3-8b:free",
-            http_referer="http://localhost:8000",
-            x_title="SALS Assistant"
-        )
-        self.output_parser = StrOutputParser()
-
-    def _create_chain(self, template: str):
-        """Create a LangChain chain with the given template."""
-        prompt = ChatPromptTemplate.from_template(template)
-        return prompt | self.chat | self.output_parser
-
-    def generate_quiz(self, topic: str) -> List[Dict[str, Any]]:
-        """Generate a quiz using LangChain while maintaining the same format."""
-        template = """You are an expert DSA instructor.
+QUIZ_TEMPLATE = """You are an expert DSA instructor.
 
 Generate a 10-question diagnostic quiz on the topic: "{topic}".
 Rules:
@@ -45,23 +31,9 @@ Return output in *pure* JSON format (no explanation, no markdown), like:
   }},
   ...
 ]"""
-        chain = self._create_chain(template)
-        result = chain.invoke({"topic": topic})
-        return json.loads(result)
 
-    def analyze_quiz(self, questions: List[Dict[str, Any]], answers: List[str]) -> List[str]:
-        """Analyze quiz responses using LangChain while maintaining the same format."""
-        qa_pairs = json.dumps([
-            {
-                "question": q["question"],
-                "concept": q["concept"],
-                "correct": q["answer"],
-                "user": a
-            }
-            for q, a in zip(questions, answers)
-        ], indent=2)
 
-        template = """You're an AI mentor evaluating a student's quiz answers.
+ANALYSIS_TEMPLATE = """You're an AI mentor evaluating a student's quiz answers.
 
 Each entry below includes:
 - The quiz question
@@ -75,15 +47,9 @@ Return a *deduplicated* JSON list of weak concepts, no markdown, no explanation.
 Example format: ["Binary Search", "Dynamic Programming"]
 Quiz Attempts:
 {qa_pairs}"""
-        
-        chain = self._create_chain(template)
-        result = chain.invoke({"qa_pairs": qa_pairs})
-        return json.loads(result)
 
-    def generate_learning_path(self, weak_concepts: List[str]) -> List[Dict[str, Any]]:
-        """Generate a learning path using LangChain while maintaining the same format."""
-        concept_list = ', '.join(weak_concepts)
-        template = """You are an expert tutor guiding a student through weaknesses in DSA.
+
+LEARNING_PATH_TEMPLATE = """You are an expert tutor guiding a student through weaknesses in DSA.
 
 For each of these concepts: {concept_list}
 Do the following:
@@ -100,14 +66,9 @@ Return as a pure JSON array:
   ...
 ]
 No markdown. No extra text."""
-        
-        chain = self._create_chain(template)
-        result = chain.invoke({"concept_list": concept_list})
-        return json.loads(result)
 
-    def generate_final_quiz(self, topic: str, weak_concepts: List[str], initial_weak_concepts: List[str]) -> Dict[str, Any]:
-        """Generate a final quiz using LangChain while maintaining the same format."""
-        template = """Generate a final assessment quiz for the topic "{topic}" that focuses on reinforcement learning and measuring improvement.
+
+FINAL_QUIZ_TEMPLATE = """Generate a final assessment quiz for the topic "{topic}" that focuses on reinforcement learning and measuring improvement.
     
 The student previously struggled with these concepts: {initial_weak_concepts}
 They have been working on improving these areas: {weak_concepts}
@@ -138,8 +99,66 @@ Format the response as a JSON object with this structure:
 
 Include at least 5 questions, with at least 3 focusing on previously weak concepts.
 Make sure the questions are challenging but fair, and provide clear explanations."""
-        
-        chain = self._create_chain(template)
+
+
+class LangChainOpenRouter:
+    def __init__(self, model=None):
+        from langchain_community.chat_models import ChatOpenRouter
+        from langchain_core.output_parsers import StrOutputParser
+
+        self.chat = ChatOpenRouter(
+            api_key=os.getenv('OPENROUTER_API_KEY'),
+            model=model or model_router.primary(),
+            http_referer="http://localhost:8000",
+            x_title="SALS Assistant"
+        )
+        self.output_parser = StrOutputParser()
+        # Chains are built once and reused for every call
+        self.chains = {
+            "generate_quiz": self._create_chain(QUIZ_TEMPLATE),
+            "analyze_quiz": self._create_chain(ANALYSIS_TEMPLATE),
+            "generate_learning_path": self._create_chain(LEARNING_PATH_TEMPLATE),
+            "generate_final_quiz": self._create_chain(FINAL_QUIZ_TEMPLATE),
+        }
+
+    def _create_chain(self, template: str):
+        """Create a LangChain chain with the given template."""
+        from langchain_core.prompts import ChatPromptTemplate
+
+        prompt = ChatPromptTemplate.from_template(template)
+        return prompt | self.chat | self.output_parser
+
+    def generate_quiz(self, topic: str) -> List[Dict[str, Any]]:
+        """Generate a quiz using LangChain while maintaining the same format."""
+        chain = self.chains["generate_quiz"]
+        result = chain.invoke({"topic": topic})
+        return json.loads(result)
+
+    def analyze_quiz(self, questions: List[Dict[str, Any]], answers: List[str]) -> List[str]:
+        """Analyze quiz responses using LangChain while maintaining the same format."""
+        qa_pairs = json.dumps([
+            {
+                "question": q["question"],
+                "concept": q["concept"],
+                "correct": q["answer"],
+                "user": a
+            }
+            for q, a in zip(questions, answers)
+        ], indent=2)
+        chain = self.chains["analyze_quiz"]
+        result = chain.invoke({"qa_pairs": qa_pairs})
+        return json.loads(result)
+
+    def generate_learning_path(self, weak_concepts: List[str]) -> List[Dict[str, Any]]:
+        """Generate a learning path using LangChain while maintaining the same format."""
+        concept_list = ', '.join(weak_concepts)
+        chain = self.chains["generate_learning_path"]
+        result = chain.invoke({"concept_list": concept_list})
+        return json.loads(result)
+
+    def generate_final_quiz(self, topic: str, weak_concepts: List[str], initial_weak_concepts: List[str]) -> Dict[str, Any]:
+        """Generate a final quiz using LangChain while maintaining the same format."""
+        chain = self.chains["generate_final_quiz"]
         result = chain.invoke({
             "topic": topic,
             "weak_concepts": weak_concepts,
@@ -147,5 +166,22 @@ Make sure the questions are challenging but fair, and provide clear explanations
         })
         return json.loads(result)
 
-# Create a singleton instance that can be imported and used
-langchain_router = LangChainOpenRouter() 
\ No newline at end of file
+_langchain_router = None
+_langchain_router_lock = threading.Lock()
+
+
+def get_langchain_router():
+    """Return the process-wide LangChainOpenRouter, creating it on first use."""
+    global _langchain_router
+    if _langchain_router is None:
+        with _langchain_router_lock:
+            if _langchain_router is None:
+                _langchain_router = LangChainOpenRouter()
+    return _langchain_router
+
+
+def __getattr__(name):
+    # ``from .langchain_integration import langchain_router`` keeps working
+    if name == "langchain_router":
+        return get_langchain_router()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,323 @@
+"""
+Tolerant extraction of JSON values from model replies.
+
+Model output wraps the JSON we asked for in all sorts of things: code
+fences, <think> blocks and other reasoning text, trailing commas,
+unquoted keys, Python literals and ``//`` comments (the final-quiz prompt
+itself contains one). extract_json finds the first complete JSON value in
+a reply without rewriting the text, so string contents are never touched.
+Strictly valid JSON is decoded by the C decoder; everything else goes
+through a small tolerant recursive-descent parser. Both are linear scans,
+and when a candidate fails to parse, scanning resumes where it failed.
+
+parse_llm_json also checks the value against the schema registered for
+the calling endpoint, skipping candidates (e.g. a bracketed aside in the
+model's reasoning) that do not match it.
+"""
+import json
+import re
+from collections import namedtuple
+from json.decoder import scanstring
+from json.scanner import NUMBER_RE
+
+from .grading import normalize_option
+from .metrics import LLM_JSON_FAILURES, current_route
+
+_decoder = json.JSONDecoder(strict=False)
+
+_WHITESPACE = " \t\n\r"
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_$][\w$-]*")
+_LITERALS = {
+    "true": True, "false": False, "null": None,
+    "True": True, "False": False, "None": None,
+}
+THINK_START = "<think>"
+THINK_END = "</think>"
+
+OPTION_LETTERS = ("A", "B", "C", "D")
+
+
+class LLMOutputError(ValueError):
+    """Raised when a model reply does not contain the JSON we asked for."""
+
+    def __init__(self, message, raw=None):
+        super().__init__(message)
+        self.raw = raw
+
+
+class _ParseError(Exception):
+    def __init__(self, message, pos):
+        super().__init__(message)
+        self.pos = pos
+
+
+class _TolerantParser:
+    def __init__(self, text):
+        self.text = text
+        self.end = len(text)
+
+    def skip(self, pos):
+        """Skip whitespace and // or /* */ comments."""
+        text, end = self.text, self.end
+        while pos < end:
+            char = text[pos]
+            if char in _WHITESPACE:
+                pos += 1
+            elif text.startswith("//", pos):
+                newline = text.find("\n", pos)
+                pos = end if newline == -1 else newline + 1
+            elif text.startswith("/*", pos):
+                close = text.find("*/", pos + 2)
+                pos = end if close == -1 else close + 2
+            else:
+                break
+        return pos
+
+    def value(self, pos):
+        if pos >= self.end:
+            raise _ParseError("Unexpected end of reply", pos)
+        char = self.text[pos]
+        if char == "{":
+            return self.object(pos + 1)
+        if char == "[":
+            return self.array(pos + 1)
+        if char == '"':
+            try:
+                return scanstring(self.text, pos + 1, False)
+            except json.JSONDecodeError as e:
+                raise _ParseError(e.msg, e.pos) from e
+        if char == "'":
+            return self.single_quoted(pos + 1)
+        match = NUMBER_RE.match(self.text, pos)
+        if match:
+            integer, frac, exp = match.groups()
+            number = float(integer + (frac or "") + (exp or "")) if frac or exp else int(integer)
+            return number, match.end()
+        match = _IDENTIFIER_RE.match(self.text, pos)
+        if match and match.group() in _LITERALS:
+            return _LITERALS[match.group()], match.end()
+        raise _ParseError(f"Unexpected character {char!r}", pos)
+
+    def single_quoted(self, pos):
+        chunks = []
+        text, end = self.text, self.end
+        while pos < end:
+            char = text[pos]
+            if char == "'":
+                return "".join(chunks), pos + 1
+            if char == "\\" and pos + 1 < end:
+                following = text[pos + 1]
+                chunks.append(following if following in "'\\" else char + following)
+                pos += 2
+                continue
+            chunks.append(char)
+            pos += 1
+        raise _ParseError("Unterminated string", pos)
+
+    def key(self, pos):
+        char = self.text[pos] if pos < self.end else ""
+        if char in "\"'":
+            return self.value(pos)
+        match = _IDENTIFIER_RE.match(self.text, pos)
+        if not match:
+            raise _ParseError("Expected a property name", pos)
+        return match.group(), match.end()
+
+    def object(self, pos):
+        result = {}
+        while True:
+            pos = self.skip(pos)
+            if pos < self.end and self.text[pos] == "}":
+                return result, pos + 1
+            key, pos = self.key(pos)
+            pos = self.skip(pos)
+            if pos >= self.end or self.text[pos] != ":":
+                raise _ParseError("Expected ':'", pos)
+            value, pos = self.value(self.skip(pos + 1))
+            result[key] = value
+            pos = self.skip(pos)
+            if pos < self.end and self.text[pos] == ",":
+                pos += 1
+            elif pos < self.end and self.text[pos] != "}" and self.text[pos] in "\"'":
+                continue  # missing comma between members
+            elif pos >= self.end or self.text[pos] != "}":
+                raise _ParseError("Expected ',' or '}'", pos)
+
+    def array(self, pos):
+        result = []
+        while True:
+            pos = self.skip(pos)
+            if pos < self.end and self.text[pos] == "]":
+                return result, pos + 1
+            value, pos = self.value(pos)
+            result.append(value)
+            pos = self.skip(pos)
+            if pos < self.end and self.text[pos] == ",":
+                pos += 1
+            elif pos < self.end and self.text[pos] in "{[\"'":
+                continue  # missing comma between elements
+            elif pos >= self.end or self.text[pos] != "]":
+                raise _ParseError("Expected ',' or ']'", pos)
+
+
+def _decode_at(text, pos, parser):
+    """Decode the value starting at ``pos``; returns ``(value, end)``."""
+    try:
+        return _decoder.raw_decode(text, pos)
+    except json.JSONDecodeError:
+        return parser.value(pos)
+
+
+def iter_json_values(text, expect=None):
+    """
+    Yield ``(value, start, end)`` for each top-level JSON value in ``text``.
+
+    ``expect`` limits candidates to values opening with that character
+    ("[" or "{"). A <think> block at the start is skipped; a candidate
+    that fails to parse is abandoned at the point of failure.
+    """
+    if not isinstance(text, str):
+        return
+    openers = expect or "[{"
+    parser = _TolerantParser(text)
+    think_end = text.find(THINK_END) if THINK_START in text[:200] else -1
+    pos = think_end + len(THINK_END) if think_end != -1 else 0
+    end = len(text)
+    while pos < end:
+        if text[pos] not in openers:
+            pos += 1
+            continue
+        try:
+            value, value_end = _decode_at(text, pos, parser)
+        except _ParseError as e:
+            pos = max(e.pos, pos + 1)
+            continue
+        except RecursionError:
+            return
+        yield value, pos, value_end
+        pos = value_end
+
+
+def extract_json(text, expect=None):
+    """Return the first complete JSON value in a model reply."""
+    for value, _, _ in iter_json_values(text, expect):
+        return value
+    raise LLMOutputError("No JSON value found in model reply", raw=text)
+
+
+def response_content(result):
+    """The assistant message text of an OpenRouter response."""
+    try:
+        content = result['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError) as e:
+        error = result.get('error') if isinstance(result, dict) else None
+        raise LLMOutputError(f"No completion in response: {error or repr(e)}", raw=result) from e
+    if not isinstance(content, str):
+        raise LLMOutputError("Completion has no text content", raw=result)
+    return content
+
+
+def validate_quiz_questions(questions):
+    """
+    Check a diagnostic quiz has the shape the frontend relies on.
+    """
+    if not isinstance(questions, list) or not questions:
+        raise ValueError("Quiz must be a non-empty list of questions")
+    for index, question in enumerate(questions):
+        if not isinstance(question, dict):
+            raise ValueError(f"Question {index} is not an object")
+        for field in ("question", "options", "answer", "concept"):
+            if not question.get(field):
+                raise ValueError(f"Question {index} is missing '{field}'")
+        if not isinstance(question["options"], list) or len(question["options"]) != len(OPTION_LETTERS):
+            raise ValueError(f"Question {index} must have {len(OPTION_LETTERS)} options")
+        # Graded with normalize_option, which also takes "B) Queue", "(B)" or the option text
+        if normalize_option(question["answer"], question["options"]) is None:
+            raise ValueError(f"Question {index} has an invalid answer '{question['answer']}'")
+    return questions
+
+
+def validate_concept_list(concepts):
+    if not isinstance(concepts, list) or not all(isinstance(c, str) for c in concepts):
+        raise ValueError("Expected a list of concept names")
+    return concepts
+
+
+def validate_learning_path_entry(item, index=0):
+    if not isinstance(item, dict) or not item.get("concept"):
+        raise ValueError(f"Learning path entry {index} has no 'concept'")
+    return item
+
+
+def validate_learning_path(path):
+    if not isinstance(path, list) or not path:
+        raise ValueError("Learning path must be a non-empty list")
+    for index, item in enumerate(path):
+        validate_learning_path_entry(item, index)
+    return path
+
+
+def validate_final_quiz(quiz):
+    questions = quiz.get("questions") if isinstance(quiz, dict) else quiz
+    if not isinstance(questions, list) or not questions:
+        raise ValueError("Final quiz must contain a non-empty list of questions")
+    for index, question in enumerate(questions):
+        if not isinstance(question, dict) or not question.get("question"):
+            raise ValueError(f"Question {index} has no 'question'")
+    return quiz
+
+
+Schema = namedtuple("Schema", ["expect", "validate"])
+
+SCHEMAS = {
+    "quiz": Schema("[", validate_quiz_questions),
+    "analysis": Schema("[", validate_concept_list),
+    "learning_path": Schema("[", validate_learning_path),
+    "final_quiz": Schema(None, validate_final_quiz),
+}
+
+
+def _parse(result, endpoint):
+    text = result if isinstance(result, str) else response_content(result)
+    schema = SCHEMAS.get(endpoint)
+    if schema is None:
+        return extract_json(text)
+
+    error = "No JSON value found in model reply"
+    for value, _, _ in iter_json_values(text, schema.expect):
+        try:
+            return schema.validate(value)
+        except ValueError as e:
+            error = str(e)
+    raise LLMOutputError(error, raw=text)
+
+
+def parse_llm_json(result, endpoint=None):
+    """
+    Extract the JSON value from a reply and validate it for ``endpoint``.
+
+    ``result`` is an OpenRouter response or the reply text itself.
+    Raises LLMOutputError when no candidate parses and validates.
+    """
+    try:
+        return _parse(result, endpoint)
+    except LLMOutputError:
+        LLM_JSON_FAILURES.inc(current_route(), endpoint or "any")
+        raise
+
+
+def is_usable_reply(result, endpoint=None):
+    """
+    Whether a response would parse and validate for ``endpoint``.
+
+    Endpoints without a schema (free-text replies such as final feedback)
+    only need non-empty text. Failures are not counted, since the caller
+    parses the reply again.
+    """
+    try:
+        if endpoint not in SCHEMAS:
+            return bool(response_content(result).strip())
+        _parse(result, endpoint)
+    except LLMOutputError:
+        return False
+    return True
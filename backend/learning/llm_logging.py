@@ -0,0 +1,136 @@
+"""
+Structured logging for OpenRouter calls.
+
+Every call produces one compact INFO record on the ``learning.llm`` logger
+with timing, sizes and IDs (also attached as ``extra`` fields for
+structured handlers). Full prompts and responses go to the separate
+``learning.llm.payloads`` logger, and only for calls picked by
+LLM_LOGGING["PAYLOAD_SAMPLE_RATE"] or when LLM_LOGGING["LOG_PAYLOADS"] is
+on. Payloads are wrapped in LazyJSON so they are only serialized when a
+handler actually formats the record.
+"""
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+
+from .prompts import prompt_label
+
+logger = logging.getLogger("learning.llm")
+payload_logger = logging.getLogger("learning.llm.payloads")
+
+DEFAULT_LLM_LOGGING_SETTINGS = {
+    "PAYLOAD_SAMPLE_RATE": 0.0,
+    "LOG_PAYLOADS": False,
+}
+
+
+def get_llm_logging_settings():
+    config = dict(DEFAULT_LLM_LOGGING_SETTINGS)
+    config.update(getattr(settings, "LLM_LOGGING", {}))
+    return config
+
+
+class LazyJSON:
+    """Defer ``json.dumps`` of a payload until the log record is formatted."""
+
+    __slots__ = ("value", "indent")
+
+    def __init__(self, value, indent=2):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self):
+        return json.dumps(self.value, indent=self.indent, default=str)
+
+
+def _content_chars(messages):
+    return sum(len(message.get("content") or "") for message in messages)
+
+
+def response_failed(response):
+    """Whether an OpenRouter response carries an error or no completion."""
+    return not isinstance(response, dict) or 'error' in response or not response.get('choices')
+
+
+def _response_error(response):
+    error = response.get("error") if isinstance(response, dict) else None
+    return str(error or "Response has no completion")[:500]
+
+
+def _response_fields(response):
+    if not isinstance(response, dict):
+        return {}
+    choices = response.get("choices") or [{}]
+    content = (choices[0].get("message") or {}).get("content") or ""
+    usage = response.get("usage") or {}
+    return {
+        "completion_id": response.get("id", ""),
+        "response_chars": len(content),
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "reasoning_tokens": (usage.get("completion_tokens_details") or {}).get("reasoning_tokens"),
+        "cost": usage.get("cost"),
+    }
+
+
+def capture_payloads():
+    """Decide whether this call's full payloads should be logged."""
+    if not payload_logger.isEnabledFor(logging.DEBUG):
+        return False
+    config = get_llm_logging_settings()
+    if config["LOG_PAYLOADS"]:
+        return True
+    rate = config["PAYLOAD_SAMPLE_RATE"]
+    return rate > 0 and random.random() < rate
+
+
+def log_llm_call(endpoint, model, messages, response=None, started=None,
+                 attempts=None, cached=False, streamed=False, error=None, coalesced=False):
+    """
+    Emit the per-call summary record and, if sampled, the full payloads.
+
+    ``started`` is a ``time.perf_counter()`` reading taken before the call;
+    ``coalesced`` marks a caller that shared another caller's upstream call.
+    A response that came back as an error is logged (and billed in the usage
+    ledger) as one, like a raised ``error``; a coalesced caller leaves that
+    to the caller that made the upstream call.
+    """
+    if not (error or cached or coalesced) and response is not None and response_failed(response):
+        error = _response_error(response)
+    duration_ms = round((time.perf_counter() - started) * 1000, 1) if started is not None else None
+    fields = {
+        "endpoint": endpoint or "",
+        "model": model,
+        "status": "error" if error else ("cached" if cached else ("coalesced" if coalesced else "ok")),
+        "duration_ms": duration_ms,
+        "attempts": 0 if cached or coalesced else (len(attempts) if attempts else 1),
+        "streamed": streamed,
+        "prompt": prompt_label(messages),
+        "prompt_chars": _content_chars(messages),
+        **_response_fields(response),
+    }
+    if error:
+        fields["error"] = error
+
+    level = logging.ERROR if error else logging.INFO
+    if logger.isEnabledFor(level):
+        logger.log(
+            level,
+            "llm_call endpoint=%s model=%s status=%s duration_ms=%s attempts=%s "
+            "prompt=%s prompt_chars=%s response_chars=%s completion_id=%s error=%s",
+            fields["endpoint"], model, fields["status"], duration_ms, fields["attempts"],
+            fields["prompt"], fields["prompt_chars"], fields.get("response_chars", 0), fields.get("completion_id", ""),
+            error or "",
+            extra={"llm": fields},
+        )
+
+    if not (cached or coalesced) and capture_payloads():
+        payload_logger.debug(
+            "llm_payload endpoint=%s model=%s\nmessages=%s\nresponse=%s",
+            fields["endpoint"], model, LazyJSON(messages), LazyJSON(response),
+            extra={"llm": fields},
+        )
+    return fields
@@ -0,0 +1,75 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from learning.models import ConceptMaterial, LLMCacheEntry, LLMInflight, Quiz, Topic, UserProgress
+
+# Plan lines that read a whole table instead of going through an index
+FULL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"\bSCAN (\w+)(?!.*\bUSING\b)"),
+    "postgresql": re.compile(r"\bSeq Scan on (\w+)"),
+}
+# Plan lines that sort rows the index did not return in order
+SORT_PATTERNS = {
+    "sqlite": re.compile(r"USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY"),
+    "postgresql": re.compile(r"^\s*(?:->\s*)?Sort\b", re.MULTILINE),
+}
+
+
+def hot_lookups():
+    """The queries run on every request, as the code issues them."""
+    now = timezone.now()
+    return {
+        "topic by name": Topic.objects.filter(name="Graphs"),
+        "progress by topic": UserProgress.objects.filter(topic_id=1),
+        "progress by topic name": UserProgress.objects.filter(topic__name="Graphs"),
+        "quiz pool head": Quiz.objects.filter(
+            topic_id=1, is_final_quiz=False, served_at__isnull=True
+        ).order_by("created_at", "id")[:1],
+        "quiz pool size": Quiz.objects.filter(topic_id=1, is_final_quiz=False, served_at__isnull=True),
+        "cache entry by key": LLMCacheEntry.objects.filter(key="0" * 64, expires_at__gt=now),
+        "expired cache entries": LLMCacheEntry.objects.filter(expires_at__lte=now),
+        "oldest cache entries": LLMCacheEntry.objects.order_by("created_at").values_list("pk", flat=True)[:10],
+        "in-flight call by key": LLMInflight.objects.filter(key="0" * 64),
+        "material by concept": ConceptMaterial.objects.filter(
+            canonical_name__in=["graphs", "trees"], updated_at__gte=now, prompt_version=""
+        ),
+    }
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot lookups and fail if any of them scans a whole table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--show-plans", action="store_true", help="Print the full plan of every lookup.")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        full_scan = FULL_SCAN_PATTERNS.get(vendor)
+        sort = SORT_PATTERNS.get(vendor)
+        if full_scan is None:
+            self.stdout.write(f"No plan check for {vendor}; printing plans only.")
+
+        failures = []
+        with transaction.atomic():
+            if vendor == "postgresql":
+                # Small tables are cheaper to scan; ask whether an index *can* serve the lookup
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            for name, queryset in hot_lookups().items():
+                plan = queryset.explain()
+                scanned = full_scan.findall(plan) if full_scan else []
+                verdict = f"FULL SCAN of {', '.join(scanned)}" if scanned else ("index" if full_scan else "?")
+                if sort and sort.search(plan):
+                    verdict += " + sort"
+                self.stdout.write(f"{name:<24} {verdict}")
+                if options["show_plans"] or scanned:
+                    for line in plan.splitlines():
+                        self.stdout.write(f"    {line}")
+                if scanned:
+                    failures.append(name)
+
+        if failures:
+            raise CommandError(f"Lookups without an index: {', '.join(failures)}")
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from learning.standin import ERROR_STATUSES, parse_latency, start_standin
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the OpenRouter chat-completions endpoint with schema-valid "
+        "replies; point OPENROUTER_BASE_URL at it for offline runs and load tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", default="0",
+                            help='Latency spec, e.g. "1.5", "uniform:0.5,2" or "lognormal:1.2,0.5".')
+        parser.add_argument("--endpoint-latency", action="append", default=[], metavar="ENDPOINT=SPEC",
+                            help='Per-endpoint latency override, e.g. "learning_path=lognormal:4,0.4" (repeatable).')
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with an error status.")
+        parser.add_argument("--error-status", type=int, action="append",
+                            help=f"Error statuses to pick from (repeatable, default {list(ERROR_STATUSES)}).")
+        parser.add_argument("--bad-reply-rate", type=float, default=0.0,
+                            help="Share of successful calls whose reply holds no JSON.")
+        parser.add_argument("--chunk-size", type=int, default=40, help="Characters per streamed delta.")
+        parser.add_argument("--chunk-delay", type=float, default=0.01, help="Seconds between streamed deltas.")
+        parser.add_argument("--rate-limit", type=float, help="Calls per minute to allow; the rest get a 429.")
+        parser.add_argument("--rate-burst", type=int, default=1, help="Calls allowed back to back under --rate-limit.")
+        parser.add_argument("--seed", type=int, help="Seed for latency and failure draws.")
+
+    def handle(self, *args, **options):
+        endpoint_latency = {}
+        try:
+            for item in options["endpoint_latency"]:
+                endpoint, _, spec = item.partition("=")
+                endpoint_latency[endpoint] = parse_latency(spec)
+            server = start_standin(
+                host=options["host"],
+                port=options["port"],
+                latency=options["latency"],
+                endpoint_latency=endpoint_latency,
+                error_rate=options["error_rate"],
+                error_statuses=options["error_status"] or ERROR_STATUSES,
+                bad_reply_rate=options["bad_reply_rate"],
+                chunk_size=options["chunk_size"],
+                chunk_delay=options["chunk_delay"],
+                rate_limit=options["rate_limit"] / 60 if options["rate_limit"] else None,
+                rate_burst=options["rate_burst"],
+                seed=options["seed"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"OpenRouter stand-in listening on {server.url} (OPENROUTER_BASE_URL={server.url})")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+            for key, count in sorted(server.stats().items()):
+                self.stdout.write(f"{key}: {count}")
@@ -0,0 +1,99 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from learning.prompts import (
+    generate_analysis_prompt,
+    generate_final_feedback_prompt,
+    generate_final_quiz_prompt,
+    generate_learning_path_prompt,
+    generate_quiz_prompt,
+    get_prompt_settings,
+)
+
+# cl100k_base pre-tokenization; each piece is at least one BPE token
+_ESTIMATE_RE = re.compile(
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+)
+
+SAMPLE_QUESTIONS = [
+    {
+        "question": f"Which data structure gives O(1) average lookup for question {i}?",
+        "concept": concept,
+        "answer": "B",
+    }
+    for i, concept in enumerate(
+        ["Hashing", "Binary Search", "Recursion", "Dynamic Programming", "Graphs",
+         "Sorting", "Heaps", "Two Pointers", "Trees", "Greedy"],
+        start=1,
+    )
+]
+SAMPLE_ANSWERS = ["B", "A", "B", "C", "B", "D", "B", "B", "A", "B"]
+SAMPLE_WEAK = ["Binary Search", "Dynamic Programming", "Sorting", "Trees"]
+SAMPLE_ALL = [q["concept"] for q in SAMPLE_QUESTIONS]
+SAMPLE_METRICS = {
+    "initial_weak": SAMPLE_WEAK,
+    "final_weak": ["Trees", "Heaps"],
+    "improved_concepts": ["Binary Search", "Dynamic Programming", "Sorting"],
+    "still_weak_concepts": ["Trees"],
+    "new_weak_concepts": ["Heaps"],
+}
+
+BUILDERS = {
+    "quiz": lambda: generate_quiz_prompt("Arrays"),
+    "analysis": lambda: generate_analysis_prompt(SAMPLE_QUESTIONS, SAMPLE_ANSWERS),
+    "learning_path": lambda: generate_learning_path_prompt(SAMPLE_WEAK, SAMPLE_ALL),
+    "final_quiz": lambda: generate_final_quiz_prompt("Arrays", SAMPLE_WEAK[2:], SAMPLE_WEAK),
+    "final_feedback": lambda: generate_final_feedback_prompt(SAMPLE_METRICS),
+}
+
+
+def _token_counter(encoding):
+    """tiktoken's count when it can load ``encoding``, else a pre-tokenizer estimate."""
+    try:
+        import tiktoken
+
+        encoder = tiktoken.get_encoding(encoding)
+        return (lambda text: len(encoder.encode(text))), encoding
+    except Exception:
+        return (lambda text: len(_ESTIMATE_RE.findall(text))), "estimate"
+
+
+class Command(BaseCommand):
+    help = "Report prompt sizes per builder in verbose and compact mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--encoding", default="cl100k_base", help="tiktoken encoding to count with.")
+        parser.add_argument("--show", choices=sorted(BUILDERS), help="Print the compact prompt of one builder.")
+
+    def handle(self, *args, **options):
+        count, counted_with = _token_counter(options["encoding"])
+        modes = {
+            "verbose": {"COMPACT": False, "OMIT_UNUSED_FIELDS": False},
+            "compact": dict(get_prompt_settings(), COMPACT=True),
+        }
+
+        prompts = {}
+        for mode, config in modes.items():
+            with override_settings(LLM_PROMPTS=config):
+                prompts[mode] = {name: build() for name, build in BUILDERS.items()}
+
+        if options["show"]:
+            self.stdout.write(prompts["compact"][options["show"]])
+            return
+
+        self.stdout.write(f"tokens counted with: {counted_with}")
+        self.stdout.write(f"{'builder':<16} {'chars':>13} {'tokens':>13} {'saved':>7}  version")
+        totals = {"verbose": 0, "compact": 0}
+        for name in BUILDERS:
+            verbose, compact = prompts["verbose"][name], prompts["compact"][name]
+            before, after = count(verbose), count(compact)
+            totals["verbose"] += before
+            totals["compact"] += after
+            saved = (before - after) / before * 100 if before else 0
+            self.stdout.write(
+                f"{name:<16} {len(verbose):>6}>{len(compact):<6} {before:>6}>{after:<6} {saved:>6.1f}%  {compact.version}"
+            )
+        before, after = totals["verbose"], totals["compact"]
+        self.stdout.write(f"{'total':<16} {'':>13} {before:>6}>{after:<6} {(before - after) / before * 100:>6.1f}%")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from learning.stats import rebuild_concept_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-concept performance counters from all stored quiz attempts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Attempts fetched per query.")
+
+    def handle(self, *args, **options):
+        counted = rebuild_concept_stats(batch_size=options["batch_size"])
+        self.stdout.write(f"Rebuilt concept stats from {counted} attempts")
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from learning.models import Topic
+from learning.quiz_pool import get_pool_settings, refill_pools, refill_topic
+
+
+class Command(BaseCommand):
+    help = "Top up the pre-generated diagnostic quiz pools, busiest topics first."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--topic", action="append", help="Only refill the named topic (repeatable).")
+        parser.add_argument("--target", type=int, help="Pool size to fill up to (defaults to QUIZ_POOL['TARGET_SIZE']).")
+        parser.add_argument("--all", action="store_true", help="Include topics with no recent demand.")
+        parser.add_argument("--loop", action="store_true", help="Keep running, refilling every REFILL_INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        interval = get_pool_settings()["REFILL_INTERVAL"]
+        while True:
+            if options["topic"]:
+                added = {}
+                for name in options["topic"]:
+                    try:
+                        topic = Topic.objects.get(name=name)
+                    except Topic.DoesNotExist:
+                        raise CommandError(f"Unknown topic: {name}")
+                    added[name] = refill_topic(topic, target=options["target"])
+            else:
+                added = refill_pools(include_idle=options["all"], target=options["target"])
+
+            for name, refill in added.items():
+                if refill.retry_after is None:
+                    self.stdout.write(f"{name}: +{refill.added}")
+                else:
+                    self.stdout.write(f"{name}: +{refill.added} (upstream busy, retry in {refill.retry_after}s)")
+            if not options["loop"]:
+                break
+            time.sleep(interval)
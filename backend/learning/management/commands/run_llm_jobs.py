@@ -0,0 +1,51 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from learning.jobs import get_job_settings, run_workers
+
+
+def _serve(threads, burst):
+    # Ctrl-C or SIGTERM lets each thread finish its current job, then exits
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    run_workers(threads, stop, burst=burst)
+
+
+class Command(BaseCommand):
+    help = "Run background LLM jobs (see learning.jobs) until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, help="Worker threads per process (defaults to LLM_JOBS['THREADS']).")
+        parser.add_argument("--processes", type=int, default=1, help="Worker processes to fork.")
+        parser.add_argument("--burst", action="store_true", help="Exit once no job is due instead of polling.")
+
+    def handle(self, *args, **options):
+        threads = options["threads"] or get_job_settings()["THREADS"]
+        processes = options["processes"]
+        if threads < 1 or processes < 1:
+            raise CommandError("--threads and --processes must be at least 1")
+        self.stdout.write(f"Running LLM jobs with {processes} process(es) x {threads} thread(s)")
+
+        if processes == 1:
+            _serve(threads, options["burst"])
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        children = [
+            context.Process(target=_serve, args=(threads, options["burst"]), name=f"llm-jobs-{i}")
+            for i in range(processes)
+        ]
+        for child in children:
+            child.start()
+        # Ctrl-C reaches the children directly; SIGTERM is passed on to them
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: [child.terminate() for child in children])
+        for child in children:
+            child.join()
@@ -0,0 +1,149 @@
+"""
+Per-concept learning-material store.
+
+Learning-path entries (explanation, resource, practice problems) are the
+same for every learner studying a concept, so each generated entry is
+stored under its canonical concept name, with separate variants for weak
+and non-weak concepts. A path request only asks the model for the
+concepts the store does not have yet, then assembles the path from stored
+and fresh entries in the requested concept order. Entries produced by an
+older version of the learning-path prompt count as missing.
+"""
+import logging
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ConceptMaterial
+from .prompts import LEARNING_PATH_PROMPT, generate_learning_path_prompt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MATERIAL_SETTINGS = {
+    "ENABLED": True,
+    "MAX_AGE": 30 * 24 * 60 * 60,
+}
+
+
+def get_material_settings():
+    config = dict(DEFAULT_MATERIAL_SETTINGS)
+    config.update(getattr(settings, "LEARNING_MATERIALS", {}))
+    return config
+
+
+def canonical_concept(name):
+    """Normalise a concept name so "Binary-Search " and "binary search" match."""
+    return re.sub(r"[^a-z0-9+#]+", " ", str(name).lower()).strip()
+
+
+class PathPlan:
+    """
+    The concepts of one learning-path request, split into stored and missing.
+    """
+
+    def __init__(self, weak_concepts, all_concepts):
+        self.weak_concepts = weak_concepts
+        self.all_concepts = all_concepts
+        self.weak = {canonical_concept(c) for c in weak_concepts}
+
+        # Requested concepts in order, weak ones included even if absent from all_concepts
+        self.concepts = []
+        seen = set()
+        for concept in list(all_concepts) + list(weak_concepts):
+            canonical = canonical_concept(concept)
+            if canonical and canonical not in seen:
+                seen.add(canonical)
+                self.concepts.append(concept)
+
+        self.stored = {}
+        self.missing = list(self.concepts)
+
+    def variant(self, concept):
+        canonical = canonical_concept(concept)
+        return canonical, canonical in self.weak
+
+    def load(self):
+        """Fetch stored entries for the requested concepts in one query."""
+        config = get_material_settings()
+        if not config["ENABLED"] or not self.concepts:
+            return self
+        fresh_since = timezone.now() - timedelta(seconds=config["MAX_AGE"])
+        wanted = dict(self.variant(concept) for concept in self.concepts)
+        rows = ConceptMaterial.objects.filter(
+            canonical_name__in=list(wanted),
+            updated_at__gte=fresh_since,
+            prompt_version=LEARNING_PATH_PROMPT.version,
+        ).values_list("canonical_name", "is_weak_concept", "material")
+        self.stored = {
+            canonical: material
+            for canonical, is_weak, material in rows
+            if wanted.get(canonical) == is_weak
+        }
+        self.missing = [c for c in self.concepts if canonical_concept(c) not in self.stored]
+        return self
+
+    def prompt(self):
+        """Prompt for the missing concepts only, or None when everything is stored."""
+        if not self.missing:
+            return None
+        missing_weak = [c for c in self.missing if canonical_concept(c) in self.weak]
+        return generate_learning_path_prompt(missing_weak, self.missing)
+
+    def stored_entries(self):
+        """Stored entries for the requested concepts, in order."""
+        return [self.stored[canonical_concept(c)] for c in self.concepts if canonical_concept(c) in self.stored]
+
+    def save(self, entries):
+        """
+        Store freshly generated entries; returns them keyed by canonical name.
+
+        Entries for concepts that were not requested (prerequisites the
+        model chose to add) are stored too.
+        """
+        fresh = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            canonical, is_weak = self.variant(entry.get("concept", ""))
+            canonical = canonical[:200]
+            if canonical and canonical not in fresh:
+                entry["is_weak_concept"] = is_weak
+                fresh[canonical] = entry
+        if fresh and get_material_settings()["ENABLED"]:
+            prompt_version = LEARNING_PATH_PROMPT.version
+            ConceptMaterial.objects.bulk_create(
+                [
+                    ConceptMaterial(
+                        canonical_name=canonical,
+                        concept=str(entry["concept"])[:200],
+                        is_weak_concept=entry["is_weak_concept"],
+                        material=entry,
+                        prompt_version=prompt_version,
+                    )
+                    for canonical, entry in fresh.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["canonical_name", "is_weak_concept"],
+                update_fields=["concept", "material", "prompt_version", "updated_at"],
+            )
+        return fresh
+
+    def assemble(self, fresh=None):
+        """
+        The learning path: requested concepts in order, then any extra fresh entries.
+        """
+        fresh = fresh or {}
+        path, used = [], set()
+        for concept in self.concepts:
+            canonical = canonical_concept(concept)
+            entry = self.stored.get(canonical) or fresh.get(canonical)
+            if entry is not None:
+                path.append(entry)
+                used.add(canonical)
+        path.extend(entry for canonical, entry in fresh.items() if canonical not in used)
+        missing = [c for c in self.concepts if canonical_concept(c) not in used]
+        if missing:
+            logger.warning(f"Learning path has no material for: {missing}")
+        return path
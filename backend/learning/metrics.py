@@ -0,0 +1,428 @@
+"""
+Request and LLM metrics in Prometheus text format.
+
+Counters, gauges and histograms are recorded into per-thread shards: a
+thread only ever writes its own dict, so recording takes no lock (the GIL
+covers the single-writer updates) and a scrape merges the shards. Shards of
+threads that have exited are folded into one retired shard, so thread
+churn does not grow the registry.
+
+Workers of one deployment aggregate through LEARNING_METRICS
+["MULTIPROCESS_DIR"]: each process writes its totals to ``<pid>.json``
+there every FLUSH_INTERVAL seconds (and at exit), and /api/metrics adds
+the other workers' files to its own live values. Gauges from files older
+than GAUGE_STALE_AFTER are left out, as their process is likely gone.
+
+MetricsMiddleware times every request, labelled with its learning.urls
+route, and counts the database queries it runs, including those of
+pipeline steps and sync_to_async calls, which inherit the request's
+context. For streaming responses the duration covers the view up to the
+first byte.
+"""
+import atexit
+import bisect
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_SETTINGS = {
+    "ENABLED": True,
+    "MULTIPROCESS_DIR": None,
+    "FLUSH_INTERVAL": 5,
+    "GAUGE_STALE_AFTER": 60,
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def get_metrics_settings():
+    config = dict(DEFAULT_METRICS_SETTINGS)
+    config.update(getattr(settings, "LEARNING_METRICS", {}))
+    return config
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._local = threading.local()
+        self._shards = {}  # thread -> {(metric name, label values): value}
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self):
+        """The calling thread's values; only this thread writes to it."""
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = self._local.values = {}
+            with self._lock:
+                self._retire_dead()
+                self._shards[threading.current_thread()] = values
+        return values
+
+    def _merge_into(self, merged, values):
+        for (name, labels), value in list(values.items()):
+            metric = self.metrics[name]
+            merged[(name, labels)] = metric.merge(merged.get((name, labels)), value)
+
+    def _retire_dead(self):
+        for thread in [t for t in self._shards if not t.is_alive()]:
+            self._merge_into(self._retired, self._shards.pop(thread))
+
+    def snapshot(self):
+        """``{(metric name, label values): value}`` summed over this process's threads."""
+        with self._lock:
+            self._retire_dead()
+            shards = list(self._shards.values())
+            merged = {}
+            self._merge_into(merged, self._retired)
+        for values in shards:
+            self._merge_into(merged, values)
+        return merged
+
+
+registry = Registry()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def merge(self, current, value):
+        return (current or 0) + value
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = registry.shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def track(self, *labels):
+        """Context manager counting the block as in progress."""
+        return _Tracked(self, labels)
+
+
+class _Tracked:
+    __slots__ = ("gauge", "labels")
+
+    def __init__(self, gauge, labels):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(*self.labels)
+
+    def __exit__(self, *exc):
+        self.gauge.dec(*self.labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = registry.shard()
+        key = (self.name, labels)
+        values = shard.get(key)
+        if values is None:
+            # Per-bucket counts (the last one is +Inf), then the sum
+            values = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def merge(self, current, value):
+        if current is None:
+            return list(value)
+        return [a + b for a, b in zip(current, value)]
+
+    def samples(self, labels, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), value):
+            cumulative += count
+            le = bound if bound == "+Inf" else repr(float(bound))
+            yield f"{self.name}_bucket", labels + (("le", le),), cumulative
+        yield f"{self.name}_sum", labels, value[-1]
+        yield f"{self.name}_count", labels, cumulative
+
+
+REQUEST_DURATION = Histogram(
+    "learning_request_duration_seconds", "Time to respond to a request, by learning.urls route.",
+    ["route", "method", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "learning_request_db_queries", "Database queries run while handling a request.",
+    ["route"], buckets=QUERY_BUCKETS,
+)
+UPSTREAM_DURATION = Histogram(
+    "learning_llm_upstream_duration_seconds", "Latency of each OpenRouter HTTP attempt, by model.",
+    ["model"],
+)
+UPSTREAM_ERRORS = Counter(
+    "learning_llm_upstream_errors_total", "Failed OpenRouter HTTP attempts, by model and status (or 'transport').",
+    ["model", "reason"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "learning_llm_upstream_in_flight", "OpenRouter calls (including open streams) currently in progress.",
+    ["model"],
+)
+UPSTREAM_ADMISSIONS = Counter(
+    "learning_llm_upstream_admissions_total",
+    "OpenRouter calls by rate-limiter outcome: admitted at once, queued for a token, or rejected.",
+    ["outcome"],
+)
+UPSTREAM_QUEUE_WAIT = Histogram(
+    "learning_llm_upstream_queue_wait_seconds", "Time queued calls waited for a rate-limit token.",
+)
+LLM_JSON_FAILURES = Counter(
+    "learning_llm_json_parse_failures_total", "Model replies without the expected JSON, by route and schema.",
+    ["route", "schema"],
+)
+
+
+def observe_upstream(model, record):
+    """Record one OpenRouter attempt from the HTTP client's attempt record."""
+    model = model or "unknown"
+    if record["latency"] is not None:
+        UPSTREAM_DURATION.observe(record["latency"], model)
+    status = record["status"]
+    if status is None or status >= 400:
+        UPSTREAM_ERRORS.inc(model, str(status) if status else "transport")
+
+
+# Per-request state, inherited by pipeline threads and sync_to_async calls
+class RequestStats:
+    __slots__ = ("request", "_queries")
+
+    def __init__(self, request):
+        self.request = request
+        # next() on a count is atomic, so concurrent steps can share it
+        self._queries = itertools.count()
+
+    def count_query(self):
+        next(self._queries)
+
+    def queries(self):
+        """Queries counted so far; read once, when the request is done."""
+        return next(self._queries)
+
+    @property
+    def route(self):
+        match = getattr(self.request, "resolver_match", None)
+        if match is None:
+            return "unmatched"
+        if not match.func.__module__.startswith("learning."):
+            return "other"
+        return match.url_name or match.route
+
+
+_current = contextvars.ContextVar("learning_request_stats", default=None)
+
+
+def current_route():
+    stats = _current.get()
+    return stats.route if stats is not None else "none"
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is not None:
+        stats.count_query()
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    """connection_created receiver adding the query counter to a connection."""
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = get_metrics_settings()["ENABLED"]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        if self.enabled:
+            start_flusher()
+
+    def _finish(self, stats, method, status, started):
+        route = stats.route
+        REQUEST_DURATION.observe(time.perf_counter() - started, route, method, str(status))
+        REQUEST_QUERIES.observe(stats.queries(), route)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        stats = RequestStats(request)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            _current.reset(token)
+            self._finish(stats, request.method, status, started)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        stats = RequestStats(request)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            _current.reset(token)
+            self._finish(stats, request.method, status, started)
+
+
+# Exposition and cross-process aggregation
+
+def _dump(snapshot):
+    return [[name, list(labels), value] for (name, labels), value in snapshot.items()]
+
+
+def _path(directory, pid):
+    return os.path.join(directory, f"{pid}.json")
+
+
+def write_process_file():
+    directory = get_metrics_settings()["MULTIPROCESS_DIR"]
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = _path(directory, os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"pid": os.getpid(), "written_at": time.time(), "metrics": _dump(registry.snapshot())}, f)
+    os.replace(tmp, path)
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher():
+    """Start this process's background writer, if MULTIPROCESS_DIR is set."""
+    global _flusher
+    config = get_metrics_settings()
+    if not config["MULTIPROCESS_DIR"] or _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is not None:
+            return
+
+        def flush_forever():
+            while True:
+                time.sleep(config["FLUSH_INTERVAL"])
+                try:
+                    write_process_file()
+                except OSError as e:
+                    logger.warning(f"Could not write metrics file: {str(e)}")
+
+        _flusher = threading.Thread(target=flush_forever, name="metrics-flusher", daemon=True)
+        _flusher.start()
+        atexit.register(write_process_file)
+
+
+def _other_processes(directory, stale_after):
+    """Merged values from the other workers' files."""
+    merged = {}
+    if not directory or not os.path.isdir(directory):
+        return merged
+    own = f"{os.getpid()}.json"
+    now = time.time()
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json") or filename == own:
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        stale = now - data.get("written_at", 0) > stale_after
+        for name, labels, value in data.get("metrics", []):
+            metric = registry.metrics.get(name)
+            if metric is None or (stale and metric.kind == "gauge"):
+                continue
+            key = (name, tuple(labels))
+            merged[key] = metric.merge(merged.get(key), value)
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render_metrics():
+    """All metrics in Prometheus text format, summed over workers."""
+    config = get_metrics_settings()
+    values = registry.snapshot()
+    for key, value in _other_processes(config["MULTIPROCESS_DIR"], config["GAUGE_STALE_AFTER"]).items():
+        values[key] = registry.metrics[key[0]].merge(values.get(key), value)
+
+    by_metric = {}
+    for (name, labels), value in values.items():
+        by_metric.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, metric in registry.metrics.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(by_metric.get(name, []), key=lambda item: item[0]):
+            pairs = tuple(zip(metric.labelnames, labels))
+            for sample, sample_labels, sample_value in metric.samples(pairs, value):
+                lines.append(f"{sample}{_format_labels(sample_labels)} {sample_value}")
+    return "\n".join(lines) + "\n"
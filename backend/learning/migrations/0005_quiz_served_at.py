@@ -0,0 +1,26 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:09
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_quizzes_served(apps, schema_editor):
+    # Every quiz created before the pool existed was handed out on creation.
+    Quiz = apps.get_model('learning', 'Quiz')
+    Quiz.objects.filter(served_at__isnull=True).update(served_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning', '0004_llmcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='served_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_quizzes_served, migrations.RunPython.noop),
+    ]
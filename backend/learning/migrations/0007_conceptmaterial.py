@@ -0,0 +1,28 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning', '0006_llminflight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConceptMaterial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canonical_name', models.CharField(max_length=200)),
+                ('concept', models.CharField(max_length=200)),
+                ('is_weak_concept', models.BooleanField(default=False)),
+                ('material', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('canonical_name', 'is_weak_concept'), name='unique_concept_material')],
+            },
+        ),
+    ]
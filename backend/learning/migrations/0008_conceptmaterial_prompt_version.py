@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning', '0007_conceptmaterial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conceptmaterial',
+            name='prompt_version',
+            field=models.CharField(blank=True, max_length=12),
+        ),
+    ]
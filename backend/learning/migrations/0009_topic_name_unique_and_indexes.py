@@ -0,0 +1,49 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:37
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_topics(apps, schema_editor):
+    # get_or_create could race and create the same topic twice. Keep the
+    # oldest row per name and move quizzes and progress over to it; of the
+    # progress rows that then share a topic only the most recently updated
+    # one is kept (the others only point at attempts and paths that stay).
+    Topic = apps.get_model('learning', 'Topic')
+    Quiz = apps.get_model('learning', 'Quiz')
+    UserProgress = apps.get_model('learning', 'UserProgress')
+
+    duplicates = Topic.objects.values('name').annotate(keep=Min('pk'), rows=Count('pk')).filter(rows__gt=1)
+    for duplicate in duplicates:
+        others = Topic.objects.filter(name=duplicate['name']).exclude(pk=duplicate['keep'])
+        Quiz.objects.filter(topic__in=others).update(topic_id=duplicate['keep'])
+        UserProgress.objects.filter(topic__in=others).update(topic_id=duplicate['keep'])
+        latest = UserProgress.objects.filter(topic_id=duplicate['keep']).order_by('-last_updated', '-pk').first()
+        if latest is not None:
+            UserProgress.objects.filter(topic_id=duplicate['keep']).exclude(pk=latest.pk).delete()
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning', '0008_conceptmaterial_prompt_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_topics, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='llmcacheentry',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='topic',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(condition=models.Q(('is_final_quiz', False), ('served_at__isnull', True)), fields=['topic', 'created_at', 'id'], name='quiz_pool_idx'),
+        ),
+    ]
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import re
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+# Frozen copies of learning.grading/learning.questions as of this migration,
+# so later edits to the app code do not change what it does
+OPTION_PATTERN = re.compile(r"^\(?([A-Da-d])(?:[).]?|[).]\s+(.*))$", re.DOTALL)
+
+
+def option_text(option):
+    match = OPTION_PATTERN.match(str(option).strip())
+    if match and match.group(2) is not None:
+        return match.group(2).strip()
+    return str(option).strip()
+
+
+def normalize_option(value, options):
+    if isinstance(value, dict):
+        value = value.get("answer")
+    if value is None:
+        return None
+    text = str(value).strip()
+    match = OPTION_PATTERN.match(text)
+    if match:
+        return match.group(1).upper()
+    for index, option in enumerate(options):
+        if option_text(option).casefold() == text.casefold():
+            return "ABCD"[index] if index < 4 else None
+    return None
+
+
+def question_list(questions):
+    if isinstance(questions, dict):
+        return questions.get("questions") or []
+    return questions or []
+
+
+def question_fields(question):
+    if not isinstance(question, dict) or not str(question.get("question") or "").strip():
+        return None
+    options = question.get("options")
+    options = [str(option) for option in options] if isinstance(options, list) else []
+    answer = question.get("answer", question.get("correct_answer"))
+    concept = question.get("concept") or question.get("concept_tested") or "General"
+    return {
+        "text": str(question["question"]).strip(),
+        "concept": str(concept).strip()[:200],
+        "difficulty": str(question.get("difficulty") or "").strip().lower()[:20],
+        "options": options,
+        "answer": (normalize_option(answer, options) or str(answer or "").strip())[:200],
+        "explanation": str(question.get("explanation") or ""),
+    }
+
+
+def question_hash(fields):
+    payload = json.dumps([fields["text"], fields["options"], fields["answer"]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def store_questions(quizzes, Question, QuizQuestion):
+    links = []
+    new_questions = {}
+    for quiz_id, questions in quizzes:
+        for position, question in enumerate(question_list(questions)):
+            fields = question_fields(question)
+            if fields is None:
+                continue
+            content_hash = question_hash(fields)
+            new_questions.setdefault(content_hash, fields)
+            links.append((quiz_id, position, content_hash))
+    if not links:
+        return
+
+    Question.objects.bulk_create(
+        [Question(content_hash=content_hash, **fields) for content_hash, fields in new_questions.items()],
+        ignore_conflicts=True,
+    )
+    ids = dict(Question.objects.filter(content_hash__in=list(new_questions)).values_list('content_hash', 'pk'))
+    QuizQuestion.objects.bulk_create(
+        [
+            QuizQuestion(quiz_id=quiz_id, question_id=ids[content_hash], position=position)
+            for quiz_id, position, content_hash in links
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def backfill_questions(apps, schema_editor):
+    Quiz = apps.get_model('learning', 'Quiz')
+    Question = apps.get_model('learning', 'Question')
+    QuizQuestion = apps.get_model('learning', 'QuizQuestion')
+
+    batch = []
+    quizzes = Quiz.objects.filter(quiz_questions__isnull=True).values_list('pk', 'questions')
+    for quiz in quizzes.iterator(chunk_size=BATCH_SIZE):
+        batch.append(quiz)
+        if len(batch) == BATCH_SIZE:
+            store_questions(batch, Question, QuizQuestion)
+            batch = []
+    if batch:
+        store_questions(batch, Question, QuizQuestion)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning', '0010_question_quizquestion'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning', '0011_backfill_questions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConceptStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('concept', models.CharField(max_length=200)),
+                ('difficulty', models.CharField(blank=True, max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('weak', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='concept_stats', to='learning.topic')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('topic', 'concept', 'difficulty'), name='unique_concept_stat')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning', '0012_conceptstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('endpoint', models.CharField(blank=True, max_length=32)),
+                ('model', models.CharField(max_length=200)),
+                ('prompt_template', models.CharField(blank=True, max_length=32)),
+                ('prompt_version', models.CharField(blank=True, max_length=12)),
+                ('topic', models.CharField(blank=True, max_length=200)),
+                ('status', models.CharField(max_length=10)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('reasoning_tokens', models.PositiveIntegerField(default=0)),
+                ('cost', models.FloatField(default=0)),
+                ('duration_ms', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+    ]
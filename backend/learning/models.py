@@ -3,7 +3,7 @@ from django.db import models
 # Create your models here.
 
 class Topic(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, unique=True)  # Looked up by name on every quiz request
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -15,6 +15,17 @@ class Quiz(models.Model):
     questions = models.JSONField()  # Stores the quiz questions and answers
     created_at = models.DateTimeField(auto_now_add=True)
     is_final_quiz = models.BooleanField(default=False)
+    served_at = models.DateTimeField(null=True, blank=True)  # Null while the quiz waits in the topic's pool
+
+    class Meta:
+        indexes = [
+            # Unserved diagnostic quizzes per topic, oldest first (learning.quiz_pool)
+            models.Index(
+                fields=['topic', 'created_at', 'id'],
+                condition=models.Q(is_final_quiz=False, served_at__isnull=True),
+                name='quiz_pool_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Quiz for {self.topic.name}"
@@ -64,3 +75,135 @@ class UserProgress(models.Model):
 
     def __str__(self):
         return f"Progress in {self.topic.name}"
+
+class LLMCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True)  # sha256 of model, messages and parameters
+    model = models.CharField(max_length=200, blank=True)
+    response = models.JSONField()  # Raw OpenRouter response
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)  # Oldest entries are evicted first
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Cached response {self.key[:12]} ({self.model})"
+
+class LLMInflight(models.Model):
+    key = models.CharField(max_length=64, unique=True)  # Same key as the response cache
+    response = models.JSONField(null=True, blank=True)  # Set by the process that made the call
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)  # Lease while running, linger once completed
+
+    def __str__(self):
+        return f"In-flight call {self.key[:12]}"
+
+class ConceptMaterial(models.Model):
+    canonical_name = models.CharField(max_length=200)  # Normalised concept name shared across learners
+    concept = models.CharField(max_length=200)  # Name as the model wrote it
+    is_weak_concept = models.BooleanField(default=False)  # Weak concepts get extra practice material
+    material = models.JSONField()  # One learning-path entry
+    prompt_version = models.CharField(max_length=12, blank=True)  # Learning-path prompt version that produced it
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['canonical_name', 'is_weak_concept'], name='unique_concept_material'),
+        ]
+
+    def __str__(self):
+        return f"Material for {self.concept}{' (weak)' if self.is_weak_concept else ''}"
+
+class Question(models.Model):
+    content_hash = models.CharField(max_length=64, unique=True)  # sha256 of text, options and answer; dedupes across quizzes
+    text = models.TextField()
+    concept = models.CharField(max_length=200, db_index=True)
+    difficulty = models.CharField(max_length=20, blank=True)
+    options = models.JSONField(default=list)
+    answer = models.CharField(max_length=200, blank=True)  # Option letter when it can be resolved
+    explanation = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.concept}: {self.text[:60]}"
+
+class QuizQuestion(models.Model):
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='quiz_questions')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='quiz_questions')
+    position = models.PositiveSmallIntegerField()  # Index in Quiz.questions, which answers refer to
+
+    class Meta:
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['quiz', 'position'], name='unique_quiz_position'),
+        ]
+
+    def __str__(self):
+        return f"Question {self.position} of quiz {self.quiz_id}"
+
+class ConceptStat(models.Model):
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='concept_stats')
+    concept = models.CharField(max_length=200)
+    difficulty = models.CharField(max_length=20, blank=True)
+    attempts = models.PositiveIntegerField(default=0)  # Answered questions
+    correct = models.PositiveIntegerField(default=0)  # Correctly answered questions
+    weak = models.PositiveIntegerField(default=0)  # Answered questions whose concept the attempt flagged weak
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['topic', 'concept', 'difficulty'], name='unique_concept_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.concept} ({self.difficulty or 'any'}) in {self.topic_id}"
+
+class LLMUsage(models.Model):
+    created_at = models.DateTimeField(db_index=True)  # When the call finished, not when the row was written
+    endpoint = models.CharField(max_length=32, blank=True)
+    model = models.CharField(max_length=200)
+    prompt_template = models.CharField(max_length=32, blank=True)
+    prompt_version = models.CharField(max_length=12, blank=True)  # Hash of the prompt template text
+    topic = models.CharField(max_length=200, blank=True)  # Topic name, kept as text so the ledger outlives topics
+    status = models.CharField(max_length=10)  # ok, error, cached or coalesced; only ok and error are billed
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    reasoning_tokens = models.PositiveIntegerField(default=0)
+    cost = models.FloatField(default=0)  # USD
+    duration_ms = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.endpoint or 'call'} on {self.model} at {self.created_at}"
+
+class LLMJob(models.Model):
+    kind = models.CharField(max_length=32)  # Flow to run, one of learning.jobs.JOB_FLOWS
+    payload = models.JSONField(default=dict)  # The request data the flow is called with
+    status = models.CharField(max_length=10, default='queued')  # queued, running, done or failed
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField()  # Queued: when it may be claimed; running: when the claim expires
+    worker = models.CharField(max_length=100, blank=True)  # host:pid:thread of the last claim
+    result = models.JSONField(null=True, blank=True)  # The flow's response payload
+    result_status = models.PositiveSmallIntegerField(null=True, blank=True)  # and its HTTP status
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Pending jobs in claim order (learning.jobs)
+            models.Index(
+                fields=['available_at', 'id'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='llm_job_pending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
+
+class LLMRateBucket(models.Model):
+    name = models.CharField(max_length=64, unique=True)  # One bucket per upstream budget (learning.ratelimit)
+    tokens = models.FloatField()  # Below zero while calls wait on reserved tokens
+    refilled_at = models.FloatField()  # Unix time tokens was last brought up to date
+
+    def __str__(self):
+        return f"Rate bucket {self.name}"
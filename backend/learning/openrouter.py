@@ -1,176 +1,338 @@
-import requests
-from dotenv import load_dotenv
-import os
-import json
-from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate
 import logging
-from langsmith import Client
-from langchain.callbacks.tracers import LangChainTracer
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.tracers.langchain import LangChainTracer
-from langchain.callbacks.tracers.run_collector import RunCollectorCallbackHandler
 import time
-import uuid
 from datetime import datetime, timezone
+from asgiref.sync import sync_to_async
+from .cache import make_cache_key, response_cache
+from .http_client import StreamError, get_async_client, get_client
+from .llm_json import is_usable_reply
+from .llm_logging import log_llm_call, response_failed
+from .metrics import UPSTREAM_IN_FLIGHT
+from .prompts import SYSTEM_PROMPT
+from .ratelimit import UpstreamBusy, get_rate_limit_settings, upstream_limiter
+from .router import model_router
+from .singleflight import acoalesce, coalesce
+from .tracing import trace_llm_call
+from .usage import record_usage
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Logging is configured through settings.LOGGING
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-# Print environment variables for debugging
-logger.debug(f"LANGCHAIN_API_KEY exists: {bool(os.getenv('LANGCHAIN_API_KEY'))}")
-logger.debug(f"LANGCHAIN_PROJECT: {os.getenv('LANGCHAIN_PROJECT')}")
-logger.debug(f"LANGCHAIN_ENDPOINT: {os.getenv('LANGCHAIN_ENDPOINT')}")
-
-# Initialize LangSmith client
-try:
-    client = Client()
-    logger.debug("Successfully initialized LangSmith client")
-except Exception as e:
-    logger.error(f"Failed to initialize LangSmith client: {str(e)}")
-
-def call_openrouter(prompt, model="deepseek/deepseek-r1-0528-qwen3-8b:free"):
+def _build_request(prompt, model):
     """
-    Original implementation of OpenRouter call with LangSmith integration.
+    Build the chat-completions payload for a prompt.
     """
-    logger.debug("Starting LangChain prompt processing...")
-    
-    headers = {
-        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "SALS Assistant"
-    }
-    
-    # Use LangChain for prompt processing while keeping the original API call
-    system_template = "You're a learning assistant for DSA/DAA topics."
-    logger.debug(f"System template: {system_template}")
-    
-    # Set up LangSmith tracing
-    try:
-        run_collector = RunCollectorCallbackHandler()
-        tracer = LangChainTracer(
-            project_name="adaptive-learning-platform"
-        )
-        callback_manager = CallbackManager([tracer, run_collector])
-        logger.debug("Successfully set up LangSmith tracing")
-    except Exception as e:
-        logger.error(f"Failed to set up LangSmith tracing: {str(e)}")
-    
-    chat_prompt = ChatPromptTemplate.from_messages([
-        ("system", system_template),
-        ("user", "{input}")
-    ])
-    logger.debug("Created ChatPromptTemplate")
-    
-    # Process the prompt using LangChain's template system
-    formatted_messages = chat_prompt.format_messages(input=prompt)
-    logger.debug(f"Formatted messages: {formatted_messages}")
-    
-    # Convert to OpenRouter format
+    system_prompt = SYSTEM_PROMPT.render()
     messages = [
-        {"role": "system", "content": system_template},
+        {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt}
     ]
-    logger.debug(f"Final messages for API: {json.dumps(messages, indent=2)}")
-    
+
     data = {
         "model": model,
-        "messages": messages
+        "messages": messages,
+        "usage": {"include": True}
     }
-    
-    run_id = None
-    try:
-        logger.debug("Making API call to OpenRouter...")
-        
-        # Make the OpenRouter API call first
-        res = requests.post("https://openrouter.ai/api/v1/chat/completions", 
-                          json=data, headers=headers)
-        response = res.json()
-        
-        # Create a run in LangSmith after successful API call
+    return system_prompt, messages, data
+
+def _log_call(topic, *args, **kwargs):
+    """Log a call and queue its row in the usage ledger."""
+    record_usage(log_llm_call(*args, **kwargs), topic)
+
+def _request_key(data):
+    """Cache and coalescing key for a request: model, messages and every other parameter."""
+    params = {k: v for k, v in data.items() if k not in ("model", "messages")}
+    return make_cache_key(data["model"], data["messages"], params)
+
+def _cache_lookup(endpoint, data):
+    """
+    Return ``(cache_key, ttl, cached_response)`` for a call.
+
+    ``cache_key`` is None when the endpoint does not opt in to caching.
+    """
+    cache_ttl = response_cache.ttl_for(endpoint)
+    if not cache_ttl:
+        return None, None, None
+    cache_key = _request_key(data)
+    cached = response_cache.get(cache_key)
+    return cache_key, cache_ttl, cached
+
+def _cache_store(cache_key, cache_ttl, endpoint, model, response):
+    """
+    Cache a response, but only once it parses and validates for the endpoint.
+
+    A truncated or malformed reply would otherwise be replayed to every
+    repeat of the prompt until its TTL runs out.
+    """
+    if not cache_key:
+        return
+    if not is_usable_reply(response, endpoint):
+        logger.warning(f"Not caching an unusable {endpoint} reply from {model}")
+        return
+    response_cache.set(cache_key, response, cache_ttl, model=model)
+
+def _rate_limited(response):
+    error = response.get('error') if isinstance(response, dict) else None
+    return isinstance(error, dict) and error.get('code') == 429
+
+def _upstream_busy():
+    return UpstreamBusy("OpenRouter rate limit reached", 1 / get_rate_limit_settings()["RATE"])
+
+def _no_model(endpoint):
+    message = f"No model available for {endpoint or 'this call'}: every circuit is open"
+    return {"error": message, "text": message}
+
+def call_openrouter(prompt, model=None, endpoint=None, topic=None):
+    """
+    Call OpenRouter, tracing the call to LangSmith in the background.
+
+    ``endpoint`` names the calling feature (e.g. "learning_path"); responses
+    are served from and stored in the response cache only for endpoints that
+    opt in through settings.LLM_CACHE["ENDPOINT_TTLS"]. Identical calls that
+    are already in flight are joined rather than repeated (see
+    learning.singleflight). Every call is logged and recorded in the usage
+    ledger under ``topic`` (see learning.usage).
+
+    The model router picks the models to try (``model``, if given, first)
+    and the next one is tried whenever a model fails. Upstream calls pass
+    through the rate limiter (see learning.ratelimit); UpstreamBusy is
+    raised when one cannot be admitted or OpenRouter still answers 429.
+    """
+    response = None
+    for candidate in model_router.candidates(endpoint, preferred=model):
+        result = _call_model(prompt, candidate, endpoint, topic)
+        if result is None:
+            continue
+        response = result
+        if not response_failed(response):
+            return response
+        logger.warning(f"{candidate} failed for {endpoint}, trying the next model")
+    return response if response is not None else _no_model(endpoint)
+
+def _call_model(prompt, model, endpoint, topic=None):
+    """One routed call; returns None if the model's circuit no longer admits it."""
+    started = time.perf_counter()
+    system_prompt, messages, data = _build_request(prompt, model)
+    cache_key, cache_ttl, cached = _cache_lookup(endpoint, data)
+    if cached is not None:
+        _log_call(topic, endpoint, model, messages, cached, started, cached=True)
+        return cached
+    if not model_router.acquire(model):
+        return None
+
+    def fetch():
         try:
-            logger.debug("Attempting to create LangSmith run...")
-            
-            # Create run with more detailed information
-            current_time = datetime.now(timezone.utc)
-            run_data = {
-                "name": "openrouter_call",
-                "run_type": "chain",
-                "inputs": {
-                    "prompt": prompt,
-                    "model": model,
-                    "system_template": system_template,
-                    "messages": messages
-                },
-                "project_name": "adaptive-learning-platform",
-                "start_time": current_time,
-                "metadata": {
-                    "model": model,
-                    "api": "openrouter",
-                    "request_id": str(uuid.uuid4())
-                }
-            }
-            
-            try:
-                logger.debug("Run data:\n" + json.dumps(run_data, indent=2, default=str))
-            except Exception as e:
-                logger.warning(f"Failed to log run_data: {e}")
-
-            try:
-                # Create the run and get the run ID
-                run = client.create_run(**run_data)
-                if run and hasattr(run, 'id'):
-                    run_id = run.id
-                    logger.debug(f"Successfully created LangSmith run with ID: {run_id}")
-                else:
-                    run_id = str(uuid.uuid4())
-                    logger.warning(f"LangSmith create_run returned invalid run object, using generated ID: {run_id}")
-                
-                # Update the run with the response
-                end_time = datetime.now(timezone.utc)
-                update_data = {
-                    "run_id": run_id,
-                    "outputs": {
-                        "response": response,
-                        "completion_id": response.get('id', ''),
-                        "model": response.get('model', ''),
-                        "provider": response.get('provider', ''),
-                        "content": response.get('choices', [{}])[0].get('message', {}).get('content', '')
-                    },
-                    "end_time": end_time
-                }
-                
-                client.update_run(**update_data)
-                logger.debug(f"Successfully updated LangSmith run {run_id} with response")
-                
-            except Exception as langsmith_error:
-                logger.error(f"LangSmith operation failed: {str(langsmith_error)}")
-                logger.debug(f"API Response: {json.dumps(response, indent=2)}")
-                # Continue with the API response even if LangSmith logging fails
-        
-        except Exception as langsmith_error:
-            logger.error(f"LangSmith logging failed: {str(langsmith_error)}")
-            # Continue even if LangSmith logging fails
-        
-        logger.debug(f"API Response: {json.dumps(response, indent=2)}")
+            upstream_limiter.acquire()
+        except BaseException:
+            model_router.release(model)
+            raise
+        fetch_started = time.perf_counter()
+        try:
+            with UPSTREAM_IN_FLIGHT.track(model):
+                response, attempts = get_client().chat_completion(data)
+        except Exception:
+            model_router.record(model, time.perf_counter() - fetch_started, False)
+            raise
+        except BaseException:
+            model_router.release(model)
+            raise
+        if _rate_limited(response):
+            # Account-wide, so neither this model's fault nor avoided by the next one
+            model_router.release(model)
+            raise _upstream_busy()
+        model_router.record(model, time.perf_counter() - fetch_started, not response_failed(response))
+        _cache_store(cache_key, cache_ttl, endpoint, model, response)
+        return response, attempts
+
+    start_time = datetime.now(timezone.utc)
+    try:
+        (response, attempts), shared = coalesce(cache_key or _request_key(data), fetch)
+
+        _log_call(topic, endpoint, model, messages, response, started, attempts, coalesced=shared)
+        if not shared:
+            trace_llm_call(prompt, model, system_prompt, messages, response, start_time)
+        else:
+            model_router.release(model)
         return response
-        
+
+    except UpstreamBusy:
+        raise
     except Exception as e:
-        logger.error(f"Error in API call: {str(e)}")
-        # Try to log the error to LangSmith if possible
+        _log_call(topic, endpoint, model, messages, None, started, error=str(e))
+        trace_llm_call(prompt, model, system_prompt, messages, None, start_time, error=str(e))
+        return {"error": f"Failed to parse JSON response: {str(e)}", "text": str(e)}
+
+async def acall_openrouter(prompt, model=None, endpoint=None, topic=None):
+    """
+    Async counterpart of call_openrouter for the ASGI views.
+
+    The upstream request runs on the event loop and cache access runs in a
+    thread, so no coroutine blocks on either.
+    """
+    response = None
+    for candidate in model_router.candidates(endpoint, preferred=model):
+        result = await _acall_model(prompt, candidate, endpoint, topic)
+        if result is None:
+            continue
+        response = result
+        if not response_failed(response):
+            return response
+        logger.warning(f"{candidate} failed for {endpoint}, trying the next model")
+    return response if response is not None else _no_model(endpoint)
+
+async def _acall_model(prompt, model, endpoint, topic=None):
+    started = time.perf_counter()
+    system_prompt, messages, data = _build_request(prompt, model)
+    cache_key, cache_ttl, cached = await sync_to_async(_cache_lookup)(endpoint, data)
+    if cached is not None:
+        _log_call(topic, endpoint, model, messages, cached, started, cached=True)
+        return cached
+    if not model_router.acquire(model):
+        return None
+
+    async def fetch():
+        try:
+            await upstream_limiter.aacquire()
+        except BaseException:
+            model_router.release(model)
+            raise
+        fetch_started = time.perf_counter()
         try:
-            if run_id:
-                error_data = {
-                    "run_id": run_id,
-                    "error": str(e),
-                    "end_time": datetime.now(timezone.utc)
-                }
-                client.update_run(**error_data)
-                logger.debug(f"Successfully logged error to LangSmith run {run_id}")
-        except Exception as langsmith_error:
-            logger.error(f"Failed to log error to LangSmith: {str(langsmith_error)}")
-            
+            with UPSTREAM_IN_FLIGHT.track(model):
+                response, attempts = await get_async_client().chat_completion(data)
+        except Exception:
+            model_router.record(model, time.perf_counter() - fetch_started, False)
+            raise
+        except BaseException:
+            model_router.release(model)
+            raise
+        if _rate_limited(response):
+            model_router.release(model)
+            raise _upstream_busy()
+        model_router.record(model, time.perf_counter() - fetch_started, not response_failed(response))
+        await sync_to_async(_cache_store)(cache_key, cache_ttl, endpoint, model, response)
+        return response, attempts
+
+    start_time = datetime.now(timezone.utc)
+    try:
+        (response, attempts), shared = await acoalesce(cache_key or _request_key(data), fetch)
+
+        _log_call(topic, endpoint, model, messages, response, started, attempts, coalesced=shared)
+        if not shared:
+            trace_llm_call(prompt, model, system_prompt, messages, response, start_time)
+        else:
+            model_router.release(model)
+        return response
+
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        _log_call(topic, endpoint, model, messages, None, started, error=str(e))
+        trace_llm_call(prompt, model, system_prompt, messages, None, start_time, error=str(e))
         return {"error": f"Failed to parse JSON response: {str(e)}", "text": str(e)}
+
+def _streamed_response(model, parts, usage=None):
+    response = {"model": model, "choices": [{"message": {"role": "assistant", "content": "".join(parts)}}]}
+    if usage:
+        response["usage"] = usage
+    return response
+
+def stream_openrouter(prompt, model=None, endpoint=None, topic=None):
+    """
+    Streaming variant of call_openrouter that yields content deltas.
+
+    A cached response is replayed as a single delta. Once the stream ends,
+    the assembled reply is traced and cached like a regular call. A model
+    that fails before sending anything is skipped for the next candidate;
+    a failure mid-stream is raised.
+    """
+    error = None
+    for candidate in model_router.candidates(endpoint, preferred=model):
+        started = time.perf_counter()
+        system_prompt, messages, data = _build_request(prompt, candidate)
+        cache_key, cache_ttl, cached = _cache_lookup(endpoint, data)
+        if cached is not None:
+            _log_call(topic, endpoint, candidate, messages, cached, started, cached=True, streamed=True)
+            yield cached['choices'][0]['message']['content']
+            return
+        if not model_router.acquire(candidate):
+            continue
+        try:
+            upstream_limiter.acquire()
+        except BaseException:
+            model_router.release(candidate)
+            raise
+
+        start_time = datetime.now(timezone.utc)
+        upstream_started = time.perf_counter()
+        parts = []
+        usage = {}
+        try:
+            with UPSTREAM_IN_FLIGHT.track(candidate):
+                for delta in get_client().stream_chat_completion(data, usage):
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            model_router.record(candidate, time.perf_counter() - upstream_started, False)
+            if parts:
+                raise
+            logger.warning(f"{candidate} failed for {endpoint}, trying the next model")
+            error = e
+            continue
+        except BaseException:
+            model_router.release(candidate)
+            raise
+        model_router.record(candidate, time.perf_counter() - upstream_started, True)
+
+        response = _streamed_response(candidate, parts, usage)
+        _log_call(topic, endpoint, candidate, messages, response, started, streamed=True)
+        trace_llm_call(prompt, candidate, system_prompt, messages, response, start_time)
+        _cache_store(cache_key, cache_ttl, endpoint, candidate, response)
+        return
+    raise error or StreamError(_no_model(endpoint)["error"])
+
+async def astream_openrouter(prompt, model=None, endpoint=None, topic=None):
+    """Async variant of stream_openrouter."""
+    error = None
+    for candidate in model_router.candidates(endpoint, preferred=model):
+        started = time.perf_counter()
+        system_prompt, messages, data = _build_request(prompt, candidate)
+        cache_key, cache_ttl, cached = await sync_to_async(_cache_lookup)(endpoint, data)
+        if cached is not None:
+            _log_call(topic, endpoint, candidate, messages, cached, started, cached=True, streamed=True)
+            yield cached['choices'][0]['message']['content']
+            return
+        if not model_router.acquire(candidate):
+            continue
+        try:
+            await upstream_limiter.aacquire()
+        except BaseException:
+            model_router.release(candidate)
+            raise
+
+        start_time = datetime.now(timezone.utc)
+        upstream_started = time.perf_counter()
+        parts = []
+        usage = {}
+        try:
+            with UPSTREAM_IN_FLIGHT.track(candidate):
+                async for delta in get_async_client().stream_chat_completion(data, usage):
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            model_router.record(candidate, time.perf_counter() - upstream_started, False)
+            if parts:
+                raise
+            logger.warning(f"{candidate} failed for {endpoint}, trying the next model")
+            error = e
+            continue
+        except BaseException:
+            model_router.release(candidate)
+            raise
+        model_router.record(candidate, time.perf_counter() - upstream_started, True)
+
+        response = _streamed_response(candidate, parts, usage)
+        _log_call(topic, endpoint, candidate, messages, response, started, streamed=True)
+        trace_llm_call(prompt, candidate, system_prompt, messages, response, start_time)
+        await sync_to_async(_cache_store)(cache_key, cache_ttl, endpoint, candidate, response)
+        return
+    raise error or StreamError(_no_model(endpoint)["error"])
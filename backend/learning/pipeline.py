@@ -0,0 +1,208 @@
+"""
+Dependency-aware execution of the steps behind one request.
+
+A Pipeline is a list of named Steps, each naming the steps it needs
+(``after``). A step's function receives the results of those steps as
+keyword arguments; if it returns an LLMCall, the call is made as part of
+the step and the OpenRouter response becomes the step's result. Steps
+whose dependencies are met run concurrently, so a request takes as long
+as its critical path rather than the sum of its steps.
+
+Pipeline.run uses a bounded, process-wide thread pool; Pipeline.arun runs
+every step as a task on the event loop, awaiting the model and running
+database work through sync_to_async. Both report per-step timings on the
+``learning.pipeline`` logger. If a step fails, no further steps start,
+running ones are allowed to finish, and the error of the earliest
+declared failing step is raised. An ``optional`` step (e.g. a model call
+whose result only refines the answer) that fails is logged and yields
+None instead.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .openrouter import acall_openrouter, call_openrouter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PIPELINE_SETTINGS = {
+    "MAX_WORKERS": 32,
+}
+
+LLMCall = namedtuple("LLMCall", ["prompt", "endpoint", "topic"], defaults=[None])
+Step = namedtuple("Step", ["name", "func", "after", "optional"], defaults=[(), False])
+
+
+def get_pipeline_settings():
+    config = dict(DEFAULT_PIPELINE_SETTINGS)
+    config.update(getattr(settings, "PIPELINE", {}))
+    return config
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide step pool, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_pipeline_settings()["MAX_WORKERS"],
+                    thread_name_prefix="pipeline",
+                )
+    return _executor
+
+
+class Pipeline:
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = list(steps)
+        self.timings = {}
+        self.total_ms = None
+        self._check()
+
+    def _check(self):
+        names = [step.name for step in self.steps]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Pipeline {self.name} has duplicate step names")
+        seen = set()
+        for step in self.steps:
+            missing = [name for name in step.after if name not in seen]
+            if missing:
+                # Declaring steps after their dependencies also rules out cycles
+                raise ValueError(f"Step {step.name} depends on undeclared or later steps: {missing}")
+            seen.add(step.name)
+
+    def _record(self, step, started, origin):
+        self.timings[step.name] = {
+            "start_ms": round((started - origin) * 1000, 1),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def _first_error(self, errors):
+        for step in self.steps:
+            if step.name in errors:
+                return errors[step.name]
+
+    def _report(self, origin):
+        self.total_ms = round((time.perf_counter() - origin) * 1000, 1)
+        if logger.isEnabledFor(logging.INFO):
+            steps = " ".join(
+                f"{name}={timing['duration_ms']}ms@{timing['start_ms']}"
+                for name, timing in sorted(self.timings.items(), key=lambda item: item[1]["start_ms"])
+            )
+            logger.info(
+                "pipeline %s total_ms=%s steps=%s", self.name, self.total_ms, steps,
+                extra={"pipeline": {"name": self.name, "total_ms": self.total_ms, "steps": self.timings}},
+            )
+
+    def _skip_failed(self, step, error):
+        """The result of a failed step: None if it is optional, else the error is raised."""
+        if not step.optional:
+            raise error
+        logger.warning(f"Optional step {step.name} of pipeline {self.name} failed: {str(error)}")
+        return None
+
+    def _run_step(self, step, kwargs, origin):
+        started = time.perf_counter()
+        try:
+            value = step.func(**kwargs)
+            if isinstance(value, LLMCall):
+                value = call_openrouter(value.prompt, endpoint=value.endpoint, topic=value.topic)
+            return value
+        except Exception as e:
+            return self._skip_failed(step, e)
+        finally:
+            self._record(step, started, origin)
+
+    def _run_pooled_step(self, step, kwargs, origin):
+        try:
+            return self._run_step(step, kwargs, origin)
+        finally:
+            close_old_connections()
+
+    def run(self):
+        """Run the steps on the shared thread pool; returns {step name: result}."""
+        executor = get_executor()
+        origin = time.perf_counter()
+        results, errors, running = {}, {}, {}
+        pending = list(self.steps)
+
+        while pending or running:
+            ready = [] if errors else [s for s in pending if all(d in results for d in s.after)]
+            for step in ready:
+                pending.remove(step)
+            kwargs = {step.name: {d: results[d] for d in step.after} for step in ready}
+
+            if len(ready) == 1 and not running:
+                # Nothing to overlap with; skip the hand-off to the pool
+                step = ready[0]
+                try:
+                    results[step.name] = self._run_step(step, kwargs[step.name], origin)
+                except Exception as e:
+                    errors[step.name] = e
+                continue
+
+            for step in ready:
+                # Steps run in the request's context (e.g. its metrics)
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, self._run_pooled_step, step, kwargs[step.name], origin)] = step.name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+
+        self._report(origin)
+        if errors:
+            raise self._first_error(errors)
+        return results
+
+    async def arun(self):
+        """Run the steps as tasks on the current event loop; returns {step name: result}."""
+        origin = time.perf_counter()
+        errors = {}
+        tasks = {}
+
+        async def run_step(step, upstream):
+            kwargs = {name: await task for name, task in upstream.items()}
+            if errors:
+                return None
+            started = time.perf_counter()
+            try:
+                value = await sync_to_async(step.func)(**kwargs)
+                if isinstance(value, LLMCall):
+                    value = await acall_openrouter(value.prompt, endpoint=value.endpoint, topic=value.topic)
+                return value
+            except Exception as e:
+                if step.optional:
+                    return self._skip_failed(step, e)
+                errors[step.name] = e
+                raise
+            finally:
+                self._record(step, started, origin)
+
+        for step in self.steps:
+            upstream = {name: tasks[name] for name in step.after}
+            tasks[step.name] = asyncio.ensure_future(run_step(step, upstream))
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        self._report(origin)
+        if errors:
+            raise self._first_error(errors)
+        return dict(zip(tasks, outcomes))
@@ -1,9 +1,137 @@
+"""
+Prompt templates and the builders that fill them in.
+
+Every template is registered once at import and compiled into literal and
+field segments for both its verbose and its compact form, so rendering is
+plain string concatenation. Each compiled form has a version: a short hash
+of its text that caches, traces and logs key on, so editing a template
+invalidates whatever was produced with the old text. Rendered prompts are
+str subclasses that carry the template name and version along.
+"""
+import hashlib
 import json
+import re
+from string import Formatter
+
+from django.conf import settings
+
+# Compact mode minifies the JSON embedded in prompts and strips indentation
+# and repeated blank lines from the templates; OMIT_UNUSED_FIELDS leaves out
+# payload fields the task does not read (the question text when only the
+# concept and the answers decide what is weak).
+DEFAULT_PROMPT_SETTINGS = {
+    "COMPACT": True,
+    "OMIT_UNUSED_FIELDS": True,
+}
+
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def get_prompt_settings():
+    config = dict(DEFAULT_PROMPT_SETTINGS)
+    config.update(getattr(settings, "LLM_PROMPTS", {}))
+    return config
+
+
+def _dumps(value):
+    if get_prompt_settings()["COMPACT"]:
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return json.dumps(value, indent=2)
+
+
+def _normalize(text):
+    """Strip indentation and collapse blank lines."""
+    lines = "\n".join(line.strip() for line in text.strip().splitlines())
+    return _BLANK_LINES_RE.sub("\n\n", lines)
+
+
+class RenderedPrompt(str):
+    """A rendered prompt that remembers its template and version."""
+
+    template = None
+    version = None
+
+    @property
+    def label(self):
+        return f"{self.template}@{self.version}"
+
+
+class CompiledTemplate:
+    def __init__(self, text):
+        self.text = text
+        self.version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        self.segments = []
+        self.fields = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(f"Prompt fields must be plain names, got {{{field}}}")
+            self.segments.append((literal, field))
+            if field is not None and field not in self.fields:
+                self.fields.append(field)
+
+    def render(self, values):
+        parts = []
+        for literal, field in self.segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(values[field]))
+        return "".join(parts)
+
+
+class PromptTemplate:
+    """
+    A registered template in str.format syntax with named fields only.
+    """
+
+    def __init__(self, name, text):
+        self.name = name
+        self.verbose = CompiledTemplate(text)
+        self.compact = CompiledTemplate(_normalize(text))
+
+    def compiled(self):
+        return self.compact if get_prompt_settings()["COMPACT"] else self.verbose
+
+    @property
+    def version(self):
+        return self.compiled().version
+
+    def render(self, **values):
+        compiled = self.compiled()
+        missing = [field for field in compiled.fields if field not in values]
+        if missing:
+            raise KeyError(f"Prompt '{self.name}' is missing {missing}")
+        prompt = RenderedPrompt(compiled.render(values))
+        prompt.template = self.name
+        prompt.version = compiled.version
+        return prompt
+
+
+PROMPTS = {}
+
+
+def register(name, text):
+    if name in PROMPTS:
+        raise ValueError(f"Prompt '{name}' is already registered")
+    PROMPTS[name] = PromptTemplate(name, text)
+    return PROMPTS[name]
+
+
+def prompt_label(messages):
+    """``template@version`` of the user prompt in ``messages``, or "" for ad-hoc text."""
+    content = messages[-1].get("content") if messages else None
+    return content.label if isinstance(content, RenderedPrompt) else ""
+
+
+def prompt_versions():
+    """Current version of every registered template."""
+    return {name: template.version for name, template in PROMPTS.items()}
+
 
-def generate_quiz_prompt(topic):
-    return f"""You are an expert DSA instructor.
+SYSTEM_PROMPT = register("system", "You're a learning assistant for DSA/DAA topics.")
 
-Generate a 10-question diagnostic quiz on the topic: "{topic}".
+QUIZ_PROMPT = register("quiz", """You are an expert DSA instructor.
+
+Generate a 10-question diagnostic quiz on the topic: "{topic}".{variant}
 Rules:
 - 3 easy, 4 medium, 3 hard MCQs
 - Cover a wide range of sub-concepts
@@ -36,25 +164,13 @@ IMPORTANT FORMATTING RULES:
 4. No trailing commas
 5. No markdown formatting
 6. No additional text or explanations
-"""
-
-def generate_analysis_prompt(questions, answers):
-    qa_pairs = json.dumps([
-        {
-            "question": q["question"],
-            "concept": q["concept"],
-            "correct": q["answer"],
-            "user": a
-        }
-        for q, a in zip(questions, answers)
-    ], indent=2)
+""")
 
-    return f"""
+ANALYSIS_PROMPT = register("analysis", """
 You're an AI mentor evaluating a student's quiz answers.
 
 Each entry below includes:
-- The quiz question
-- The concept it tests
+{question_item}- The concept it tests
 - The correct answer
 - The student's submitted answer
 
@@ -64,16 +180,13 @@ Return a *deduplicated* JSON list of weak concepts, no markdown, no explanation.
 Example format: ["Binary Search", "Dynamic Programming"]
 Quiz Attempts:
 {qa_pairs}
-"""
+""")
 
-def generate_learning_path_prompt(weak_concepts, all_concepts):
-    weak_concept_list = ', '.join(weak_concepts)
-    all_concept_list = ', '.join(all_concepts)
-    return f"""
+LEARNING_PATH_PROMPT = register("learning_path", """
 You are an expert tutor creating a comprehensive learning path for DSA.
 
-The student needs to learn these concepts: {all_concept_list}
-They particularly struggled with these concepts: {weak_concept_list}
+The student needs to learn these concepts: {all_concepts}
+They particularly struggled with these concepts: {weak_concepts}
 
 Create a learning path that:
 1. Covers ALL concepts in a logical progression
@@ -121,10 +234,9 @@ Example of a single object:
 
 Order the concepts in a way that builds understanding progressively.
 For weak concepts, include more practice problems and detailed explanations.
-"""
+""")
 
-def generate_final_quiz_prompt(topic, weak_concepts, initial_weak_concepts):
-    return f"""
+FINAL_QUIZ_PROMPT = register("final_quiz", """
     Generate a final assessment quiz for the topic "{topic}" that focuses on reinforcement learning and measuring improvement.
     
     The student previously struggled with these concepts: {initial_weak_concepts}
@@ -156,4 +268,73 @@ def generate_final_quiz_prompt(topic, weak_concepts, initial_weak_concepts):
     
     Include at least 5 questions, with at least 3 focusing on previously weak concepts.
     Make sure the questions are challenging but fair, and provide clear explanations.
+    """)
+
+FINAL_FEEDBACK_PROMPT = register("final_feedback", """
+    Based on the following learning journey:
+    Initial weak concepts: {initial_weak}
+    Final weak concepts: {final_weak}
+    Improved concepts: {improved_concepts}
+    Still weak concepts: {still_weak_concepts}
+    New weak concepts: {new_weak_concepts}
+
+    Provide a detailed analysis of the student's progress and specific recommendations for further improvement.
+    Focus on:
+    1. Areas of significant improvement
+    2. Concepts that still need work
+    3. New areas that emerged as weak
+    4. Specific study recommendations
+    """)
+
+
+def generate_quiz_prompt(topic, variant=None, variants=1):
     """
+    ``variant`` (1-based, out of ``variants``) asks for a quiz distinct from
+    the topic's other variants, so concurrent generations are not coalesced
+    into one.
+    """
+    note = ""
+    if variant is not None and variants > 1:
+        note = f" This is variant {variant} of {variants}; ask different questions than the other variants."
+    return QUIZ_PROMPT.render(topic=topic, variant=note)
+
+
+def generate_analysis_prompt(questions, answers):
+    omit_question = get_prompt_settings()["OMIT_UNUSED_FIELDS"]
+    qa_pairs = _dumps([
+        {
+            **({} if omit_question else {"question": q["question"]}),
+            "concept": q["concept"],
+            "correct": q["answer"],
+            "user": a
+        }
+        for q, a in zip(questions, answers)
+    ])
+    return ANALYSIS_PROMPT.render(
+        question_item="" if omit_question else "- The quiz question\n",
+        qa_pairs=qa_pairs,
+    )
+
+
+def generate_learning_path_prompt(weak_concepts, all_concepts):
+    return LEARNING_PATH_PROMPT.render(
+        weak_concepts=', '.join(weak_concepts),
+        all_concepts=', '.join(all_concepts),
+    )
+
+
+def generate_final_quiz_prompt(topic, weak_concepts, initial_weak_concepts):
+    return FINAL_QUIZ_PROMPT.render(
+        topic=topic,
+        weak_concepts=weak_concepts,
+        initial_weak_concepts=initial_weak_concepts,
+    )
+
+
+def generate_final_feedback_prompt(metrics):
+    # The metrics are sets; sorting keeps the prompt (and so its cache and
+    # coalescing key) the same in every process
+    return FINAL_FEEDBACK_PROMPT.render(**{
+        field: sorted(metrics[field])
+        for field in ("initial_weak", "final_weak", "improved_concepts", "still_weak_concepts", "new_weak_concepts")
+    })
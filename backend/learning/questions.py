@@ -0,0 +1,89 @@
+"""
+Normalized storage of quiz questions.
+
+Quiz.questions keeps the JSON the frontend is served; alongside it every
+question is stored once as a Question row (deduplicated by a hash of its
+text, options and answer) and linked to its quizzes through QuizQuestion,
+whose position is the question's index in Quiz.questions. That makes
+questions queryable by concept and difficulty and reusable across quizzes.
+"""
+import hashlib
+import json
+
+from django.db import transaction
+
+from .grading import normalize_option, question_answer, question_concept, quiz_question_list
+from .models import Question, Quiz, QuizQuestion
+
+
+def question_fields(question):
+    """Question model fields for one quiz question, or None if it has no text."""
+    if not isinstance(question, dict) or not str(question.get("question") or "").strip():
+        return None
+    options = question.get("options")
+    options = [str(option) for option in options] if isinstance(options, list) else []
+    answer = question_answer(question)
+    return {
+        "text": str(question["question"]).strip(),
+        "concept": str(question_concept(question)).strip()[:200],
+        "difficulty": str(question.get("difficulty") or "").strip().lower()[:20],
+        "options": options,
+        "answer": (normalize_option(answer, options) or str(answer or "").strip())[:200],
+        "explanation": str(question.get("explanation") or ""),
+    }
+
+
+def question_hash(fields):
+    payload = json.dumps([fields["text"], fields["options"], fields["answer"]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def store_questions(quizzes):
+    """
+    Store the questions of ``quizzes`` (``(quiz_id, questions)`` pairs) and link them in order.
+
+    Uses three queries however many quizzes are given.
+    """
+    links = []
+    new_questions = {}
+    for quiz_id, questions in quizzes:
+        for position, question in enumerate(quiz_question_list(questions)):
+            fields = question_fields(question)
+            if fields is None:
+                continue
+            content_hash = question_hash(fields)
+            new_questions.setdefault(content_hash, fields)
+            links.append((quiz_id, position, content_hash))
+    if not links:
+        return 0
+
+    Question.objects.bulk_create(
+        [Question(content_hash=content_hash, **fields) for content_hash, fields in new_questions.items()],
+        ignore_conflicts=True,
+    )
+    ids = dict(
+        Question.objects.filter(content_hash__in=list(new_questions)).values_list("content_hash", "pk")
+    )
+    QuizQuestion.objects.bulk_create(
+        [
+            QuizQuestion(quiz_id=quiz_id, question_id=ids[content_hash], position=position)
+            for quiz_id, position, content_hash in links
+        ],
+        ignore_conflicts=True,
+    )
+    return len(links)
+
+
+def create_quizzes(topic, question_sets, **fields):
+    """Create one quiz per question set, with their normalized questions, in one transaction."""
+    with transaction.atomic():
+        quizzes = Quiz.objects.bulk_create(
+            [Quiz(topic=topic, questions=questions, **fields) for questions in question_sets]
+        )
+        store_questions([(quiz.pk, quiz.questions) for quiz in quizzes])
+    return quizzes
+
+
+def create_quiz(topic, questions, **fields):
+    """Create a quiz together with its normalized questions."""
+    return create_quizzes(topic, [questions], **fields)[0]
@@ -0,0 +1,179 @@
+import logging
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .llm_json import LLMOutputError, parse_llm_json
+from .models import Quiz, Topic
+from .openrouter import call_openrouter
+from .prompts import generate_quiz_prompt
+from .questions import create_quiz
+from .ratelimit import UpstreamBusy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SETTINGS = {
+    "ENABLED": True,
+    "LOW_WATER_MARK": 2,
+    "TARGET_SIZE": 4,
+    "DEMAND_WINDOW": 60 * 60,
+    "BACKGROUND_REFILL": False,
+    "REFILL_INTERVAL": 60,
+}
+
+
+# Outcome of refilling one topic; ``retry_after`` (seconds) is set when the
+# upstream rate limiter turned the refill away
+Refill = namedtuple("Refill", ["added", "retry_after"], defaults=[None])
+
+
+class QuizGenerationError(Exception):
+    """Raised when the model reply cannot be turned into a valid quiz."""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def get_pool_settings():
+    config = dict(DEFAULT_POOL_SETTINGS)
+    config.update(getattr(settings, "QUIZ_POOL", {}))
+    return config
+
+
+def parse_quiz_response(result):
+    """
+    Extract and validate the questions from a quiz-generation response.
+    """
+    try:
+        return parse_llm_json(result, "quiz")
+    except LLMOutputError as e:
+        raise QuizGenerationError(str(e), response=result) from e
+
+
+def generate_quiz_questions(topic_name):
+    """
+    Ask the model for a diagnostic quiz and return the validated questions.
+    """
+    return parse_quiz_response(call_openrouter(generate_quiz_prompt(topic_name), endpoint="quiz", topic=topic_name))
+
+
+def pop_quiz(topic):
+    """
+    Claim the oldest unserved diagnostic quiz for a topic in a single query.
+
+    Returns None when the topic's pool is empty.
+    """
+    table = Quiz._meta.db_table
+    skip_locked = " FOR UPDATE SKIP LOCKED" if connection.vendor == "postgresql" else ""
+    sql = (
+        f"UPDATE {table} SET served_at = %s "
+        f"WHERE id = (SELECT id FROM {table} "
+        f"WHERE topic_id = %s AND NOT is_final_quiz AND served_at IS NULL "
+        f"ORDER BY created_at, id LIMIT 1{skip_locked}) "
+        f"AND served_at IS NULL "
+        f"RETURNING id, topic_id, questions, created_at, is_final_quiz, served_at"
+    )
+    return next(iter(Quiz.objects.raw(sql, [timezone.now(), topic.pk])), None)
+
+
+def pool_size(topic):
+    return Quiz.objects.filter(topic=topic, is_final_quiz=False, served_at__isnull=True).count()
+
+
+def refill_topic(topic, target=None):
+    """
+    Generate quizzes until the topic's pool holds ``target`` entries.
+
+    Returns a Refill with the number of quizzes added, and with
+    ``retry_after`` if the upstream rate limiter stopped the refill.
+    """
+    target = target if target is not None else get_pool_settings()["TARGET_SIZE"]
+    added = 0
+    for _ in range(max(target - pool_size(topic), 0)):
+        try:
+            questions = generate_quiz_questions(topic.name)
+        except UpstreamBusy as e:
+            logger.info(f"Quiz pool refill for {topic.name} deferred, retry in {e.retry_after}s: {str(e)}")
+            return Refill(added, e.retry_after)
+        except QuizGenerationError as e:
+            logger.warning(f"Quiz pool refill for {topic.name} failed: {str(e)}")
+            break
+        create_quiz(topic, questions)
+        added += 1
+    return Refill(added)
+
+
+def topics_needing_refill(include_idle=False):
+    """
+    Topics whose pool is below the low-water mark, busiest first.
+
+    Demand is the number of diagnostic quizzes served for the topic within
+    QUIZ_POOL["DEMAND_WINDOW"]; idle topics are skipped unless asked for.
+    """
+    config = get_pool_settings()
+    since = timezone.now() - timedelta(seconds=config["DEMAND_WINDOW"])
+    topics = Topic.objects.annotate(
+        pooled=Count("quiz", filter=Q(quiz__is_final_quiz=False, quiz__served_at__isnull=True)),
+        demand=Count("quiz", filter=Q(quiz__is_final_quiz=False, quiz__served_at__gte=since)),
+    ).filter(pooled__lt=config["LOW_WATER_MARK"])
+    if not include_idle:
+        topics = topics.filter(demand__gt=0)
+    return list(topics.order_by("-demand", "pooled", "name"))
+
+
+def refill_pools(include_idle=False, target=None):
+    """Top up every topic that needs it. Returns {topic name: Refill}."""
+    added = {}
+    for topic in topics_needing_refill(include_idle=include_idle):
+        added[topic.name] = refill_topic(topic, target=target)
+    return added
+
+
+class RefillWorker(threading.Thread):
+    """
+    Daemon thread that refills pools whenever it is woken or the interval elapses.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="quiz-pool-refill", daemon=True)
+        self.interval = interval
+        self.wakeup = threading.Event()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                refill_pools()
+            except Exception as e:
+                logger.error(f"Quiz pool refill failed: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def request_refill():
+    """
+    Wake the in-process refill worker, starting it on first use.
+
+    Does nothing unless QUIZ_POOL["BACKGROUND_REFILL"] is set, so web
+    processes only run a refill thread when asked to.
+    """
+    global _worker
+    config = get_pool_settings()
+    if not (config["ENABLED"] and config["BACKGROUND_REFILL"]):
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = RefillWorker(config["REFILL_INTERVAL"])
+            _worker.start()
+    _worker.wakeup.set()
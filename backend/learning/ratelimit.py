@@ -0,0 +1,280 @@
+"""
+Admission control for upstream OpenRouter calls.
+
+OpenRouter's free models allow only a few requests a minute per account.
+Past that, a burst of users becomes a burst of 429s. Every upstream call
+first takes a token from a bucket that refills at RATE calls per second, up
+to BURST. With SHARED, the bucket is an LLMRateBucket row, updated in a
+single statement, so all worker processes draw on one budget.
+
+A call that finds the bucket empty reserves the next token and sleeps until
+it is due, but only if it is due within MAX_WAIT seconds. The outstanding
+reservations form a queue with a deadline, served in arrival order across
+processes. Within a process, at most MAX_WAITERS calls wait at once, and at
+most MAX_WAITERS_PER_CLIENT for any one client (see ClientMiddleware). One
+client's burst therefore cannot take the whole queue. Calls made outside a
+request (job workers, quiz pool refills) count as a single "background"
+client without the per-client cap; batch threads run in the request's
+context and count as its client. A call that cannot be
+admitted raises UpstreamBusy at once, and the views answer it with 503 and
+Retry-After. Upstream throughput stays at RATE instead of collapsing into
+retried 429s.
+
+The limiter is off unless ENABLED is set. BURST and MAX_WAITERS_PER_CLIENT
+default to the batch fan-out (QUIZ_BATCH["MAX_CONCURRENCY"]), so turning it
+on does not turn away a single client's batch at once.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .metrics import UPSTREAM_ADMISSIONS, UPSTREAM_QUEUE_WAIT
+from .models import LLMRateBucket
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMIT_SETTINGS = {
+    "ENABLED": False,
+    "RATE": 20 / 60,
+    "BURST": 8,
+    "SHARED": True,
+    "BUCKET": "openrouter",
+    "MAX_WAIT": 10,
+    "MAX_WAITERS": 32,
+    "MAX_WAITERS_PER_CLIENT": 8,
+    "CLIENT_HEADER": None,
+}
+
+
+def get_rate_limit_settings():
+    config = dict(DEFAULT_RATE_LIMIT_SETTINGS)
+    config.update(getattr(settings, "LLM_RATE_LIMIT", {}))
+    return config
+
+
+class UpstreamBusy(Exception):
+    """Raised when an upstream call cannot be admitted; ``retry_after`` is in whole seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class LocalBucket:
+    """Token bucket for this process only."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._stamp = clock()
+
+    def reserve(self, max_wait):
+        """
+        Take a token, possibly one that has not been refilled yet.
+
+        Returns ``(True, wait)`` with the seconds until the token is due, or
+        ``(False, retry_after)`` when it is more than ``max_wait`` away.
+        """
+        with self._lock:
+            now = self._clock()
+            tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if tokens - 1 < -self.rate * max_wait:
+                self._tokens = tokens
+                return False, (1 - tokens) / self.rate - max_wait
+            self._tokens = tokens - 1
+            return True, max(0.0, (1 - tokens) / self.rate)
+
+
+class DatabaseBucket:
+    """Token bucket kept in an LLMRateBucket row and shared by every process on the database."""
+
+    def __init__(self, name, rate, burst, clock=time.time):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+
+    def _level(self, now):
+        """SQL for the refilled token count, capped at the burst size."""
+        refilled = "(tokens + (%s - refilled_at) * %s)"
+        return (
+            f"(CASE WHEN {refilled} > %s THEN %s ELSE {refilled} END)",
+            [now, self.rate, self.burst, self.burst, now, self.rate],
+        )
+
+    def reserve(self, max_wait):
+        """Same contract as LocalBucket.reserve, in one UPDATE ... RETURNING."""
+        now = self._clock()
+        level, params = self._level(now)
+        table = LLMRateBucket._meta.db_table
+        sql = (
+            f"UPDATE {table} SET tokens = {level} - 1, refilled_at = %s "
+            f"WHERE name = %s AND {level} - 1 >= %s "
+            f"RETURNING tokens"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [now, self.name] + params + [-self.rate * max_wait])
+            row = cursor.fetchone()
+        if row is not None:
+            return True, max(0.0, -row[0] / self.rate)
+
+        bucket = LLMRateBucket.objects.filter(name=self.name).first()
+        if bucket is None:
+            LLMRateBucket.objects.get_or_create(name=self.name, defaults={"tokens": self.burst, "refilled_at": now})
+            return self.reserve(max_wait)
+        tokens = min(self.burst, bucket.tokens + (now - bucket.refilled_at) * self.rate)
+        return False, (1 - tokens) / self.rate - max_wait
+
+
+BACKGROUND = "background"
+
+# The client a call is made for, set per request by ClientMiddleware
+_client = contextvars.ContextVar("learning_upstream_client", default=BACKGROUND)
+
+
+def current_client():
+    return _client.get()
+
+
+def client_key(request):
+    header = get_rate_limit_settings()["CLIENT_HEADER"]
+    forwarded = request.META.get(header, "") if header else ""
+    return forwarded.split(",")[0].strip() or request.META.get("REMOTE_ADDR") or "unknown"
+
+
+class ClientMiddleware:
+    """Tag upstream calls with the client they are made for, for per-client fairness."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _client.set(client_key(request))
+        try:
+            return self.get_response(request)
+        finally:
+            _client.reset(token)
+
+    async def __acall__(self, request):
+        token = _client.set(client_key(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            _client.reset(token)
+
+
+class UpstreamLimiter:
+    """
+    The process-wide gate every upstream call goes through.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiting = Counter()
+        self._bucket = None
+        self._bucket_key = None
+
+    def _get_bucket(self, config):
+        key = (config["SHARED"], config["BUCKET"], config["RATE"], config["BURST"])
+        with self._lock:
+            if key != self._bucket_key:
+                if config["SHARED"]:
+                    self._bucket = DatabaseBucket(config["BUCKET"], config["RATE"], config["BURST"])
+                else:
+                    self._bucket = LocalBucket(config["RATE"], config["BURST"])
+                self._bucket_key = key
+            return self._bucket
+
+    def _enter(self, client, config):
+        """Claim a place in this process's wait queue."""
+        with self._lock:
+            if sum(self._waiting.values()) >= config["MAX_WAITERS"]:
+                reason = "too many calls are already waiting"
+            elif client != BACKGROUND and self._waiting[client] >= config["MAX_WAITERS_PER_CLIENT"]:
+                reason = "too many of this client's calls are already waiting"
+            else:
+                self._waiting[client] += 1
+                return
+        UPSTREAM_ADMISSIONS.inc("rejected")
+        raise UpstreamBusy(f"Upstream is busy: {reason}", 1 / config["RATE"])
+
+    def _leave(self, client):
+        with self._lock:
+            self._waiting[client] -= 1
+            if not self._waiting[client]:
+                del self._waiting[client]
+
+    def _reserve(self, config):
+        """Seconds to wait for this call's token; raises UpstreamBusy past MAX_WAIT."""
+        try:
+            admitted, wait = self._get_bucket(config).reserve(config["MAX_WAIT"])
+        except DatabaseError as e:
+            # Better to risk a 429 than to fail calls because the bucket row is unavailable
+            logger.warning(f"Rate limit bucket unavailable, admitting the call: {str(e)}")
+            return 0.0
+        if not admitted:
+            UPSTREAM_ADMISSIONS.inc("rejected")
+            raise UpstreamBusy("Upstream rate limit reached", wait)
+        UPSTREAM_ADMISSIONS.inc("queued" if wait > 0 else "admitted")
+        return wait
+
+    def acquire(self):
+        """Block until the next upstream call may be made (or raise UpstreamBusy)."""
+        config = get_rate_limit_settings()
+        if not config["ENABLED"]:
+            return 0.0
+        client = current_client()
+        self._enter(client, config)
+        try:
+            wait = self._reserve(config)
+            if wait > 0:
+                time.sleep(wait)
+                UPSTREAM_QUEUE_WAIT.observe(wait)
+            return wait
+        finally:
+            self._leave(client)
+
+    async def aacquire(self):
+        """Async counterpart of acquire."""
+        config = get_rate_limit_settings()
+        if not config["ENABLED"]:
+            return 0.0
+        client = current_client()
+        self._enter(client, config)
+        try:
+            if config["SHARED"]:
+                wait = await sync_to_async(self._reserve)(config)
+            else:
+                wait = self._reserve(config)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                UPSTREAM_QUEUE_WAIT.observe(wait)
+            return wait
+        finally:
+            self._leave(client)
+
+    def waiting(self):
+        with self._lock:
+            return dict(self._waiting)
+
+
+upstream_limiter = UpstreamLimiter()
@@ -0,0 +1,220 @@
+"""
+Model routing for OpenRouter calls.
+
+The router keeps a rolling window of latency and outcome samples per model
+and a circuit breaker on top of it. For every call it hands out an ordered
+list of candidate models:
+
+- models come in the configured LLM_ROUTER["MODELS"] order, the first
+  being the primary;
+- models over the endpoint's cost budget are left out;
+- models whose recent p95 latency exceeds the endpoint's latency budget
+  move behind those within it;
+- models with an open circuit are skipped until their cool-down ends,
+  after which a single probe call is let through (half-open). When every
+  circuit is open the list is empty and the call fails fast.
+
+call_openrouter walks the list until a model answers, claiming each model
+with acquire() and reporting the outcome with record(). snapshot()
+returns the whole routing state for inspection.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+DEFAULT_MODEL = "deepseek/deepseek-r1-0528-qwen3-8b:free"
+
+DEFAULT_ROUTER_SETTINGS = {
+    "MODELS": [DEFAULT_MODEL],
+    "COSTS": {},
+    "ENDPOINTS": {},
+    "MAX_MODELS_PER_CALL": 3,
+    "WINDOW": 50,
+    "MIN_SAMPLES": 5,
+    "FAILURE_RATE": 0.5,
+    "CONSECUTIVE_FAILURES": 3,
+    "OPEN_SECONDS": 30,
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def get_router_settings():
+    config = dict(DEFAULT_ROUTER_SETTINGS)
+    config.update(getattr(settings, "LLM_ROUTER", {}))
+    return config
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ModelStats:
+    """
+    Rolling samples and circuit state for one model. Not thread-safe on its
+    own; ModelRouter serializes access.
+    """
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # (latency seconds, ok)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+
+    def latencies(self):
+        return [latency for latency, ok in self.samples if ok]
+
+    def failure_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def p95(self):
+        return _percentile(self.latencies(), 0.95)
+
+
+class ModelRouter:
+    def __init__(self, config=None, clock=time.monotonic):
+        self._config = config
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @property
+    def config(self):
+        return self._config or get_router_settings()
+
+    def _get(self, model):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats(self.config["WINDOW"])
+        return stats
+
+    def primary(self):
+        return self.config["MODELS"][0]
+
+    def _reopens_in(self, stats, now):
+        return max(0.0, self.config["OPEN_SECONDS"] - (now - stats.opened_at))
+
+    def _available(self, stats, now):
+        if stats.state == CLOSED:
+            return True
+        if stats.probe_in_flight:
+            return False
+        return stats.state == HALF_OPEN or self._reopens_in(stats, now) == 0
+
+    def candidates(self, endpoint=None, preferred=None):
+        """Ordered models to try for one call to ``endpoint``."""
+        config = self.config
+        budget = config["ENDPOINTS"].get(endpoint, {})
+        max_cost = budget.get("MAX_COST")
+        latency_budget = budget.get("LATENCY_BUDGET")
+
+        models = list(config["MODELS"])
+        if preferred:
+            models = [preferred] + [m for m in models if m != preferred]
+        if max_cost is not None:
+            models = [m for m in models if m == preferred or config["COSTS"].get(m, 0) <= max_cost]
+
+        now = self._clock()
+        within, over = [], []
+        with self._lock:
+            for model in models:
+                stats = self._get(model)
+                if not self._available(stats, now):
+                    continue
+                p95 = stats.p95()
+                slow = latency_budget is not None and p95 is not None and p95 > latency_budget
+                (over if slow else within).append(model)
+        return (within + over)[:config["MAX_MODELS_PER_CALL"]]
+
+    def acquire(self, model):
+        """
+        Claim a call to ``model`` right before making it.
+
+        Returns False if the model became unavailable since candidates()
+        (e.g. another caller took its half-open probe).
+        """
+        now = self._clock()
+        with self._lock:
+            stats = self._get(model)
+            if stats.state == CLOSED:
+                return True
+            if not self._available(stats, now):
+                return False
+            stats.state = HALF_OPEN
+            stats.probe_in_flight = True
+            return True
+
+    def record(self, model, latency, ok):
+        """Record the outcome of one upstream call and update the model's circuit."""
+        config = self.config
+        with self._lock:
+            stats = self._get(model)
+            stats.samples.append((latency, ok))
+            stats.calls += 1
+            stats.probe_in_flight = False
+            if ok:
+                stats.consecutive_failures = 0
+                if stats.state != CLOSED:
+                    stats.state = CLOSED
+                    stats.opened_at = None
+                return
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            tripped = stats.consecutive_failures >= config["CONSECUTIVE_FAILURES"] or (
+                len(stats.samples) >= config["MIN_SAMPLES"] and stats.failure_rate() >= config["FAILURE_RATE"]
+            )
+            if stats.state == HALF_OPEN or tripped:
+                stats.state = OPEN
+                stats.opened_at = self._clock()
+
+    def release(self, model):
+        """Give back a half-open probe whose call was abandoned."""
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is not None and stats.state == HALF_OPEN and stats.probe_in_flight:
+                stats.probe_in_flight = False
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def snapshot(self):
+        """Routing state per model plus the current candidates per endpoint."""
+        config = self.config
+        now = self._clock()
+        models = {}
+        with self._lock:
+            for model in dict.fromkeys(list(config["MODELS"]) + list(self._stats)):
+                stats = self._get(model)
+                latencies = stats.latencies()
+                models[model] = {
+                    "state": stats.state,
+                    "reopens_in": round(self._reopens_in(stats, now), 1) if stats.state == OPEN else None,
+                    "calls": stats.calls,
+                    "failures": stats.failures,
+                    "consecutive_failures": stats.consecutive_failures,
+                    "window_failure_rate": round(stats.failure_rate(), 3),
+                    "p50_latency": _percentile(latencies, 0.5),
+                    "p95_latency": _percentile(latencies, 0.95),
+                    "cost": config["COSTS"].get(model, 0),
+                }
+        return {
+            "models": models,
+            "endpoints": {
+                endpoint: {"budget": budget, "order": self.candidates(endpoint)}
+                for endpoint, budget in config["ENDPOINTS"].items()
+            },
+        }
+
+
+model_router = ModelRouter()
@@ -0,0 +1,241 @@
+"""
+Coalescing of identical in-flight OpenRouter calls.
+
+When many requests need the same completion at once (a class opening the
+same topic), only the first one calls upstream; the others wait for it and
+share its result. Within a process this works across threads and
+coroutines alike: every flight is a concurrent.futures.Future that threads
+wait on directly and coroutines await through asyncio.wrap_future.
+
+With LLM_SINGLE_FLIGHT["CROSS_PROCESS"] the leader of each process also
+claims the key in the LLMInflight table, so one call is made across all
+workers sharing the database. Waiting processes poll the row until the
+result is stored, and take over if the leader's lease runs out.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import LLMInflight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINGLE_FLIGHT_SETTINGS = {
+    "ENABLED": True,
+    "CROSS_PROCESS": False,
+    "LEASE": 180,
+    "POLL_INTERVAL": 0.25,
+    "RESULT_TTL": 5,
+}
+
+
+def get_single_flight_settings():
+    config = dict(DEFAULT_SINGLE_FLIGHT_SETTINGS)
+    config.update(getattr(settings, "LLM_SINGLE_FLIGHT", {}))
+    return config
+
+
+class _LeaderGone(Exception):
+    """The leading caller went away without a result; a waiter takes over."""
+
+
+class SingleFlight:
+    """
+    In-process group of flights keyed by cache key.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._counters = {"leaders": 0, "shared": 0}
+
+    def _join(self, key):
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self._counters["shared"] += 1
+                return future, False
+            future = Future()
+            # A running future cannot be cancelled by a departing waiter
+            future.set_running_or_notify_cancel()
+            self._flights[key] = future
+            self._counters["leaders"] += 1
+            return future, True
+
+    def _land(self, key, future, result=None, error=None):
+        with self._lock:
+            self._flights.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn):
+        """
+        Call ``fn`` unless an identical call is in flight.
+
+        Returns ``(result, shared)``; ``shared`` is True when the result
+        came from another caller's flight.
+        """
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result(), True
+                except _LeaderGone:
+                    continue
+            try:
+                result = fn()
+            except Exception as e:
+                self._land(key, future, error=e)
+                raise
+            except BaseException:
+                self._land(key, future, error=_LeaderGone())
+                raise
+            self._land(key, future, result)
+            return result, False
+
+    async def ado(self, key, afn):
+        """Coroutine version of do(); ``afn`` is an async callable."""
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return await asyncio.wrap_future(future), True
+                except _LeaderGone:
+                    continue
+            try:
+                result = await afn()
+            except Exception as e:
+                self._land(key, future, error=e)
+                raise
+            except BaseException:
+                # Cancelled (e.g. the client disconnected); let a waiter retry
+                self._land(key, future, error=_LeaderGone())
+                raise
+            self._land(key, future, result)
+            return result, False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._flights)
+        return stats
+
+
+flights = SingleFlight()
+
+
+# Cross-process flights
+#
+# _claim returns one of these states for the calling process.
+LEAD, DONE, WAIT = "lead", "done", "wait"
+
+
+def _claim(key, lease):
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            LLMInflight.objects.create(key=key, expires_at=now + timedelta(seconds=lease))
+        return LEAD, None
+    except IntegrityError:
+        pass
+
+    row = LLMInflight.objects.filter(key=key).values("response", "completed_at", "expires_at").first()
+    if row is None:
+        return WAIT, None
+    if row["expires_at"] <= now:
+        # Leader died or the shared result is stale; clear it and claim on the next poll
+        LLMInflight.objects.filter(key=key, expires_at=row["expires_at"]).delete()
+        return WAIT, None
+    if row["completed_at"] is not None:
+        return DONE, row["response"]
+    return WAIT, None
+
+
+def _complete(key, result, result_ttl):
+    now = timezone.now()
+    LLMInflight.objects.filter(key=key).update(
+        response=result, completed_at=now, expires_at=now + timedelta(seconds=result_ttl)
+    )
+    LLMInflight.objects.filter(expires_at__lt=now).delete()
+
+
+def _abandon(key):
+    LLMInflight.objects.filter(key=key, completed_at__isnull=True).delete()
+
+
+def db_do(key, fn, config):
+    """
+    Cross-process do(); ``fn``'s result must be JSON-serializable.
+
+    Results shared through the database come back as decoded JSON (tuples
+    become lists).
+    """
+    while True:
+        state, result = _claim(key, config["LEASE"])
+        if state == DONE:
+            return result, True
+        if state == WAIT:
+            time.sleep(config["POLL_INTERVAL"])
+            continue
+        try:
+            result = fn()
+        except BaseException:
+            _abandon(key)
+            raise
+        _complete(key, result, config["RESULT_TTL"])
+        return result, False
+
+
+async def adb_do(key, afn, config):
+    """Coroutine version of db_do()."""
+    while True:
+        state, result = await sync_to_async(_claim)(key, config["LEASE"])
+        if state == DONE:
+            return result, True
+        if state == WAIT:
+            await asyncio.sleep(config["POLL_INTERVAL"])
+            continue
+        try:
+            result = await afn()
+        except BaseException:
+            await asyncio.shield(sync_to_async(_abandon)(key))
+            raise
+        await sync_to_async(_complete)(key, result, config["RESULT_TTL"])
+        return result, False
+
+
+def coalesce(key, fn):
+    """
+    Run ``fn`` once per key across concurrent callers; returns ``(result, shared)``.
+    """
+    config = get_single_flight_settings()
+    if not config["ENABLED"]:
+        return fn(), False
+    if not config["CROSS_PROCESS"]:
+        return flights.do(key, fn)
+
+    # Threads of this process queue behind one database claim
+    (result, db_shared), shared = flights.do(key, lambda: db_do(key, fn, config))
+    return result, shared or db_shared
+
+
+async def acoalesce(key, afn):
+    """Coroutine version of coalesce(); ``afn`` is an async callable."""
+    config = get_single_flight_settings()
+    if not config["ENABLED"]:
+        return await afn(), False
+    if not config["CROSS_PROCESS"]:
+        return await flights.ado(key, afn)
+
+    (result, db_shared), shared = await flights.ado(key, lambda: adb_do(key, afn, config))
+    return result, shared or db_shared
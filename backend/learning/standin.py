@@ -0,0 +1,383 @@
+"""
+Local stand-in for the OpenRouter chat-completions endpoint.
+
+Answers POST /chat/completions with replies that pass the schemas in
+learning.llm_json: it recognises which prompt it was sent (diagnostic quiz,
+analysis, learning path, final quiz, final feedback), pulls the topic and
+concepts out of it and builds a matching reply. Latency is drawn from a
+configurable distribution (optionally per endpoint), a share of calls fail
+with an upstream error status or return an unparseable reply, and
+``stream: true`` requests are answered as server-sent events in chunks.
+
+Point the backend at it with OPENROUTER_BASE_URL=http://127.0.0.1:<port>.
+GET /stats returns the calls served per endpoint and outcome. The module
+only uses the standard library so load tests can run it without Django;
+``python manage.py openrouter_standin`` serves it from the command line.
+
+Latency specs:
+    0.5                   fixed 0.5 s
+    fixed:0.5             same
+    uniform:0.2,1.5       uniform between the bounds
+    normal:1.0,0.3        normal(mean, stddev), clipped at 0
+    lognormal:1.2,0.5     log-normal with the given median and sigma
+    exp:0.8               exponential with the given mean
+"""
+import ast
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINT_MARKERS = [
+    ("quiz", "diagnostic quiz"),
+    ("analysis", "evaluating a student's quiz answers"),
+    ("learning_path", "creating a comprehensive learning path"),
+    ("final_quiz", "final assessment quiz"),
+    ("final_feedback", "following learning journey"),
+]
+
+ERROR_STATUSES = (429, 500, 503)
+
+_TOPIC_RE = re.compile(r'topic:? "([^"]+)"')
+_CONCEPT_RE = re.compile(r'"concept":\s*"([^"]+)"')
+_LETTERS = "ABCD"
+
+
+def parse_latency(spec):
+    """Turn a latency spec (see the module docstring) into a sampler taking an RNG."""
+    spec = str(spec).strip()
+    kind, _, args = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+    try:
+        values = [float(v) for v in args.split(",")] if args else []
+    except ValueError:
+        raise ValueError(f"Invalid latency spec: {spec!r}")
+
+    expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+    if kind not in expected or len(values) != expected[kind]:
+        raise ValueError(f"Invalid latency spec: {spec!r}")
+
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, values[1]) if values[0] > 0 else 0.0
+    return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+
+
+def detect_endpoint(prompt):
+    for endpoint, marker in ENDPOINT_MARKERS:
+        if marker in prompt:
+            return endpoint
+    return "unknown"
+
+
+def _line_after(prompt, label):
+    for line in prompt.splitlines():
+        line = line.strip()
+        if line.startswith(label):
+            return line[len(label):].strip()
+    return ""
+
+
+def _concept_list(text):
+    """Concepts rendered either as a Python/JSON list or comma-separated."""
+    if text.startswith("["):
+        try:
+            return [str(c) for c in ast.literal_eval(text)]
+        except (ValueError, SyntaxError):
+            pass
+    return [c.strip() for c in text.split(",") if c.strip()]
+
+
+def _topic(prompt):
+    match = _TOPIC_RE.search(prompt)
+    return match.group(1) if match else "DSA"
+
+
+def quiz_reply(prompt, serial):
+    topic = _topic(prompt)
+    difficulties = ["easy"] * 3 + ["medium"] * 4 + ["hard"] * 3
+    return [
+        {
+            "question": f"[{serial}] Which statement about {topic} concept {i % 4 + 1} holds in case {i + 1}?",
+            "options": [f"{letter}) {topic} option {letter.lower()}{i + 1}" for letter in _LETTERS],
+            "answer": _LETTERS[(serial + i) % 4],
+            "difficulty": difficulty,
+            "concept": f"{topic} concept {i % 4 + 1}",
+        }
+        for i, difficulty in enumerate(difficulties)
+    ]
+
+
+def analysis_reply(prompt, serial):
+    concepts = list(dict.fromkeys(_CONCEPT_RE.findall(prompt)))
+    return concepts[::2]
+
+
+def learning_path_reply(prompt, serial):
+    concepts = _concept_list(_line_after(prompt, "The student needs to learn these concepts:"))
+    weak = set(_concept_list(_line_after(prompt, "They particularly struggled with these concepts:")))
+    return [
+        {
+            "concept": concept,
+            "explanation": f"Work through {concept} on small inputs before tackling the general case.",
+            "resource": "https://www.geeksforgeeks.org/fundamentals-of-algorithms/",
+            "practice_problems": [f"{concept} drill {n}" for n in range(1, 5 if concept in weak else 3)],
+            "is_weak_concept": concept in weak,
+            "related_concepts": [c for c in concepts if c != concept][:2],
+        }
+        for concept in concepts or ["Foundations"]
+    ]
+
+
+def final_quiz_reply(prompt, serial):
+    topic = _topic(prompt)
+    weak = _concept_list(_line_after(prompt, "They have been working on improving these areas:"))
+    concepts = weak or [f"{topic} concept {n}" for n in range(1, 4)]
+    questions = []
+    for i in range(max(5, len(concepts))):
+        concept = concepts[i % len(concepts)]
+        letter = _LETTERS[(serial + i) % 4]
+        questions.append({
+            "id": i + 1,
+            "question": f"[{serial}] How would you apply {concept} in scenario {i + 1}?",
+            "options": [f"{l}) Approach {l.lower()}" for l in _LETTERS],
+            "correct_answer": letter,
+            "explanation": f"Approach {letter.lower()} is the one that uses {concept} correctly.",
+            "concept_tested": concept,
+            "difficulty": ("easy", "medium", "hard")[i % 3],
+            "is_reinforcement": i < len(weak),
+        })
+    return {
+        "title": f"Final Assessment Quiz - {topic}",
+        "description": "This quiz measures your improvement and understanding after the learning path",
+        "questions": questions,
+    }
+
+
+def final_feedback_reply(prompt, serial):
+    return (
+        "You improved steadily on the concepts you practised. Keep revising the ones that are still weak "
+        "with timed problems, and revisit the related concepts listed in your learning path."
+    )
+
+
+REPLIES = {
+    "quiz": quiz_reply,
+    "analysis": analysis_reply,
+    "learning_path": learning_path_reply,
+    "final_quiz": final_quiz_reply,
+    "final_feedback": final_feedback_reply,
+}
+
+
+def reply_for(prompt, serial=0):
+    """The endpoint a prompt belongs to and the reply text the stand-in gives it."""
+    endpoint = detect_endpoint(prompt)
+    builder = REPLIES.get(endpoint)
+    if builder is None:
+        return endpoint, "OK"
+    reply = builder(prompt, serial)
+    return endpoint, reply if isinstance(reply, str) else json.dumps(reply, indent=2)
+
+
+class Behaviour:
+    """
+    How the stand-in answers: latency, failures and streaming pace.
+
+    ``latency`` is a spec or sampler applied before every reply (before
+    the first chunk when streaming); ``endpoint_latency`` overrides it per
+    endpoint. ``error_rate`` of the calls fail with one of
+    ``error_statuses``, and ``bad_reply_rate`` of the rest return text
+    without the expected JSON. With ``rate_limit`` (calls per second, in
+    bursts of up to ``rate_burst``) calls beyond the limit get a 429, like
+    OpenRouter's free models.
+    """
+
+    def __init__(self, latency=0.0, endpoint_latency=None, error_rate=0.0, error_statuses=ERROR_STATUSES,
+                 bad_reply_rate=0.0, chunk_size=40, chunk_delay=0.01, rate_limit=None, rate_burst=1, seed=None):
+        self.latency = parse_latency(latency) if not callable(latency) else latency
+        self.endpoint_latency = {
+            endpoint: parse_latency(spec) if not callable(spec) else spec
+            for endpoint, spec in (endpoint_latency or {}).items()
+        }
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.bad_reply_rate = bad_reply_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.tokens = float(rate_burst)
+        self.refilled_at = time.monotonic()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def _over_limit(self):
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.rate_burst, self.tokens + (now - self.refilled_at) * self.rate_limit)
+        self.refilled_at = now
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+
+    def draw(self, endpoint):
+        """Latency, error status (or None) and whether to garble the reply for one call."""
+        sampler = self.endpoint_latency.get(endpoint, self.latency)
+        with self.lock:
+            delay = sampler(self.rng)
+            status = self.rng.choice(self.error_statuses) if self.rng.random() < self.error_rate else None
+            if self._over_limit():
+                status = 429
+            bad = status is None and self.rng.random() < self.bad_reply_rate
+        return delay, status, bad
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, behaviour):
+        super().__init__(address, StandinHandler)
+        self.behaviour = behaviour
+        self.counts = Counter()
+        self.serial = 0
+        self.count_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # A caller that timed out has already hung up; that is expected here
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_serial(self):
+        with self.count_lock:
+            self.serial += 1
+            return self.serial
+
+    def count(self, endpoint, outcome):
+        with self.count_lock:
+            self.counts[f"{endpoint}:{outcome}"] += 1
+
+    def stats(self):
+        with self.count_lock:
+            return dict(self.counts)
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+            return
+
+        messages = payload.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        serial = self.server.next_serial()
+        endpoint, content = reply_for(prompt, serial)
+        delay, status, bad = self.server.behaviour.draw(endpoint)
+        time.sleep(delay)
+
+        if status is not None:
+            self.server.count(endpoint, status)
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._send_json(status, {"error": {"code": status, "message": "Stand-in upstream error"}}, headers)
+            return
+        if bad:
+            content = "I'm sorry, I can't produce that right now."
+        self.server.count(endpoint, "bad_reply" if bad else "ok")
+
+        usage = {
+            "prompt_tokens": sum(_estimate_tokens(m.get("content", "")) for m in messages),
+            "completion_tokens": _estimate_tokens(content),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = payload.get("model", "standin")
+        if payload.get("stream"):
+            try:
+                self._stream(serial, model, content, usage)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the caller stopped reading
+            return
+        self._send_json(200, {
+            "id": f"standin-{serial}",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, serial, model, content, usage):
+        behaviour = self.server.behaviour
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._write_chunk(b": OPENROUTER PROCESSING\n\n")
+        for start in range(0, len(content), behaviour.chunk_size):
+            chunk = {
+                "id": f"standin-{serial}",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[start:start + behaviour.chunk_size]}}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            if behaviour.chunk_delay:
+                time.sleep(behaviour.chunk_delay)
+        final = {"id": f"standin-{serial}", "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+def start_standin(host="127.0.0.1", port=0, **behaviour):
+    """Serve the stand-in from a background thread; returns the server (see ``.url``)."""
+    server = StandinServer((host, port), Behaviour(**behaviour))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
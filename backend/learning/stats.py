@@ -0,0 +1,101 @@
+"""
+Per-concept performance counters.
+
+Every graded attempt adds its question outcomes to one ConceptStat row per
+(topic, concept, difficulty): answered questions, correct answers and
+answers whose concept the attempt flagged weak. The counters are bumped in
+place with F() expressions, so concurrent attempts never lose updates and
+reading the stats never touches UserQuizAttempt. rebuild_concept_stats
+recomputes them from the attempt history.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .grading import grade_quiz
+from .models import ConceptStat, UserQuizAttempt
+
+
+def attempt_counts(grade, weak_concepts):
+    """``{(concept, difficulty): [attempts, correct, weak]}`` for one graded attempt."""
+    weak = set(weak_concepts or ())
+    counts = defaultdict(lambda: [0, 0, 0])
+    for result in grade["results"]:
+        if not result["answered"]:
+            continue
+        concept = str(result["concept"]).strip()[:200]
+        difficulty = str(result.get("difficulty") or "").strip().lower()[:20]
+        row = counts[(concept, difficulty)]
+        row[0] += 1
+        row[1] += int(result["correct"])
+        row[2] += int(result["concept"] in weak)
+    return counts
+
+
+def record_attempt(topic_id, grade, weak_concepts):
+    """Add one graded attempt to the topic's counters."""
+    counts = attempt_counts(grade, weak_concepts)
+    if not counts:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        ConceptStat.objects.bulk_create(
+            [ConceptStat(topic_id=topic_id, concept=concept, difficulty=difficulty) for concept, difficulty in counts],
+            ignore_conflicts=True,
+        )
+        for (concept, difficulty), (answered, correct, weak) in counts.items():
+            ConceptStat.objects.filter(topic_id=topic_id, concept=concept, difficulty=difficulty).update(
+                attempts=F("attempts") + answered,
+                correct=F("correct") + correct,
+                weak=F("weak") + weak,
+                updated_at=now,
+            )
+
+
+def concept_stats(topic):
+    """Per-concept totals for a topic, with a breakdown by difficulty."""
+    concepts = {}
+    rows = ConceptStat.objects.filter(topic=topic).values_list("concept", "difficulty", "attempts", "correct", "weak")
+    for concept, difficulty, attempts, correct, weak in rows:
+        entry = concepts.setdefault(concept, {"concept": concept, "attempts": 0, "correct": 0, "weak": 0, "by_difficulty": {}})
+        entry["attempts"] += attempts
+        entry["correct"] += correct
+        entry["weak"] += weak
+        entry["by_difficulty"][difficulty or "unknown"] = {"attempts": attempts, "correct": correct, "weak": weak}
+    for entry in concepts.values():
+        entry["error_rate"] = round(1 - entry["correct"] / entry["attempts"], 4) if entry["attempts"] else None
+    return sorted(concepts.values(), key=lambda entry: (-(entry["error_rate"] or 0), entry["concept"]))
+
+
+def rebuild_concept_stats(batch_size=500):
+    """
+    Recompute every counter from the stored attempts. Returns the number of attempts counted.
+    """
+    totals = defaultdict(lambda: [0, 0, 0])
+    counted = 0
+    history = UserQuizAttempt.objects.values_list(
+        "quiz__topic_id", "quiz__questions", "user_answers", "weak_concepts"
+    )
+    for topic_id, questions, user_answers, weak_concepts in history.iterator(chunk_size=batch_size):
+        grade = grade_quiz(questions, user_answers)
+        for key, counts in attempt_counts(grade, weak_concepts).items():
+            row = totals[(topic_id,) + key]
+            for index, count in enumerate(counts):
+                row[index] += count
+        counted += 1
+
+    with transaction.atomic():
+        ConceptStat.objects.all().delete()
+        ConceptStat.objects.bulk_create(
+            [
+                ConceptStat(
+                    topic_id=topic_id, concept=concept, difficulty=difficulty,
+                    attempts=answered, correct=correct, weak=weak,
+                )
+                for (topic_id, concept, difficulty), (answered, correct, weak) in totals.items()
+            ],
+            batch_size=batch_size,
+        )
+    return counted
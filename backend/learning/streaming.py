@@ -0,0 +1,139 @@
+import json
+import logging
+
+from django.http import StreamingHttpResponse
+
+from .llm_json import THINK_END, THINK_START, LLMOutputError, extract_json
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Wrap an (async) iterator of SSE strings in an unbuffered streaming response."""
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def ndjson_line(data):
+    """Format one newline-delimited JSON record."""
+    return json.dumps(data) + "\n"
+
+
+def ndjson_response(lines):
+    """Wrap an (async) iterator of NDJSON lines in an unbuffered streaming response."""
+    response = StreamingHttpResponse(lines, content_type="application/x-ndjson")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class JSONArrayStreamParser:
+    """
+    Pull complete elements out of a top-level JSON array as it streams in.
+
+    A leading <think> block is skipped like in llm_json, then text before
+    the opening bracket (code fences, preamble) is skipped and everything
+    after the closing bracket is ignored. Each call to feed() returns the
+    elements completed by that chunk. Elements that still fail to decode,
+    even tolerantly, or that ``validate`` rejects with a ValueError are
+    logged and dropped.
+    """
+
+    def __init__(self, validate=None):
+        self.validate = validate
+        self.started = False
+        self.finished = False
+        self.skipped = 0
+        self._preamble = ""
+        self._thinking = None
+        self._element = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _skip_preamble(self, text):
+        """Consume text before the opening bracket; returns the text after it, or None until it arrives."""
+        self._preamble += text
+        if self._thinking is None:
+            head = self._preamble.lstrip()
+            if len(head) < len(THINK_START) and THINK_START.startswith(head):
+                return None
+            self._thinking = head.startswith(THINK_START)
+        if self._thinking:
+            end = self._preamble.find(THINK_END)
+            if end == -1:
+                # Keep enough of the tail to find a closing tag split across chunks
+                self._preamble = self._preamble[-len(THINK_END):]
+                return None
+            self._preamble = self._preamble[end + len(THINK_END):]
+            self._thinking = False
+        start = self._preamble.find("[")
+        rest = self._preamble[start + 1:] if start != -1 else None
+        self._preamble = ""
+        self.started = start != -1
+        return rest
+
+    def feed(self, text):
+        completed = []
+        if not self.started:
+            text = self._skip_preamble(text)
+            if text is None:
+                return completed
+        for char in text:
+            if self.finished:
+                break
+
+            if self._in_string:
+                self._element.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0 and char in ",]":
+                self._flush(completed)
+                self.finished = char == "]"
+                continue
+            if self._depth == 0 and not self._element and char.isspace():
+                continue
+
+            self._element.append(char)
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._flush(completed)
+        return completed
+
+    def _flush(self, completed):
+        text = "".join(self._element).strip()
+        self._element = []
+        if not text:
+            return
+        try:
+            element = extract_json(text)
+        except LLMOutputError as e:
+            self.skipped += 1
+            logger.warning(f"Dropping undecodable streamed element: {str(e)}")
+            return
+        if self.validate is not None:
+            try:
+                self.validate(element)
+            except ValueError as e:
+                self.skipped += 1
+                logger.warning(f"Dropping invalid streamed element: {str(e)}")
+                return
+        completed.append(element)
@@ -1,48 +1,76 @@
-from openrouter import call_openrouter
-from prompts import generate_quiz_prompt, generate_analysis_prompt, generate_learning_path_prompt
-import json
-
-def test_quiz_generation():
-    print("\n=== Testing Quiz Generation ===")
-    topic = "Binary Search"
-    prompt = generate_quiz_prompt(topic)
-    print(f"\nPrompt being sent to LangChain:\n{prompt}")
-    
-    result = call_openrouter(prompt)
-    print("\nResponse from LangChain:")
-    print(json.dumps(result, indent=2))
-
-def test_quiz_analysis():
-    print("\n=== Testing Quiz Analysis ===")
-    # Sample quiz and answers
-    questions = [
-        {
-            "question": "What is the time complexity of binary search?",
-            "concept": "Time Complexity",
-            "answer": "A"
-        }
-    ]
-    answers = ["B"]  # Wrong answer
-    
-    prompt = generate_analysis_prompt(questions, answers)
-    print(f"\nPrompt being sent to LangChain:\n{prompt}")
-    
-    result = call_openrouter(prompt)
-    print("\nResponse from LangChain:")
-    print(json.dumps(result, indent=2))
-
-def test_learning_path():
-    print("\n=== Testing Learning Path Generation ===")
-    weak_concepts = ["Binary Search", "Time Complexity"]
-    prompt = generate_learning_path_prompt(weak_concepts)
-    print(f"\nPrompt being sent to LangChain:\n{prompt}")
-    
-    result = call_openrouter(prompt)
-    print("\nResponse from LangChain:")
-    print(json.dumps(result, indent=2))
-
-if __name__ == "__main__":
-    print("Starting LangChain Integration Tests...")
-    test_quiz_generation()
-    test_quiz_analysis()
-    test_learning_path() 
\ No newline at end of file
+"""
+End-to-end checks of the prompt builders and OpenRouter calls.
+
+The calls go to the local stand-in (learning.standin) instead of
+OpenRouter, so these run offline: ``python manage.py test learning``.
+"""
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from learning import http_client
+from learning.llm_json import parse_llm_json
+from learning.openrouter import call_openrouter, stream_openrouter
+from learning.prompts import generate_analysis_prompt, generate_learning_path_prompt, generate_quiz_prompt
+from learning.router import model_router
+from learning.standin import start_standin
+
+
+class OpenRouterStandinTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.upstream = start_standin(seed=0)
+        cls.settings_override = override_settings(
+            OPENROUTER={"BASE_URL": cls.upstream.url, "MAX_RETRIES": 0},
+            LLM_CACHE={"ENDPOINT_TTLS": {}},
+            LLM_USAGE={"ENABLED": False},
+            LLM_RATE_LIMIT={"ENABLED": False},
+        )
+        cls.settings_override.enable()
+        # The client singletons read BASE_URL when first created
+        cls.client_patch = mock.patch.object(http_client, "_client", None)
+        cls.client_patch.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client_patch.stop()
+        cls.settings_override.disable()
+        cls.upstream.shutdown()
+        super().tearDownClass()
+
+    def setUp(self):
+        model_router.reset()
+
+    def test_quiz_generation(self):
+        result = call_openrouter(generate_quiz_prompt("Binary Search"), endpoint="quiz")
+        questions = parse_llm_json(result, "quiz")
+        self.assertEqual(len(questions), 10)
+        self.assertTrue(all("Binary Search" in q["concept"] for q in questions))
+
+    def test_quiz_analysis(self):
+        questions = [
+            {
+                "question": "What is the time complexity of binary search?",
+                "concept": "Time Complexity",
+                "answer": "A"
+            }
+        ]
+        answers = ["B"]  # Wrong answer
+
+        result = call_openrouter(generate_analysis_prompt(questions, answers), endpoint="analysis")
+        self.assertEqual(parse_llm_json(result, "analysis"), ["Time Complexity"])
+
+    def test_learning_path(self):
+        weak_concepts = ["Binary Search", "Time Complexity"]
+        all_concepts = weak_concepts + ["Sorting"]
+
+        result = call_openrouter(generate_learning_path_prompt(weak_concepts, all_concepts), endpoint="learning_path")
+        path = parse_llm_json(result, "learning_path")
+        self.assertEqual([entry["concept"] for entry in path], all_concepts)
+        self.assertEqual([entry["is_weak_concept"] for entry in path], [True, True, False])
+
+    def test_streamed_learning_path(self):
+        prompt = generate_learning_path_prompt(["Graphs"], ["Graphs", "Trees"])
+        reply = "".join(stream_openrouter(prompt, endpoint="learning_path"))
+        self.assertEqual([entry["concept"] for entry in parse_llm_json(reply, "learning_path")], ["Graphs", "Trees"])
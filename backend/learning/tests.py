@@ -1,3 +1,1075 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+
+from django.conf import settings
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from learning import jobs, openrouter, ratelimit, singleflight
+from learning.batch import run_batch
+from learning.cache import ResponseCache
+from learning.grading import grade_quiz, normalize_option
+from learning.http_client import AsyncOpenRouterClient, OpenRouterClient
+from learning.llm_json import LLMOutputError, parse_llm_json, validate_learning_path_entry
+from learning.llm_logging import log_llm_call
+from learning.metrics import UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_IN_FLIGHT, render_metrics, write_process_file
+from learning.models import (
+    ConceptStat, LLMCacheEntry, LLMInflight, LLMJob, LLMUsage, Question, Quiz, QuizQuestion, Topic, UserQuizAttempt,
+)
+from learning.pipeline import LLMCall, Pipeline, Step
+from learning.questions import create_quiz, store_questions
+from learning.quiz_pool import Refill, pool_size, pop_quiz, refill_topic
+from learning.ratelimit import UpstreamBusy
+from learning.router import CLOSED, HALF_OPEN, OPEN, ModelRouter, model_router
+from learning.standin import Behaviour, StandinServer
+from learning.stats import rebuild_concept_stats, record_attempt
+from learning.streaming import JSONArrayStreamParser
+from learning.usage import UsageWriter, record_usage, usage_summary
+
+DIAGNOSTIC_QUIZ = [
+    {
+        "question": "Which structure keeps database indexes balanced on disk?",
+        "options": ["A) Hash table", "B) B-tree", "C) Linked list", "D) Stack"],
+        "answer": "B",
+        "difficulty": "medium",
+        "concept": "Trees",
+    },
+    {
+        "question": "Which search uses a heuristic to find shortest paths?",
+        "options": ["A) A-star search", "B) Linear search", "C) Binary search", "D) Jump search"],
+        "answer": "A",
+        "difficulty": "hard",
+        "concept": "Graph Search",
+    },
+    {
+        "question": "What does BFS use to hold the frontier?",
+        "options": ["A) Stack", "B) Queue", "C) Heap", "D) Array"],
+        "answer": "B",
+        "difficulty": "easy",
+        "concept": "Graph Search",
+    },
+]
+
+FINAL_QUIZ = {
+    "title": "Final Assessment Quiz - Data Structures",
+    "questions": [
+        {
+            "id": 1,
+            "question": "Which structure keeps database indexes balanced on disk?",
+            "options": ["Hash table", "B-tree", "Linked list", "Stack"],
+            "correct_answer": "B-tree",
+            "concept_tested": "Trees",
+            "difficulty": "medium",
+        },
+        {
+            "id": 2,
+            "question": "Which search uses a heuristic to find shortest paths?",
+            "options": ["A-star search", "Linear search", "Binary search", "Jump search"],
+            "correct_answer": "A",
+            "concept_tested": "Graph Search",
+            "difficulty": "hard",
+        },
+        {
+            "id": 3,
+            "question": "What does BFS use to hold the frontier?",
+            "options": ["Stack", "Queue", "Heap", "Array"],
+            "correct_answer": "Queue",
+            "concept_tested": "Graph Search",
+            "difficulty": "easy",
+        },
+    ],
+}
+
+
+class NormalizeOptionTests(SimpleTestCase):
+    options = ["A) A-star search", "B) B-tree", "C) Queue", "D) Stack"]
+
+    def test_letter_forms(self):
+        for value in ("B", "b", "(B)", "B)", "B.", "B) B-tree", "(B) B-tree", "B. B-tree"):
+            with self.subTest(value=value):
+                self.assertEqual(normalize_option(value, self.options), "B")
+
+    def test_option_text_starting_with_a_letter(self):
+        self.assertEqual(normalize_option("B-tree", self.options), "B")
+        self.assertEqual(normalize_option("A-star search", self.options), "A")
+        self.assertEqual(normalize_option("a-star SEARCH", self.options), "A")
+
+    def test_unresolvable(self):
+        self.assertIsNone(normalize_option("B-tree"))
+        self.assertIsNone(normalize_option("Heap", self.options))
+        self.assertIsNone(normalize_option(None, self.options))
+
+
+class GradeQuizTests(SimpleTestCase):
+    # The same answers in each format the frontend sends
+    answer_formats = {
+        "list": ["B-tree", "A-star search", "A"],
+        "objects": [
+            {"question_id": 0, "answer": "B-tree"},
+            {"question_id": 1, "answer": "A-star search"},
+            {"question_id": 2, "answer": "A"},
+        ],
+        "mapping": {"0": "B-tree", "1": "A-star search", "2": "A"},
+    }
+
+    def assert_grade(self, quiz, answers):
+        grade = grade_quiz(quiz, answers)
+        self.assertEqual(grade["total"], 3)
+        self.assertEqual(grade["correct"], 2)
+        self.assertEqual([result["correct"] for result in grade["results"]], [True, True, False])
+        self.assertEqual(grade["weak_concepts"], ["Graph Search"])
+        self.assertEqual(grade["all_concepts"], ["Trees", "Graph Search"])
+
+    def test_diagnostic_quiz(self):
+        for name, answers in self.answer_formats.items():
+            with self.subTest(answers=name):
+                self.assert_grade(DIAGNOSTIC_QUIZ, answers)
+
+    def test_final_quiz(self):
+        for name, answers in self.answer_formats.items():
+            with self.subTest(answers=name):
+                self.assert_grade(FINAL_QUIZ, answers)
+
+    def test_letter_answers(self):
+        grade = grade_quiz(DIAGNOSTIC_QUIZ, ["B)", "(A) A-star search", "b"])
+        self.assertEqual(grade["correct"], 3)
+        self.assertEqual(grade["score"], 100.0)
+        self.assertEqual(grade["weak_concepts"], [])
+
+    def test_unanswered_questions_are_not_weak(self):
+        for answers in (["B"], [{"question_id": 0, "answer": "B"}], {"0": "B", "2": ""}):
+            with self.subTest(answers=answers):
+                grade = grade_quiz(FINAL_QUIZ, answers)
+                self.assertEqual(grade["correct"], 1)
+                self.assertEqual([result["answered"] for result in grade["results"]], [True, False, False])
+                self.assertEqual(grade["weak_concepts"], [])
+                self.assertAlmostEqual(grade["score"], 100 / 3)
+
+
+class LLMJSONCorpusTests(SimpleTestCase):
+    """The replies in benchmarks/llm_json_corpus.json, which benchmarks/llm_json.py also fuzzes and times."""
+
+    # Reformattings of the endpoint's *_plain reply that must decode to the same value
+    same_as_plain = (
+        "quiz_fenced", "quiz_fenced_inline", "quiz_fenced_crlf", "quiz_think_block", "quiz_preamble_brackets",
+        "quiz_trailing_text", "quiz_trailing_commas", "quiz_unquoted_keys", "quiz_single_quotes",
+        "quiz_missing_comma", "learning_path_fenced", "learning_path_unquoted_keys_trailing_commas",
+        "learning_path_comments", "learning_path_python_bools", "final_quiz_prompt_comment",
+        "final_quiz_preamble_fenced",
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(settings.BASE_DIR / "benchmarks" / "llm_json_corpus.json") as f:
+            cls.corpus = {case["name"]: case for case in json.load(f)}
+
+    def parse(self, name):
+        case = self.corpus[name]
+        return parse_llm_json(case["reply"], case["endpoint"])
+
+    def test_corpus_verdicts(self):
+        for name, case in self.corpus.items():
+            with self.subTest(case=name):
+                if case["ok"]:
+                    self.parse(name)
+                else:
+                    with self.assertRaises(LLMOutputError):
+                        self.parse(name)
+
+    def test_recovered_values(self):
+        for name in self.same_as_plain:
+            with self.subTest(case=name):
+                plain = self.corpus[f"{self.corpus[name]['endpoint']}_plain"]["reply"]
+                self.assertEqual(self.parse(name), json.loads(plain))
+
+        self.assertEqual(self.parse("analysis_fenced_commentary"), ["Heaps", "Tries"])
+        self.assertEqual(self.parse("analysis_python_list"), ["Heaps", "Tries"])
+        self.assertEqual(self.parse("analysis_numbered_aside"), ["Heaps", "Graphs"])
+        self.assertEqual(self.parse("analysis_empty"), [])
+        self.assertIn("\n", self.parse("quiz_raw_newline_in_string")[0]["question"])
+        self.assertEqual(self.parse("final_quiz_question_list")[0]["question"], "Q1")
+        answers = self.parse("quiz_option_text_answers")
+        self.assertEqual([normalize_option(q["answer"], q["options"]) for q in answers], ["B"] * 4)
+
+    def test_schema_rejections(self):
+        rejections = {
+            "quiz_three_options": "must have 4 options",
+            "quiz_unknown_answer": "Question 1 has an invalid answer 'E) Deque'",
+            "learning_path_no_concept": "has no 'concept'",
+            "final_quiz_no_questions": "non-empty list of questions",
+            "quiz_truncated": "No JSON value found",
+            "refusal": "No JSON value found",
+        }
+        for name, message in rejections.items():
+            with self.subTest(case=name):
+                with self.assertRaisesMessage(LLMOutputError, message):
+                    self.parse(name)
+
+
+class JSONArrayStreamParserTests(SimpleTestCase):
+    reply = (
+        '<think>Maybe ["Graphs"], or [1, 2]?</think>\nHere is the path:\n```json\n'
+        '[{"concept": "Graphs"}, {"title": "no concept"}, {"concept": "Trees",}]\n```'
+    )
+
+    def feed(self, reply, size):
+        parser = JSONArrayStreamParser(validate_learning_path_entry)
+        elements = []
+        for start in range(0, len(reply), size):
+            elements.extend(parser.feed(reply[start:start + size]))
+        return parser, elements
+
+    def test_skips_think_block_and_invalid_entries(self):
+        for size in (1, 5, len(self.reply)):
+            with self.subTest(chunk_size=size):
+                parser, elements = self.feed(self.reply, size)
+                self.assertEqual(elements, [{"concept": "Graphs"}, {"concept": "Trees"}])
+                self.assertEqual(parser.skipped, 1)
+                self.assertTrue(parser.finished)
+
+    def test_array_without_think_block(self):
+        _, elements = self.feed('Sure: [{"concept": "Heaps"}]', 3)
+        self.assertEqual(elements, [{"concept": "Heaps"}])
+
+
+class PipelineTests(SimpleTestCase):
+    def pipeline(self, optional):
+        def enrich():
+            raise UpstreamBusy("Upstream rate limit reached", 3)
+
+        return Pipeline("test", [
+            Step("grade", lambda: ["Graphs"]),
+            Step("enrichment", enrich, optional=optional),
+            Step("weak", lambda grade, enrichment: grade + (enrichment or []), after=("grade", "enrichment")),
+        ])
+
+    def test_optional_step_falls_back_to_none(self):
+        self.assertEqual(self.pipeline(optional=True).run()["weak"], ["Graphs"])
+        self.assertEqual(asyncio.run(self.pipeline(optional=True).arun())["weak"], ["Graphs"])
+
+    def test_required_step_fails_the_pipeline(self):
+        with self.assertRaises(UpstreamBusy):
+            self.pipeline(optional=False).run()
+        with self.assertRaises(UpstreamBusy):
+            asyncio.run(self.pipeline(optional=False).arun())
+
+
+class SingleFlightTests(SimpleTestCase):
+    def wait_for_followers(self, group, count):
+        deadline = time.monotonic() + 5
+        while group.stats()["shared"] < count:
+            self.assertLess(time.monotonic(), deadline, "followers never joined the flight")
+            time.sleep(0.005)
+
+    def run_threads(self, group, fn, callers=5):
+        outcomes = [None] * callers
+
+        def call(index):
+            try:
+                outcomes[index] = group.do("key", fn)
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, outcomes
+
+    def test_threads_share_the_leaders_result(self):
+        group, release, calls = singleflight.SingleFlight(), threading.Event(), []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return {"choices": []}
+
+        threads, outcomes = self.run_threads(group, fetch)
+        self.wait_for_followers(group, 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in outcomes), [False, True, True, True, True])
+        self.assertTrue(all(result is outcomes[0][0] for result, _ in outcomes))
+        self.assertEqual(group.stats()["in_flight"], 0)
+
+    def test_errors_reach_followers(self):
+        group, release = singleflight.SingleFlight(), threading.Event()
+
+        def fetch():
+            release.wait(5)
+            raise ValueError("upstream failed")
+
+        threads, outcomes = self.run_threads(group, fetch, callers=3)
+        self.wait_for_followers(group, 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        # The failed flight is gone, so the next call goes upstream again
+        self.assertEqual(group.do("key", lambda: "retried"), ("retried", False))
+
+    def test_coroutines_share_the_leaders_result(self):
+        group, calls = singleflight.SingleFlight(), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "completion"
+
+        async def main():
+            return await asyncio.gather(*(group.ado("key", fetch) for _ in range(5)))
+
+        outcomes = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcomes), [("completion", False)] + [("completion", True)] * 4)
+
+    def test_follower_takes_over_from_a_cancelled_leader(self):
+        group = singleflight.SingleFlight()
+
+        async def main():
+            started = asyncio.Event()
+
+            async def slow():
+                started.set()
+                await asyncio.sleep(5)
+
+            async def quick():
+                return "completion"
+
+            leader = asyncio.ensure_future(group.ado("key", slow))
+            await started.wait()
+            follower = asyncio.ensure_future(group.ado("key", quick))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(main()), ("completion", False))
+
+
+class CrossProcessSingleFlightTests(TestCase):
+    config = {"LEASE": 60, "POLL_INTERVAL": 0.01, "RESULT_TTL": 5}
+
+    def test_waiter_reads_the_stored_result(self):
+        self.assertEqual(singleflight._claim("key", 60), (singleflight.LEAD, None))
+        self.assertEqual(singleflight._claim("key", 60), (singleflight.WAIT, None))
+        singleflight._complete("key", {"choices": ["shared"]}, result_ttl=5)
+        self.assertEqual(
+            singleflight.db_do("key", lambda: self.fail("the stored result should be shared"), self.config),
+            ({"choices": ["shared"]}, True),
+        )
+
+    def test_expired_result_is_not_shared(self):
+        singleflight._claim("key", 60)
+        singleflight._complete("key", "stale", result_ttl=5)
+        LLMInflight.objects.filter(key="key").update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(singleflight.db_do("key", lambda: "fresh", self.config), ("fresh", False))
+
+    def test_waiter_takes_over_an_expired_lease(self):
+        # Another process claimed the key and died before completing it
+        LLMInflight.objects.create(key="key", expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(singleflight.db_do("key", lambda: "taken over", self.config), ("taken over", False))
+        self.assertEqual(LLMInflight.objects.get(key="key").response, "taken over")
+
+    def test_failed_leader_releases_the_key(self):
+        def fetch():
+            raise ValueError("upstream failed")
+
+        with self.assertRaises(ValueError):
+            singleflight.db_do("key", fetch, self.config)
+        self.assertFalse(LLMInflight.objects.filter(key="key").exists())
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ModelRouterTests(SimpleTestCase):
+    def router(self, **overrides):
+        config = {
+            "MODELS": ["primary", "backup", "spare"],
+            "COSTS": {"primary": 0, "backup": 2, "spare": 1},
+            "ENDPOINTS": {},
+            "MAX_MODELS_PER_CALL": 3,
+            "WINDOW": 10,
+            "MIN_SAMPLES": 5,
+            "FAILURE_RATE": 0.5,
+            "CONSECUTIVE_FAILURES": 3,
+            "OPEN_SECONDS": 30,
+        }
+        config.update(overrides)
+        self.clock = FakeClock()
+        return ModelRouter(config, clock=self.clock)
+
+    def fail_calls(self, router, model, times):
+        for _ in range(times):
+            self.assertTrue(router.acquire(model))
+            router.record(model, 1.0, False)
+
+    def state(self, router, model):
+        return router.snapshot()["models"][model]["state"]
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        router = self.router()
+        self.fail_calls(router, "primary", 2)
+        self.assertEqual(self.state(router, "primary"), CLOSED)
+        self.fail_calls(router, "primary", 1)
+        self.assertEqual(self.state(router, "primary"), OPEN)
+        self.assertEqual(router.candidates(), ["backup", "spare"])
+        self.assertFalse(router.acquire("primary"))
+
+    def test_circuit_opens_on_failure_rate(self):
+        router = self.router(CONSECUTIVE_FAILURES=100)
+        for ok in (True, False, True, False, False):
+            router.record("primary", 1.0, ok)
+        self.assertEqual(self.state(router, "primary"), OPEN)
+
+    def test_half_open_lets_one_probe_through(self):
+        router = self.router()
+        self.fail_calls(router, "primary", 3)
+        self.clock.now += 30
+        self.assertEqual(router.candidates(), ["primary", "backup", "spare"])
+        self.assertTrue(router.acquire("primary"))
+        self.assertEqual(self.state(router, "primary"), HALF_OPEN)
+        # Only one probe at a time
+        self.assertFalse(router.acquire("primary"))
+        self.assertNotIn("primary", router.candidates())
+
+        router.record("primary", 0.5, True)
+        self.assertEqual(self.state(router, "primary"), CLOSED)
+        self.assertTrue(router.acquire("primary"))
+
+    def test_failed_probe_reopens_the_circuit(self):
+        router = self.router()
+        self.fail_calls(router, "primary", 3)
+        self.clock.now += 30
+        self.fail_calls(router, "primary", 1)
+        self.assertEqual(self.state(router, "primary"), OPEN)
+        self.clock.now += 29
+        self.assertNotIn("primary", router.candidates())
+
+    def test_released_probe_can_be_retaken(self):
+        router = self.router()
+        self.fail_calls(router, "primary", 3)
+        self.clock.now += 30
+        self.assertTrue(router.acquire("primary"))
+        router.release("primary")
+        self.assertTrue(router.acquire("primary"))
+
+    def test_every_circuit_open_fails_fast(self):
+        router = self.router()
+        for model in ("primary", "backup", "spare"):
+            self.fail_calls(router, model, 3)
+        self.assertEqual(router.candidates(), [])
+
+    def test_budgets_order_candidates(self):
+        router = self.router(ENDPOINTS={
+            "quiz": {"LATENCY_BUDGET": 2.0},
+            "analysis": {"MAX_COST": 1},
+        })
+        for _ in range(5):
+            router.record("primary", 5.0, True)
+            router.record("backup", 1.0, True)
+        self.assertEqual(router.candidates("quiz"), ["backup", "spare", "primary"])
+        self.assertEqual(router.candidates("analysis"), ["primary", "spare"])
+        self.assertEqual(router.candidates("analysis", preferred="backup"), ["backup", "primary", "spare"])
+
+
+@override_settings(
+    LLM_ROUTER={"MODELS": ["primary", "backup"], "CONSECUTIVE_FAILURES": 1, "OPEN_SECONDS": 30},
+    LLM_USAGE={"ENABLED": False},
+    LLM_RATE_LIMIT={"ENABLED": False},
+)
+class FailoverTests(SimpleTestCase):
+    def setUp(self):
+        model_router.reset()
+        self.addCleanup(model_router.reset)
+        # The shared response cache read its TTLs at import, so bypass it here
+        patcher = mock.patch.object(openrouter.response_cache, "ttl_for", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def upstream(self, failing):
+        def chat_completion(payload):
+            self.calls.append(payload["model"])
+            if payload["model"] in failing:
+                return {"error": {"code": 502, "message": "Provider returned error"}}, []
+            return {"model": payload["model"], "choices": [{"message": {"content": "[]"}}]}, []
+
+        return mock.patch.object(openrouter, "get_client", return_value=mock.Mock(chat_completion=chat_completion))
+
+    def test_fails_over_to_the_next_model(self):
+        with self.upstream(failing={"primary"}):
+            response = openrouter.call_openrouter("prompt", endpoint="analysis")
+            self.assertEqual(response["model"], "backup")
+            self.assertEqual(self.calls, ["primary", "backup"])
+
+            # The primary's circuit is open, so the next call skips it
+            self.calls.clear()
+            openrouter.call_openrouter("prompt", endpoint="analysis")
+            self.assertEqual(self.calls, ["backup"])
+
+    def test_last_error_is_returned_when_every_model_fails(self):
+        with self.upstream(failing={"primary", "backup"}):
+            response = openrouter.call_openrouter("prompt", endpoint="analysis")
+            self.assertIn("error", response)
+            self.assertEqual(self.calls, ["primary", "backup"])
+
+            response = openrouter.call_openrouter("prompt", endpoint="analysis")
+            self.assertIn("every circuit is open", response["error"])
+            self.assertEqual(self.calls, ["primary", "backup"])
+
+
+def job_flow(payload):
+    """A job flow that writes before and after its model call."""
+    Topic.objects.get_or_create(name="before")
+    yield LLMCall("prompt", "quiz")
+    Topic.objects.create(name="after")
+    return {"status": payload["status"]}, payload["status"]
+
+
+class JobWorkerMixin:
+    def run_job(self, status=200, call=None):
+        """Enqueue, claim and process a job of job_flow; returns the job as stored."""
+        with mock.patch.dict(jobs.JOB_FLOWS, {"test": job_flow}), \
+                mock.patch("learning.flows.call_openrouter", side_effect=call or (lambda *args, **kwargs: {})):
+            job = jobs.enqueue_job("test", {"status": status})
+            claimed = jobs.claim_job("worker")
+            self.assertEqual(claimed.id, job.id)
+            jobs.process_job(claimed)
+        return LLMJob.objects.get(id=job.id)
+
+
+class JobTests(JobWorkerMixin, TestCase):
+    def test_flow_writes_commit_with_the_result(self):
+        job = self.run_job()
+        self.assertEqual((job.status, job.result_status), ("done", 200))
+        self.assertTrue(Topic.objects.filter(name="after").exists())
+
+    def test_failed_attempt_keeps_nothing(self):
+        job = self.run_job(status=500)
+        self.assertEqual((job.status, job.attempts), ("queued", 1))
+        self.assertFalse(Topic.objects.filter(name="after").exists())
+
+    def test_worker_that_lost_its_claim_writes_nothing(self):
+        def steal_claim(*args, **kwargs):
+            LLMJob.objects.filter(status="running").update(worker="other", attempts=F("attempts") + 1)
+            return {}
+
+        job = self.run_job(call=steal_claim)
+        self.assertEqual((job.status, job.worker), ("running", "other"))
+        self.assertFalse(Topic.objects.filter(name="after").exists())
+
+
+@override_settings(LLM_JOBS={"VISIBILITY_TIMEOUT": 0.3})
+class JobLeaseTests(JobWorkerMixin, TransactionTestCase):
+    def test_claim_is_renewed_while_the_flow_runs(self):
+        leases = []
+
+        def slow_call(*args, **kwargs):
+            leases.append(LLMJob.objects.get().available_at)
+            time.sleep(0.5)
+            leases.append(LLMJob.objects.get().available_at)
+            return {}
+
+        job = self.run_job(call=slow_call)
+        self.assertEqual(job.status, "done")
+        self.assertGreater(leases[1], leases[0])
+
+
+class UpstreamBusyTests(TestCase):
+    def test_batch_threads_run_as_the_requesting_client(self):
+        clients = []
+
+        def generate(prompt, endpoint=None, topic=None):
+            clients.append(ratelimit.current_client())
+            if topic == "Busy":
+                raise UpstreamBusy("Upstream rate limit reached", 3)
+            return DIAGNOSTIC_QUIZ
+
+        token = ratelimit._client.set("203.0.113.7")
+        self.addCleanup(ratelimit._client.reset, token)
+        with mock.patch("learning.batch.call_openrouter", side_effect=generate), \
+                mock.patch("learning.batch.parse_quiz_response", side_effect=lambda reply: reply):
+            results = {result.get("topic"): result for result in run_batch({"Graphs": 2, "Busy": 1})}
+
+        self.assertEqual(clients, ["203.0.113.7"] * 3)
+        self.assertEqual(results["Graphs"]["status"], "ok")
+        self.assertNotIn("retry_after", results["Graphs"])
+        self.assertEqual((results["Busy"]["status"], results["Busy"]["retry_after"]), ("error", 3))
+
+    def test_refill_reports_when_to_retry(self):
+        topic = Topic.objects.create(name="Graphs")
+        busy = UpstreamBusy("Upstream rate limit reached", 4)
+        with mock.patch("learning.quiz_pool.call_openrouter", side_effect=busy):
+            self.assertEqual(refill_topic(topic, target=2), Refill(0, 4))
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.cache = ResponseCache({"MEMORY_MAX_ENTRIES": 2, "DB_MAX_ENTRIES": 10, "ENDPOINT_TTLS": {"analysis": 60}})
+
+    def test_least_recently_used_entry_is_evicted_from_memory(self):
+        self.cache.set("a", {"value": "a"}, 60)
+        self.cache.set("b", {"value": "b"}, 60)
+        self.cache.get("a")
+        self.cache.set("c", {"value": "c"}, 60)
+        self.assertIsNone(self.cache.memory.get("b"))
+        self.assertEqual(self.cache.memory.get("a"), {"value": "a"})
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expired_entries_miss(self):
+        with mock.patch("learning.cache.time.monotonic", return_value=1000.0):
+            self.cache.set("a", {"value": "a"}, 60)
+        with mock.patch("learning.cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(self.cache.memory.get("a"))
+        LLMCacheEntry.objects.filter(key="a").update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_database_tier_fills_memory(self):
+        self.cache.set("a", {"value": "a"}, 60)
+        self.cache.memory.clear()
+        self.assertEqual(self.cache.get("a"), {"value": "a"})
+        self.assertEqual(self.cache.get("a"), {"value": "a"})
+        stats = self.cache.stats()
+        self.assertEqual((stats["db_hits"], stats["memory_hits"], stats["memory_entries"]), (1, 1, 1))
+
+
+@override_settings(
+    LLM_ROUTER={"MODELS": ["primary"]},
+    LLM_USAGE={"ENABLED": False},
+    LLM_RATE_LIMIT={"ENABLED": False},
+)
+class CachedCallTests(TestCase):
+    def setUp(self):
+        model_router.reset()
+        self.addCleanup(model_router.reset)
+        self.cache = ResponseCache({"MEMORY_MAX_ENTRIES": 8, "DB_MAX_ENTRIES": 10, "ENDPOINT_TTLS": {"analysis": 60}})
+        patcher = mock.patch.object(openrouter, "response_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reply = '["Graphs"]'
+        self.calls = []
+
+    def upstream(self):
+        def chat_completion(payload):
+            self.calls.append(payload["messages"][-1]["content"])
+            return {"model": payload["model"], "choices": [{"message": {"content": self.reply}}]}, []
+
+        return mock.patch.object(openrouter, "get_client", return_value=mock.Mock(chat_completion=chat_completion))
+
+    def test_same_request_is_served_from_the_cache(self):
+        with self.upstream():
+            first = openrouter.call_openrouter("prompt", endpoint="analysis")
+            second = openrouter.call_openrouter("prompt", endpoint="analysis")
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, ["prompt"])
+        self.assertEqual(self.cache.stats()["memory_hits"], 1)
+
+    def test_changed_parameters_miss(self):
+        with self.upstream():
+            openrouter.call_openrouter("prompt", endpoint="analysis")
+            openrouter.call_openrouter("other prompt", endpoint="analysis")
+        self.assertEqual(self.calls, ["prompt", "other prompt"])
+
+        _, _, data = openrouter._build_request("prompt", "primary")
+        self.assertNotEqual(openrouter._request_key(data), openrouter._request_key({**data, "temperature": 0.2}))
+        self.assertNotEqual(openrouter._request_key(data), openrouter._request_key({**data, "model": "backup"}))
+
+    def test_unusable_reply_is_not_cached(self):
+        self.reply = '["Graphs", '
+        with self.upstream():
+            openrouter.call_openrouter("prompt", endpoint="analysis")
+            openrouter.call_openrouter("prompt", endpoint="analysis")
+        self.assertEqual(self.calls, ["prompt", "prompt"])
+        self.assertFalse(LLMCacheEntry.objects.exists())
+
+
+class ScriptedBehaviour(Behaviour):
+    """Fails with the given statuses, one per call, before answering normally."""
+
+    def __init__(self, statuses=(), **kwargs):
+        super().__init__(**kwargs)
+        self.statuses = list(statuses)
+
+    def draw(self, endpoint):
+        delay, status, bad = super().draw(endpoint)
+        with self.lock:
+            return delay, (self.statuses.pop(0) if self.statuses else status), bad
+
+
+class StandinClientMixin:
+    """Runs the HTTP clients against a local learning.standin server."""
+
+    payload = {"model": "standin", "messages": [{"role": "user", "content": "Say hello"}]}
+
+    def serve(self, statuses=(), **behaviour):
+        server = StandinServer(("127.0.0.1", 0), ScriptedBehaviour(statuses, **behaviour))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.url
+
+    def unreachable(self):
+        """A URL whose connects hang: the listener's accept queue is already full."""
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(0)
+        self.addCleanup(listener.close)
+        for _ in range(3):
+            filler = socket.socket()
+            filler.setblocking(False)
+            filler.connect_ex(listener.getsockname())
+            self.addCleanup(filler.close)
+        time.sleep(0.1)
+        host, port = listener.getsockname()
+        return f"http://{host}:{port}"
+
+    def settings_for(self, base_url, **overrides):
+        config = {
+            "base_url": base_url, "connect_timeout": 1, "read_timeout": 2, "max_retries": 2,
+            "backoff_base": 0, "backoff_max": 8, "pool_maxsize": 2, "api_key": "test",
+        }
+        config.update(overrides)
+        return config
+
+
+class OpenRouterClientTests(StandinClientMixin, SimpleTestCase):
+    def make_client(self, base_url, **overrides):
+        client = OpenRouterClient(**self.settings_for(base_url, **overrides))
+        self.addCleanup(client.close)
+        return client
+
+    def test_retries_until_the_upstream_answers(self):
+        client = self.make_client(self.serve(statuses=[500, 503]))
+        response, attempts = client.chat_completion(self.payload)
+        self.assertEqual(response["choices"][0]["message"]["content"], "OK")
+        self.assertEqual([attempt["status"] for attempt in attempts], [500, 503, 200])
+        self.assertEqual([attempt["attempt"] for attempt in attempts], [1, 2, 3])
+        self.assertTrue(all(attempt["latency"] is not None for attempt in attempts))
+
+    def test_gives_up_after_max_retries(self):
+        client = self.make_client(self.serve(statuses=[500, 429, 503]), backoff_max=0)
+        response, attempts = client.chat_completion(self.payload)
+        self.assertEqual(response["error"]["code"], 503)
+        self.assertEqual([attempt["status"] for attempt in attempts], [500, 429, 503])
+
+    def test_retry_after_is_honoured_up_to_backoff_max(self):
+        # The stand-in sends Retry-After: 1 with its 429s
+        client = self.make_client(self.serve(statuses=[429]))
+        started = time.perf_counter()
+        client.chat_completion(self.payload)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.9)
+
+        client = self.make_client(self.serve(statuses=[429]), backoff_max=0.1)
+        started = time.perf_counter()
+        client.chat_completion(self.payload)
+        self.assertLess(time.perf_counter() - started, 0.9)
+
+    def test_read_timeout_is_raised(self):
+        client = self.make_client(self.serve(latency=1.0), read_timeout=0.2, max_retries=1)
+        with self.assertRaises(requests.Timeout):
+            client.chat_completion(self.payload)
+        records = list(client.recent_attempts)
+        self.assertEqual([record["attempt"] for record in records], [1, 2])
+        self.assertTrue(all(record["error"] and record["status"] is None for record in records))
+
+    def test_connect_timeout_is_raised(self):
+        client = self.make_client(self.unreachable(), connect_timeout=0.2, max_retries=0)
+        started = time.perf_counter()
+        with self.assertRaises(requests.ConnectTimeout):
+            client.chat_completion(self.payload)
+        self.assertLess(time.perf_counter() - started, 2)
+
+
+class AsyncOpenRouterClientTests(StandinClientMixin, SimpleTestCase):
+    def complete(self, base_url, **overrides):
+        async def run():
+            client = AsyncOpenRouterClient(**self.settings_for(base_url, **overrides))
+            try:
+                return await client.chat_completion(self.payload)
+            finally:
+                await client.aclose()
+
+        return asyncio.run(run())
+
+    def test_retries_until_the_upstream_answers(self):
+        response, attempts = self.complete(self.serve(statuses=[429, 500]), backoff_max=0)
+        self.assertEqual(response["choices"][0]["message"]["content"], "OK")
+        self.assertEqual([attempt["status"] for attempt in attempts], [429, 500, 200])
+
+    def test_gives_up_after_max_retries(self):
+        response, attempts = self.complete(self.serve(statuses=[503, 503]), max_retries=1)
+        self.assertEqual(response["error"]["code"], 503)
+        self.assertEqual(len(attempts), 2)
+
+    def test_timeouts_are_raised(self):
+        with self.assertRaises(httpx.ReadTimeout):
+            self.complete(self.serve(latency=1.0), read_timeout=0.2, max_retries=0)
+        with self.assertRaises(httpx.ConnectTimeout):
+            self.complete(self.unreachable(), connect_timeout=0.2, max_retries=0)
+
+
+class ConceptStatTests(TestCase):
+    def setUp(self):
+        self.topic = Topic.objects.create(name="Data Structures")
+        self.quiz = create_quiz(self.topic, DIAGNOSTIC_QUIZ)
+
+    def attempt(self, user_answers):
+        grade = grade_quiz(self.quiz.questions, user_answers)
+        UserQuizAttempt.objects.create(
+            quiz=self.quiz, user_answers=user_answers, score=grade["score"],
+            weak_concepts=grade["weak_concepts"], all_concepts=grade["all_concepts"],
+        )
+        record_attempt(self.topic.id, grade, grade["weak_concepts"])
+
+    def rows(self):
+        return sorted(ConceptStat.objects.values_list("topic_id", "concept", "difficulty", "attempts", "correct", "weak"))
+
+    def test_attempts_accumulate_and_rebuild_matches(self):
+        self.attempt(["B", "A", "B"])
+        self.attempt(["A", "A) A-star search", "Stack"])
+
+        self.assertEqual(self.rows(), [
+            (self.topic.id, "Graph Search", "easy", 2, 1, 1),
+            (self.topic.id, "Graph Search", "hard", 2, 2, 1),
+            (self.topic.id, "Trees", "medium", 2, 1, 1),
+        ])
+        recorded = self.rows()
+        self.assertEqual(rebuild_concept_stats(), 2)
+        self.assertEqual(self.rows(), recorded)
+
+
+@override_settings(LLM_USAGE={"ENABLED": True}, LLM_ROUTER={"COSTS": {"priced": 2.0}})
+class UsageLedgerTests(TransactionTestCase):
+    messages = [{"role": "user", "content": "Which concepts were weak?"}]
+
+    def setUp(self):
+        self.writer = UsageWriter(max_queue=100, batch_size=10, flush_interval=0.05)
+        patcher = mock.patch("learning.usage.get_writer", return_value=self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, model, response, **kwargs):
+        record_usage(log_llm_call("analysis", model, self.messages, response, time.perf_counter(), **kwargs), "Graphs")
+        self.writer.flush()
+        # The writer thread may already hold the row
+        deadline = time.monotonic() + 5
+        while self.writer.stats()["written"] < self.writer.stats()["enqueued"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def response(self, **usage):
+        return {"id": "gen-1", "choices": [{"message": {"content": '["Heaps"]'}}], "usage": usage}
+
+    def test_usage_block_becomes_one_row(self):
+        self.record("priced", self.response(prompt_tokens=1200, completion_tokens=300,
+                                            completion_tokens_details={"reasoning_tokens": 50}))
+        row = LLMUsage.objects.get()
+        self.assertEqual((row.endpoint, row.model, row.topic, row.status), ("analysis", "priced", "Graphs", "ok"))
+        self.assertEqual((row.prompt_tokens, row.completion_tokens, row.reasoning_tokens), (1200, 300, 50))
+        self.assertAlmostEqual(row.cost, 1500 * 2.0 / 1_000_000)
+
+        self.record("priced", self.response(prompt_tokens=10, completion_tokens=5, cost=0.25))
+        self.assertEqual(LLMUsage.objects.order_by("-id").first().cost, 0.25)
+
+    def test_cached_calls_are_not_billed(self):
+        self.record("priced", self.response(prompt_tokens=1200, completion_tokens=300, cost=0.25), cached=True)
+        row = LLMUsage.objects.get()
+        self.assertEqual(row.status, "cached")
+        self.assertEqual((row.prompt_tokens, row.completion_tokens, row.cost), (0, 0, 0))
+
+
+class UsageSummaryTests(TestCase):
+    def test_groups_tokens_and_cost_by_endpoint_and_day(self):
+        today = timezone.now()
+        yesterday = today - timedelta(days=1)
+        LLMUsage.objects.bulk_create([
+            LLMUsage(created_at=yesterday, endpoint="analysis", model="m", status="ok",
+                     prompt_tokens=100, completion_tokens=10, cost=0.1),
+            LLMUsage(created_at=today, endpoint="analysis", model="m", status="ok",
+                     prompt_tokens=200, completion_tokens=20, cost=0.2),
+            LLMUsage(created_at=today, endpoint="analysis", model="m", status="cached"),
+            LLMUsage(created_at=today, endpoint="learning_path", model="m", status="error",
+                     prompt_tokens=1000, completion_tokens=0, cost=0.5),
+            LLMUsage(created_at=today - timedelta(days=40), endpoint="analysis", model="m", status="ok",
+                     prompt_tokens=5000, cost=9.0),
+        ])
+        summary = usage_summary(days=30)
+
+        self.assertEqual(summary["total"]["calls"], 4)
+        self.assertEqual(summary["total"]["prompt_tokens"], 1300)
+        by_endpoint = {row["endpoint"]: row for row in summary["by_endpoint"]}
+        self.assertEqual(
+            {name: (row["calls"], row["billed_calls"], row["prompt_tokens"], row["cost"]) for name, row in by_endpoint.items()},
+            {"analysis": (3, 2, 300, 0.3), "learning_path": (1, 1, 1000, 0.5)},
+        )
+        self.assertEqual(by_endpoint["learning_path"]["errors"], 1)
+        by_day = {(row["day"], row["endpoint"]): row["prompt_tokens"] for row in summary["by_day"]}
+        self.assertEqual(by_day, {
+            (timezone.localdate(yesterday).isoformat(), "analysis"): 100,
+            (timezone.localdate(today).isoformat(), "analysis"): 200,
+            (timezone.localdate(today).isoformat(), "learning_path"): 1000,
+        })
+
+
+class QuizPoolTests(TestCase):
+    def setUp(self):
+        self.topic = Topic.objects.create(name="Graphs")
+
+    def pooled(self, age, topic=None, **fields):
+        quiz = create_quiz(topic or self.topic, DIAGNOSTIC_QUIZ, **fields)
+        Quiz.objects.filter(pk=quiz.pk).update(created_at=timezone.now() - timedelta(minutes=age))
+        return quiz
+
+    def test_pop_serves_the_oldest_quiz_once(self):
+        newer, older = self.pooled(age=1), self.pooled(age=5)
+        self.pooled(age=10, is_final_quiz=True)
+        self.pooled(age=10, served_at=timezone.now())
+        self.pooled(age=10, topic=Topic.objects.create(name="Trees"))
+
+        popped = pop_quiz(self.topic)
+        self.assertEqual(popped.id, older.id)
+        self.assertIsNotNone(popped.served_at)
+        self.assertEqual(popped.questions, DIAGNOSTIC_QUIZ)
+        self.assertEqual(list(Quiz.objects.filter(topic=self.topic, is_final_quiz=False, served_at__isnull=True)), [newer])
+
+        self.assertEqual(pop_quiz(self.topic).id, newer.id)
+        self.assertIsNone(pop_quiz(self.topic))
+
+    def test_empty_pool_pops_none(self):
+        self.assertIsNone(pop_quiz(self.topic))
+
+    def test_refill_tops_the_pool_up_to_its_target(self):
+        self.pooled(age=1)
+        reply = {"choices": [{"message": {"content": json.dumps(DIAGNOSTIC_QUIZ)}}]}
+        with mock.patch("learning.quiz_pool.call_openrouter", return_value=reply) as call:
+            self.assertEqual(refill_topic(self.topic, target=3), Refill(2))
+            self.assertEqual(refill_topic(self.topic, target=3), Refill(0))
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(pool_size(self.topic), 3)
+
+
+class QuestionStoreTests(TestCase):
+    def setUp(self):
+        self.topic = Topic.objects.create(name="Data Structures")
+
+    def linked(self, quiz):
+        return [(link.position, link.question.text, link.question.answer) for link in quiz.quiz_questions.select_related("question")]
+
+    def test_restored_questions_reuse_their_rows(self):
+        first = create_quiz(self.topic, DIAGNOSTIC_QUIZ)
+        second = create_quiz(self.topic, list(reversed(DIAGNOSTIC_QUIZ)))
+        self.assertEqual(Question.objects.count(), 3)
+        self.assertEqual(
+            sorted(first.quiz_questions.values_list("question_id", flat=True)),
+            sorted(second.quiz_questions.values_list("question_id", flat=True)),
+        )
+
+        self.assertEqual(store_questions([(first.pk, first.questions)]), 3)
+        self.assertEqual((Question.objects.count(), QuizQuestion.objects.count()), (3, 6))
+
+    def test_positions_round_trip_with_quiz_questions(self):
+        questions = list(reversed(DIAGNOSTIC_QUIZ))
+        quiz = create_quiz(self.topic, questions)
+        self.assertEqual(Quiz.objects.get(pk=quiz.pk).questions, questions)
+        self.assertEqual(self.linked(quiz), [(i, q["question"], q["answer"]) for i, q in enumerate(questions)])
+
+        # Final quizzes keep their questions under "questions" and answer with option text
+        final = create_quiz(self.topic, FINAL_QUIZ, is_final_quiz=True)
+        self.assertEqual(self.linked(final), [
+            (i, q["question"], letter) for (i, q), letter in zip(enumerate(FINAL_QUIZ["questions"]), "BAB")
+        ])
+
+    def test_positions_skip_questions_without_text(self):
+        quiz = create_quiz(self.topic, [DIAGNOSTIC_QUIZ[0], {"question": " "}, DIAGNOSTIC_QUIZ[2]])
+        self.assertEqual([position for position, _, _ in self.linked(quiz)], [0, 2])
+
+
+def scraped(name, **labels):
+    """The value of one sample in the current /api/metrics text, or None."""
+    wanted = name + ("{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}" if labels else "")
+    for line in render_metrics().splitlines():
+        sample, _, value = line.rpartition(" ")
+        if sample == wanted:
+            return float(value)
+    return None
+
+
+class MetricsTests(SimpleTestCase):
+    def test_counts_from_live_and_exited_threads_add_up(self):
+        model = "metrics-threads-test"
+        release = threading.Event()
+
+        def record(wait):
+            for _ in range(100):
+                UPSTREAM_ERRORS.inc(model, "500")
+                UPSTREAM_DURATION.observe(0.2, model)
+            if wait:
+                release.wait(5)
+
+        exited = [threading.Thread(target=record, args=(False,)) for _ in range(7)]
+        for thread in exited:
+            thread.start()
+        for thread in exited:
+            thread.join()
+        live = threading.Thread(target=record, args=(True,))
+        live.start()
+        self.addCleanup(live.join)
+        self.addCleanup(release.set)
+        while live.is_alive() and scraped("learning_llm_upstream_errors_total", model=model, reason="500") != 800:
+            time.sleep(0.01)
+
+        self.assertEqual(scraped("learning_llm_upstream_errors_total", model=model, reason="500"), 800)
+        self.assertEqual(scraped("learning_llm_upstream_duration_seconds_count", model=model), 800)
+        self.assertEqual(scraped("learning_llm_upstream_duration_seconds_bucket", model=model, le="0.25"), 800)
+        self.assertEqual(scraped("learning_llm_upstream_duration_seconds_bucket", model=model, le="0.1"), 0)
+
+        # Once the last thread exits its shard is retired without losing counts
+        release.set()
+        live.join()
+        self.assertEqual(scraped("learning_llm_upstream_errors_total", model=model, reason="500"), 800)
+
+    def test_other_processes_are_added_from_the_multiprocess_directory(self):
+        model = "metrics-multiprocess-test"
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        directory = tmp.name
+
+        def worker_file(pid, age, errors, in_flight):
+            with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+                json.dump({"pid": pid, "written_at": time.time() - age, "metrics": [
+                    ["learning_llm_upstream_errors_total", [model, "503"], errors],
+                    ["learning_llm_upstream_in_flight", [model], in_flight],
+                ]}, f)
+
+        UPSTREAM_ERRORS.inc(model, "503", amount=2)
+        UPSTREAM_IN_FLIGHT.inc(model)
+        self.addCleanup(UPSTREAM_IN_FLIGHT.dec, model)
+        worker_file(pid=999991, age=1, errors=5, in_flight=3)
+        worker_file(pid=999992, age=3600, errors=7, in_flight=4)
+
+        with override_settings(LEARNING_METRICS={"MULTIPROCESS_DIR": directory, "GAUGE_STALE_AFTER": 60}):
+            # This process's own file is not counted on top of its live values
+            write_process_file()
+            self.assertTrue(os.path.exists(os.path.join(directory, f"{os.getpid()}.json")))
+            self.assertEqual(scraped("learning_llm_upstream_errors_total", model=model, reason="503"), 2 + 5 + 7)
+            # Gauges from a stale file are left out
+            self.assertEqual(scraped("learning_llm_upstream_in_flight", model=model), 1 + 3)
@@ -0,0 +1,220 @@
+"""
+Background export of LLM call traces to LangSmith.
+
+Requests only pay for building a run dict and a non-blocking queue put; a
+daemon thread drains the queue and ships runs to LangSmith in batches.
+When the queue is full new runs are dropped (and counted) rather than
+slowing requests down, and the queue is flushed at interpreter exit.
+Without a LangSmith API key every call is a no-op.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACING_SETTINGS = {
+    "PROJECT": "adaptive-learning-platform",
+    "MAX_QUEUE": 1000,
+    "BATCH_SIZE": 50,
+    "FLUSH_INTERVAL": 2.0,
+    "SHUTDOWN_TIMEOUT": 5.0,
+}
+
+
+def get_tracing_settings():
+    config = dict(DEFAULT_TRACING_SETTINGS)
+    config.update(getattr(settings, "LANGSMITH_TRACING", {}))
+    return config
+
+
+def tracing_api_key():
+    return os.getenv("LANGCHAIN_API_KEY") or os.getenv("LANGSMITH_API_KEY")
+
+
+class NoopExporter:
+    """Stand-in used when LangSmith is not configured."""
+
+    enabled = False
+
+    def enqueue(self, run):
+        return False
+
+    def flush(self, timeout=None):
+        return 0
+
+    def stats(self):
+        return {"enabled": False}
+
+
+class TraceExporter:
+    """
+    Bounded queue of runs drained in batches by a daemon thread.
+    """
+
+    enabled = True
+
+    def __init__(self, client, max_queue, batch_size, flush_interval):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._counters = {"enqueued": 0, "exported": 0, "dropped": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._run, name="langsmith-exporter", daemon=True)
+        self._thread.start()
+
+    def _incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def enqueue(self, run):
+        """Queue a run for export; returns False if it was dropped."""
+        try:
+            self._queue.put_nowait(run)
+        except queue.Full:
+            self._incr("dropped")
+            return False
+        self._incr("enqueued")
+        return True
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch):
+        if not batch:
+            return 0
+        with self._export_lock:
+            try:
+                self.client.batch_ingest_runs(create=batch)
+            except Exception as e:
+                self._incr("failed", len(batch))
+                logger.warning(f"LangSmith export of {len(batch)} runs failed: {str(e)}")
+                return 0
+        self._incr("exported", len(batch))
+        return len(batch)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._export(self._drain(first))
+
+    def flush(self, timeout=None):
+        """Export everything currently queued from the calling thread."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        exported = 0
+        while not self._queue.empty():
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            exported += self._export(self._drain())
+        return exported
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["enabled"] = True
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """Return the process-wide exporter, creating it (and the LangSmith client) on first use."""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = _create_exporter()
+    return _exporter
+
+
+def _create_exporter():
+    logger.debug(
+        f"LangSmith tracing: api key set={bool(tracing_api_key())} "
+        f"project={get_tracing_settings()['PROJECT']} endpoint={os.getenv('LANGCHAIN_ENDPOINT')}"
+    )
+    if not tracing_api_key():
+        logger.debug("No LangSmith API key configured; tracing disabled")
+        return NoopExporter()
+    try:
+        from langsmith import Client
+        client = Client()
+    except Exception as e:
+        logger.error(f"Failed to initialize LangSmith client: {str(e)}")
+        return NoopExporter()
+
+    config = get_tracing_settings()
+    exporter = TraceExporter(
+        client,
+        max_queue=config["MAX_QUEUE"],
+        batch_size=config["BATCH_SIZE"],
+        flush_interval=config["FLUSH_INTERVAL"],
+    )
+    atexit.register(exporter.flush, config["SHUTDOWN_TIMEOUT"])
+    return exporter
+
+
+def trace_llm_call(prompt, model, system_template, messages, response, start_time, end_time=None, error=None):
+    """
+    Queue one OpenRouter call as a completed LangSmith run.
+    """
+    exporter = get_exporter()
+    if not exporter.enabled:
+        return False
+
+    run_id = uuid.uuid4()
+    end_time = end_time or datetime.now(timezone.utc)
+    response = response or {}
+    choices = response.get('choices') or [{}]
+    run = {
+        "id": run_id,
+        "trace_id": run_id,
+        "dotted_order": f"{start_time:%Y%m%dT%H%M%S%fZ}{run_id}",
+        "name": "openrouter_call",
+        "run_type": "chain",
+        "session_name": get_tracing_settings()["PROJECT"],
+        "start_time": start_time,
+        "end_time": end_time,
+        "inputs": {
+            "prompt": prompt,
+            "model": model,
+            "system_template": system_template,
+            "messages": messages
+        },
+        "outputs": {
+            "completion_id": response.get('id', ''),
+            "model": response.get('model', ''),
+            "provider": response.get('provider', ''),
+            "content": (choices[0].get('message') or {}).get('content', ''),
+            "usage": response.get('usage')
+        },
+        "extra": {"metadata": {
+            "model": model,
+            "api": "openrouter",
+            "prompt_template": getattr(prompt, "template", None),
+            "prompt_version": getattr(prompt, "version", None),
+        }},
+    }
+    if error:
+        run["error"] = error
+    return exporter.enqueue(run)
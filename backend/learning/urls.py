@@ -1,11 +1,22 @@
-from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('generate-quiz/', views.generate_quiz, name='generate_quiz'),
-    path('analyze-quiz/', views.analyze_quiz, name='analyze_quiz'),
-    path('learning-path/', views.learning_path, name='learning_path'),
-    path('final-quiz/', views.final_quiz, name='final_quiz'),
-    path('submit-final-quiz/', views.submit_final_quiz, name='submit_final_quiz'),
-    path('quiz-attempt/<int:attempt_id>/', views.get_quiz_attempt, name='get_quiz_attempt'),
-]
+from django.conf import settings
+from django.urls import path
+from . import async_views, views
+
+# Under ASGI the LLM-bound endpoints are served by their async versions
+llm_views = async_views if settings.LEARNING_ASYNC_VIEWS else views
+
+urlpatterns = [
+    path('generate-quiz/', llm_views.generate_quiz, name='generate_quiz'),
+    path('generate-quiz/batch/', llm_views.generate_quiz_batch, name='generate_quiz_batch'),
+    path('analyze-quiz/', llm_views.analyze_quiz, name='analyze_quiz'),
+    path('learning-path/', llm_views.learning_path, name='learning_path'),
+    path('learning-path/stream/', llm_views.learning_path_stream, name='learning_path_stream'),
+    path('final-quiz/', llm_views.final_quiz, name='final_quiz'),
+    path('submit-final-quiz/', llm_views.submit_final_quiz, name='submit_final_quiz'),
+    path('quiz-attempt/<int:attempt_id>/', views.get_quiz_attempt, name='get_quiz_attempt'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('llm/routing/', views.llm_routing, name='llm_routing'),
+    path('llm/usage/', views.llm_usage, name='llm_usage'),
+    path('stats/concepts/', views.concept_stats, name='concept_stats'),
+    path('metrics', views.metrics, name='metrics'),
+]
@@ -0,0 +1,228 @@
+"""
+Token and cost ledger for OpenRouter calls.
+
+Every call becomes one LLMUsage row, keyed by endpoint, model, prompt
+template and version, and topic, with the prompt, completion and
+reasoning tokens from the response's ``usage`` block. Cache hits and
+coalesced calls are recorded without tokens, since nothing was billed
+for them. Cost is the ``usage.cost`` OpenRouter reports; when it is
+missing, the tokens are priced at LLM_ROUTER["COSTS"] (USD per million
+tokens).
+
+Rows are queued in memory and a daemon thread writes them in bulk_create
+batches, so requests never wait on the insert. When the queue is full,
+new rows are dropped (and counted) rather than slowing requests down.
+The queue is flushed at interpreter exit.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import LLMUsage
+from .router import get_router_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USAGE_SETTINGS = {
+    "ENABLED": True,
+    "MAX_QUEUE": 10000,
+    "BATCH_SIZE": 200,
+    "FLUSH_INTERVAL": 2.0,
+    "SHUTDOWN_TIMEOUT": 5.0,
+}
+
+BILLED_STATUSES = ("ok", "error")
+
+
+def get_usage_settings():
+    config = dict(DEFAULT_USAGE_SETTINGS)
+    config.update(getattr(settings, "LLM_USAGE", {}))
+    return config
+
+
+class UsageWriter:
+    """
+    Bounded queue of ledger rows written in batches by a daemon thread.
+    """
+
+    def __init__(self, max_queue, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+        self._thread.start()
+
+    def _incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def enqueue(self, row):
+        """Queue a row for writing; returns False if it was dropped."""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._incr("dropped")
+            return False
+        self._incr("enqueued")
+        return True
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return 0
+        with self._write_lock:
+            try:
+                LLMUsage.objects.bulk_create(batch)
+            except Exception as e:
+                self._incr("failed", len(batch))
+                logger.warning(f"Writing {len(batch)} usage rows failed: {str(e)}")
+                return 0
+            finally:
+                close_old_connections()
+        self._incr("written", len(batch))
+        return len(batch)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def flush(self, timeout=None):
+        """Write everything currently queued from the calling thread."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        written = 0
+        while not self._queue.empty():
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            written += self._write(self._drain())
+        return written
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide writer, starting its thread on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = get_usage_settings()
+                _writer = UsageWriter(config["MAX_QUEUE"], config["BATCH_SIZE"], config["FLUSH_INTERVAL"])
+                atexit.register(_writer.flush, config["SHUTDOWN_TIMEOUT"])
+    return _writer
+
+
+def call_cost(model, prompt_tokens, completion_tokens, reported=None):
+    """USD cost of one call: OpenRouter's own figure, else the configured price."""
+    if reported is not None:
+        return float(reported)
+    price = get_router_settings()["COSTS"].get(model, 0)
+    return (prompt_tokens + completion_tokens) * price / 1_000_000
+
+
+def record_usage(fields, topic=None):
+    """
+    Queue the ledger row for one call.
+
+    ``fields`` is what log_llm_call returned for the call.
+    """
+    if not get_usage_settings()["ENABLED"]:
+        return
+    template, _, version = (fields.get("prompt") or "").partition("@")
+    billed = fields["status"] in BILLED_STATUSES
+    prompt_tokens = (fields.get("prompt_tokens") or 0) if billed else 0
+    completion_tokens = (fields.get("completion_tokens") or 0) if billed else 0
+    get_writer().enqueue(LLMUsage(
+        created_at=timezone.now(),
+        endpoint=fields.get("endpoint") or "",
+        model=str(fields.get("model") or "")[:200],
+        prompt_template=template[:32],
+        prompt_version=version[:12],
+        topic=str(topic or "")[:200],
+        status=fields["status"],
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        reasoning_tokens=(fields.get("reasoning_tokens") or 0) if billed else 0,
+        cost=call_cost(fields.get("model"), prompt_tokens, completion_tokens, fields.get("cost")) if billed else 0,
+        duration_ms=fields.get("duration_ms"),
+    ))
+
+
+def _totals():
+    return {
+        "calls": Count("id"),
+        "billed_calls": Count("id", filter=Q(status__in=BILLED_STATUSES)),
+        "errors": Count("id", filter=Q(status="error")),
+        "prompt_tokens": Sum("prompt_tokens"),
+        "completion_tokens": Sum("completion_tokens"),
+        "reasoning_tokens": Sum("reasoning_tokens"),
+        "cost": Sum("cost"),
+    }
+
+
+def _row(row):
+    row = dict(row)
+    for field in ("prompt_tokens", "completion_tokens", "reasoning_tokens"):
+        row[field] = row[field] or 0
+    row["cost"] = round(row["cost"] or 0, 6)
+    if "day" in row:
+        row["day"] = row["day"].isoformat()
+    return row
+
+
+def usage_summary(days=30, topic=None, model=None):
+    """Tokens and cost over the last ``days`` days: in total, per endpoint, per prompt template and per day."""
+    since = timezone.now() - timedelta(days=days)
+    rows = LLMUsage.objects.filter(created_at__gte=since)
+    if topic:
+        rows = rows.filter(topic=topic)
+    if model:
+        rows = rows.filter(model=model)
+
+    by_cost = ("-cost", "-prompt_tokens")
+    return {
+        "since": since.isoformat(),
+        "total": _row(rows.aggregate(**_totals())),
+        "by_endpoint": [
+            _row(row) for row in rows.values("endpoint").annotate(**_totals()).order_by(*by_cost, "endpoint")
+        ],
+        "by_prompt": [
+            _row(row) for row in rows.values("prompt_template", "prompt_version")
+            .annotate(**_totals()).order_by(*by_cost, "prompt_template")
+        ],
+        "by_day": [
+            _row(row) for row in rows.annotate(day=TruncDate("created_at")).values("day", "endpoint")
+            .annotate(**_totals()).order_by("day", "endpoint")
+        ],
+    }
@@ -1,39 +1,46 @@
 import json
-import re
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from .openrouter import call_openrouter
-from .prompts import generate_quiz_prompt, generate_analysis_prompt, generate_learning_path_prompt, generate_final_quiz_prompt
-from .models import Topic, Quiz, UserQuizAttempt, LearningPath, UserProgress
+from . import flows
+from .batch import parse_batch_request, run_batch
+from .cache import response_cache
+from .flows import flow_response, run_flow
+from .jobs import enqueue_response, job_state, wants_job
+from .llm_json import validate_learning_path_entry
+from .metrics import CONTENT_TYPE, get_metrics_settings, render_metrics
+from .models import LLMJob, Topic, UserQuizAttempt
+from .openrouter import stream_openrouter
+from .ratelimit import UpstreamBusy
+from .router import model_router
+from .stats import concept_stats as topic_concept_stats
+from .streaming import JSONArrayStreamParser, ndjson_line, ndjson_response, sse_event, sse_response
+from .usage import usage_summary
 
 @csrf_exempt
 def generate_quiz(request):
     topic_name = request.GET.get("topic", "Graphs")
-    topic, _ = Topic.objects.get_or_create(name=topic_name)
-    
-    prompt = generate_quiz_prompt(topic_name)
-    try:
-        result = call_openrouter(prompt)
-    except Exception as e:
-        return JsonResponse({"error": f"API call failed: {str(e)}"}, status=500)
+    if wants_job(request):
+        return enqueue_response("generate_quiz", {"topic": topic_name})
+    payload, status = run_flow(flows.generate_quiz(topic_name))
+    return flow_response(payload, status)
 
-    try:
-        quiz_raw = result['choices'][0]['message']['content']
-        cleaned = re.sub(r"^```json\n|```$", "", quiz_raw.strip())
-        quiz_data = json.loads(cleaned)
+@csrf_exempt
+def generate_quiz_batch(request):
+    """
+    Generate quizzes for many topics concurrently.
 
-        quiz = Quiz.objects.create(
-            topic=topic,
-            questions=quiz_data
-        )
+    Streams one NDJSON record per topic as its quizzes are saved, then a
+    summary record (see learning.batch).
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
 
-        return JsonResponse({
-            "quiz": quiz_data,
-            "quiz_id": quiz.id
-        }, safe=False)
+    try:
+        counts = parse_batch_request(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-    except (KeyError, json.JSONDecodeError) as e:
-        return JsonResponse({"error": f"Invalid API response or JSON parsing error: {str(e)}", "response": result}, status=500)
+    return ndjson_response(ndjson_line(result) for result in run_batch(counts))
 
 @csrf_exempt
 def analyze_quiz(request):
@@ -42,40 +49,10 @@ def analyze_quiz(request):
 
     try:
         data = json.loads(request.body)
-        quiz_id = data.get("quiz_id")
-        user_answers = data.get("user_answers", [])
-
-        # Get the existing quiz
-        quiz = Quiz.objects.get(id=quiz_id)
-        questions = quiz.questions
-
-        # Extract all concepts from the quiz
-        all_concepts = list(set(q["concept"] for q in questions))
-
-        prompt = generate_analysis_prompt(questions, user_answers)
-        result = call_openrouter(prompt)
-        raw = result['choices'][0]['message']['content']
-        weak_concepts = json.loads(raw.strip().replace("```json", "").replace("```", ""))
-
-        # Save the quiz attempt using the existing quiz
-        quiz_attempt = UserQuizAttempt.objects.create(
-            quiz=quiz,
-            user_answers=user_answers,
-            weak_concepts=weak_concepts,
-            all_concepts=all_concepts  # Store all concepts
-        )
-
-        # Create or update progress
-        progress, _ = UserProgress.objects.get_or_create(
-            topic=quiz.topic,
-            defaults={'initial_quiz_attempt': quiz_attempt}
-        )
-
-        return JsonResponse({
-            "weak_concepts": weak_concepts,
-            "all_concepts": all_concepts,  # Return all concepts
-            "quiz_attempt_id": quiz_attempt.id
-        })
+        if wants_job(request):
+            return enqueue_response("analyze_quiz", data)
+        payload, status = run_flow(flows.analyze_quiz(data))
+        return flow_response(payload, status)
 
     except Exception as e:
         return JsonResponse({"error": str(e)})
@@ -87,101 +64,68 @@ def learning_path(request):
 
     try:
         data = json.loads(request.body)
-        quiz_attempt_id = data.get("quiz_attempt_id")
-        weak_concepts = data.get("weak_concepts", [])
-        all_concepts = data.get("all_concepts", [])  # Get all concepts
-
-        quiz_attempt = UserQuizAttempt.objects.get(id=quiz_attempt_id)
-        
-        # Generate learning path that includes all concepts but emphasizes weak ones
-        prompt = generate_learning_path_prompt(weak_concepts, all_concepts)
-        result = call_openrouter(prompt)
-        raw = result['choices'][0]['message']['content']
-        
-        # Clean the response and ensure it's valid JSON
-        cleaned = raw.strip()
-        # Remove any markdown code block indicators
-        cleaned = re.sub(r'^```json\s*|\s*```$', '', cleaned)
-        # Remove any trailing commas in arrays and objects
-        cleaned = re.sub(r',(\s*[}\]])', r'\1', cleaned)
-        # Ensure all property names are in double quotes
-        cleaned = re.sub(r'([{,])\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*:', r'\1"\2":', cleaned)
-        
-        try:
-            learning_path_data = json.loads(cleaned)
-        except json.JSONDecodeError as e:
-            return JsonResponse({
-                "error": f"Invalid JSON in learning path response: {str(e)}",
-                "raw_response": raw,
-                "cleaned_response": cleaned
-            }, status=500)
-
-        # Save the learning path
-        learning_path = LearningPath.objects.create(
-            weak_concepts=weak_concepts,
-            all_concepts=all_concepts,  # Store all concepts
-            learning_materials=learning_path_data
-        )
-
-        # Update progress
-        progress = UserProgress.objects.get(
-            topic=quiz_attempt.quiz.topic
-        )
-        progress.learning_path = learning_path
-        progress.save()
-
-        return JsonResponse({
-            "learning_path": learning_path_data,
-            "learning_path_id": learning_path.id
-        })
+        if wants_job(request):
+            return enqueue_response("learning_path", data)
+        payload, status = run_flow(flows.learning_path(data))
+        return flow_response(payload, status)
 
     except Exception as e:
         return JsonResponse({"error": str(e)})
 
 @csrf_exempt
-def final_quiz(request):
+def learning_path_stream(request):
+    """
+    Stream the learning path as server-sent events.
+
+    Emits one ``concept`` event per concept (stored material first, then
+    each generated concept as it completes), then a ``done`` event with the
+    saved learning path id (or an ``error`` event).
+    """
     if request.method != "POST":
         return JsonResponse({"error": "Only POST allowed"}, status=405)
 
     try:
-        data = json.loads(request.body)
-        topic_name = data.get("topic", "Graphs")
-        weak_concepts = data.get("weak_concepts", [])
-
-        topic = Topic.objects.get(name=topic_name)
-        
-        # Get the initial quiz attempt to compare with
-        progress = UserProgress.objects.get(topic=topic)
-        initial_attempt = progress.initial_quiz_attempt
-        
-        # Generate a more focused final quiz
-        prompt = generate_final_quiz_prompt(
-            topic_name, 
-            weak_concepts,
-            initial_attempt.weak_concepts if initial_attempt else []
-        )
-        result = call_openrouter(prompt)
+        stream = flows.start_learning_path_stream(json.loads(request.body))
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
+    def events():
+        parser = JSONArrayStreamParser(validate_learning_path_entry)
+        concepts, parts = [], []
         try:
-            raw_quiz = result['choices'][0]['message']['content']
-            cleaned = raw_quiz.strip().replace("```json", "").replace("```", "")
-            quiz_data = json.loads(cleaned)
-
-            # Save the final quiz
-            quiz = Quiz.objects.create(
-                topic=topic,
-                questions=quiz_data,
-                is_final_quiz=True
-            )
+            # Stored material goes out straight away; only missing concepts are generated
+            for concept in stream["stored"]:
+                yield sse_event("concept", concept)
+            if stream["prompt"]:
+                for delta in stream_openrouter(stream["prompt"], endpoint="learning_path", topic=stream["topic"]):
+                    parts.append(delta)
+                    for concept in parser.feed(delta):
+                        concepts.append(concept)
+                        yield sse_event("concept", concept)
+                if not concepts:
+                    # The reply was not a streamable array; fall back to a full parse
+                    for concept in flows.parse_learning_path("".join(parts)):
+                        concepts.append(concept)
+                        yield sse_event("concept", concept)
+            yield sse_event("done", flows.finish_learning_path_stream(stream, concepts))
+        except UpstreamBusy as e:
+            yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return sse_response(events())
 
-            return JsonResponse({
-                "quiz": quiz_data,
-                "quiz_id": quiz.id,
-                "initial_weak_concepts": initial_attempt.weak_concepts if initial_attempt else []
-            })
+@csrf_exempt
+def final_quiz(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
 
-        except Exception as inner:
-            return JsonResponse({"error": str(inner), "response": result})
+    try:
+        data = json.loads(request.body)
+        if wants_job(request):
+            return enqueue_response("final_quiz", data)
+        payload, status = run_flow(flows.final_quiz(data))
+        return flow_response(payload, status)
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
@@ -193,78 +137,10 @@ def submit_final_quiz(request):
 
     try:
         data = json.loads(request.body)
-        quiz_id = data.get("quiz_id")
-        user_answers = data.get("user_answers")
-
-        if not quiz_id:
-            return JsonResponse({"error": "Quiz ID is required"}, status=400)
-
-        quiz = Quiz.objects.get(id=quiz_id)
-        
-        # Save the final quiz attempt
-        quiz_attempt = UserQuizAttempt.objects.create(
-            quiz=quiz,
-            user_answers=user_answers if user_answers else []  # Ensure we always have a valid value
-        )
-
-        # Get progress and initial attempt
-        progress = UserProgress.objects.get(topic=quiz.topic)
-        initial_attempt = progress.initial_quiz_attempt
-
-        # Analyze final performance
-        prompt = generate_analysis_prompt(quiz.questions, user_answers if user_answers else [])
-        result = call_openrouter(prompt)
-        raw = result['choices'][0]['message']['content']
-        final_weak_concepts = json.loads(raw.strip().replace("```json", "").replace("```", ""))
-
-        # Calculate improvement metrics
-        initial_weak = set(initial_attempt.weak_concepts) if initial_attempt else set()
-        final_weak = set(final_weak_concepts)
-        
-        improved_concepts = initial_weak - final_weak
-        still_weak_concepts = initial_weak.intersection(final_weak)
-        new_weak_concepts = final_weak - initial_weak
-
-        # Calculate overall improvement percentage
-        total_concepts = len(initial_weak.union(final_weak))
-        improvement_percentage = (len(improved_concepts) / total_concepts * 100) if total_concepts > 0 else 0
-
-        # Update progress
-        progress.final_quiz_attempt = quiz_attempt
-        progress.progress_percentage = improvement_percentage
-        progress.save()
-
-        # Generate reinforcement feedback
-        feedback_prompt = f"""
-        Based on the following learning journey:
-        Initial weak concepts: {list(initial_weak)}
-        Final weak concepts: {list(final_weak)}
-        Improved concepts: {list(improved_concepts)}
-        Still weak concepts: {list(still_weak_concepts)}
-        New weak concepts: {list(new_weak_concepts)}
-        
-        Provide a detailed analysis of the student's progress and specific recommendations for further improvement.
-        Focus on:
-        1. Areas of significant improvement
-        2. Concepts that still need work
-        3. New areas that emerged as weak
-        4. Specific study recommendations
-        """
-
-        feedback_result = call_openrouter(feedback_prompt)
-        feedback = feedback_result['choices'][0]['message']['content']
-
-        return JsonResponse({
-            "message": "Final quiz submitted successfully",
-            "quiz_attempt_id": quiz_attempt.id,
-            "improvement_metrics": {
-                "improvement_percentage": improvement_percentage,
-                "improved_concepts": list(improved_concepts),
-                "still_weak_concepts": list(still_weak_concepts),
-                "new_weak_concepts": list(new_weak_concepts)
-            },
-            "detailed_feedback": feedback
-        })
+        if wants_job(request):
+            return enqueue_response("submit_final_quiz", data)
+        payload, status = run_flow(flows.submit_final_quiz(data))
+        return flow_response(payload, status)
 
     except Exception as e:
         return JsonResponse({"error": str(e)})
@@ -274,7 +150,7 @@ def get_quiz_attempt(request, attempt_id):
     try:
         attempt = UserQuizAttempt.objects.get(id=attempt_id)
         return JsonResponse({
-            "quiz_id": attempt.quiz.id,
+            "quiz_id": attempt.quiz_id,
             "user_answers": attempt.user_answers,
             "weak_concepts": attempt.weak_concepts,
             "all_concepts": attempt.all_concepts
@@ -283,4 +159,43 @@ def get_quiz_attempt(request, attempt_id):
         return JsonResponse({"error": "Quiz attempt not found"}, status=404)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
-    
\ No newline at end of file
+
+def llm_routing(request):
+    """Current model routing state: per-model stats and circuits, per-endpoint model order."""
+    return JsonResponse(model_router.snapshot())
+
+def job_status(request, job_id):
+    """Status of a background job, with the flow's response once it has finished."""
+    try:
+        job = LLMJob.objects.get(id=job_id)
+    except LLMJob.DoesNotExist:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse(job_state(job))
+
+def llm_usage(request):
+    """
+    Tokens and cost from the usage ledger, per endpoint, prompt template and
+    day, plus this process's response cache counters.
+    """
+    try:
+        days = int(request.GET.get("days", 30))
+    except ValueError:
+        return JsonResponse({"error": "days must be an integer"}, status=400)
+    summary = usage_summary(days, topic=request.GET.get("topic"), model=request.GET.get("model"))
+    summary["cache"] = response_cache.stats()
+    return JsonResponse(summary)
+
+def concept_stats(request):
+    """Per-concept answer counts and error rates for a topic, from the maintained counters."""
+    topic_name = request.GET.get("topic", "Graphs")
+    try:
+        topic = Topic.objects.get(name=topic_name)
+    except Topic.DoesNotExist:
+        return JsonResponse({"error": "Topic not found"}, status=404)
+    return JsonResponse({"topic": topic.name, "concepts": topic_concept_stats(topic)})
+
+def metrics(request):
+    """Request, upstream and parse metrics in Prometheus text format, summed over workers."""
+    if not get_metrics_settings()["ENABLED"]:
+        return JsonResponse({"error": "Metrics are disabled"}, status=404)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
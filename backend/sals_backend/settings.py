@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+load_dotenv()
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'learning.metrics.MetricsMiddleware',
+    'learning.ratelimit.ClientMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -75,13 +82,44 @@ WSGI_APPLICATION = 'sals_backend.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# SQLite by default. DB_PROFILE=postgres switches to PostgreSQL (needs
+# psycopg) configured from the POSTGRES_* variables. Connections are kept
+# open for DB_CONN_MAX_AGE seconds and health-checked before reuse; with
+# DB_POOL=1 psycopg's connection pool is used instead (Django 5.1+), which
+# requires CONN_MAX_AGE 0. `python manage.py check_query_plans` verifies
+# that the hot lookups use indexes on the configured database.
+
+DB_PROFILE = os.getenv('DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgres':
+    DB_POOL = os.getenv('DB_POOL', '0') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'sals'),
+            'USER': os.getenv('POSTGRES_USER', 'sals'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        }
     }
-}
 
 
 # Password validation
@@ -126,3 +164,269 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# OpenRouter response cache
+# Endpoints listed in ENDPOINT_TTLS (seconds) are served from the cache;
+# quiz generation is left out so learners keep getting fresh questions.
+
+LLM_CACHE = {
+    'MEMORY_MAX_ENTRIES': 256,
+    'DB_MAX_ENTRIES': 5000,
+    'ENDPOINT_TTLS': {
+        'learning_path': 7 * 24 * 60 * 60,
+        'analysis': 24 * 60 * 60,
+        'final_feedback': 24 * 60 * 60,
+    },
+}
+
+# Pre-generated diagnostic quiz pool
+# generate-quiz serves an unused pooled quiz when one exists; pools below
+# LOW_WATER_MARK are topped up to TARGET_SIZE by `manage.py refill_quiz_pool
+# --loop`, busiest topics first. QUIZ_POOL_BACKGROUND_REFILL=1 instead runs a
+# refill thread inside every web process.
+
+QUIZ_POOL = {
+    'ENABLED': True,
+    'LOW_WATER_MARK': 2,
+    'TARGET_SIZE': 4,
+    'DEMAND_WINDOW': 60 * 60,
+    'BACKGROUND_REFILL': os.getenv('QUIZ_POOL_BACKGROUND_REFILL', '0') == '1',
+    'REFILL_INTERVAL': 60,
+}
+
+# Quiz answers are graded locally; set this to also ask the model for
+# additional weak concepts after grading (costs one LLM round trip).
+
+LLM_ANALYSIS_ENRICHMENT = False
+
+# OpenRouter HTTP client
+# BASE_URL can point at a local stand-in server for development and load tests.
+
+OPENROUTER = {
+    'BASE_URL': os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1'),
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 120,
+    'MAX_RETRIES': 2,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 8,
+    'POOL_MAXSIZE': 20,
+    'ASYNC_MAX_CONNECTIONS': 500,
+}
+
+# Serve the LLM-bound endpoints with the async views in learning/async_views.py.
+# asgi.py turns this on by default; WSGI deployments keep the sync views.
+
+LEARNING_ASYNC_VIEWS = os.getenv('LEARNING_ASYNC_VIEWS', '0') == '1'
+
+# LangSmith tracing
+# Runs are queued in memory and exported in batches by a background thread;
+# tracing is a no-op unless LANGCHAIN_API_KEY (or LANGSMITH_API_KEY) is set.
+
+LANGSMITH_TRACING = {
+    'PROJECT': os.getenv('LANGCHAIN_PROJECT', 'adaptive-learning-platform'),
+    'MAX_QUEUE': 1000,
+    'BATCH_SIZE': 50,
+    'FLUSH_INTERVAL': 2.0,
+    'SHUTDOWN_TIMEOUT': 5.0,
+}
+
+# Logging
+# One compact `llm_call` record per OpenRouter call goes to learning.llm.
+# Full prompts/responses are only written to learning.llm.payloads for the
+# PAYLOAD_SAMPLE_RATE fraction of calls (or every call with LOG_PAYLOADS),
+# and only when LEARNING_LOG_LEVEL lets DEBUG records through.
+
+LLM_LOGGING = {
+    'PAYLOAD_SAMPLE_RATE': float(os.getenv('LLM_PAYLOAD_SAMPLE_RATE', '0')),
+    'LOG_PAYLOADS': os.getenv('LLM_LOG_PAYLOADS', '0') == '1',
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'learning': {
+            'handlers': ['console'],
+            'level': os.getenv('LEARNING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Request pipelines
+# Independent steps of a multi-step view (database work, model calls) run
+# concurrently on a shared pool of at most MAX_WORKERS threads under WSGI.
+
+PIPELINE = {
+    'MAX_WORKERS': 32,
+}
+
+# Batch quiz generation
+# generate-quiz/batch/ runs at most MAX_CONCURRENCY model calls at a time
+# and accepts up to MAX_TOPICS topics with up to MAX_COUNT quizzes each.
+
+QUIZ_BATCH = {
+    'MAX_CONCURRENCY': int(os.getenv('QUIZ_BATCH_CONCURRENCY', '8')),
+    'MAX_TOPICS': 50,
+    'MAX_COUNT': 5,
+}
+
+# Single-flight for identical OpenRouter calls
+# Concurrent identical calls in a process share one upstream request. With
+# CROSS_PROCESS the claim is also made in the database (LLMInflight), so
+# all workers share it; waiting workers poll every POLL_INTERVAL seconds
+# and take over once a leader's LEASE expires. Finished results stay
+# readable for RESULT_TTL seconds.
+
+LLM_SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'CROSS_PROCESS': os.getenv('LLM_SINGLE_FLIGHT_CROSS_PROCESS', '0') == '1',
+    'LEASE': 180,
+    'POLL_INTERVAL': 0.25,
+    'RESULT_TTL': 5,
+}
+
+# Per-concept learning-material store
+# Learning paths reuse stored material per concept (weak and non-weak
+# variants); only concepts without material younger than MAX_AGE seconds
+# are sent to the model.
+
+LEARNING_MATERIALS = {
+    'ENABLED': True,
+    'MAX_AGE': 30 * 24 * 60 * 60,
+}
+
+# Prompt compaction
+# COMPACT minifies JSON payloads and strips indentation and extra blank
+# lines from prompt templates; OMIT_UNUSED_FIELDS drops payload fields the
+# model does not need for the task. Compare both modes with
+# `python manage.py prompt_report`.
+
+LLM_PROMPTS = {
+    'COMPACT': os.getenv('LLM_COMPACT_PROMPTS', '1') == '1',
+    'OMIT_UNUSED_FIELDS': True,
+}
+
+# Model routing
+# MODELS is the ordered fallback list (the first is the primary). A model's
+# circuit opens after CONSECUTIVE_FAILURES failures in a row, or when at
+# least FAILURE_RATE of its last WINDOW calls failed (given MIN_SAMPLES),
+# and half-opens for a single probe after OPEN_SECONDS. Per endpoint,
+# models whose recent p95 latency exceeds LATENCY_BUDGET seconds are tried
+# last, and models costing more than MAX_COST (per COSTS, USD per million
+# tokens) are not used.
+
+LLM_ROUTER = {
+    'MODELS': [
+        model.strip()
+        for model in os.getenv(
+            'OPENROUTER_MODELS',
+            'deepseek/deepseek-r1-0528-qwen3-8b:free,'
+            'meta-llama/llama-3.3-70b-instruct:free,'
+            'mistralai/mistral-7b-instruct:free',
+        ).split(',')
+        if model.strip()
+    ],
+    'COSTS': {},
+    'ENDPOINTS': {
+        'quiz': {'LATENCY_BUDGET': 60},
+        'analysis': {'LATENCY_BUDGET': 20},
+        'learning_path': {'LATENCY_BUDGET': 60},
+        'final_quiz': {'LATENCY_BUDGET': 60},
+        'final_feedback': {'LATENCY_BUDGET': 30},
+    },
+    'MAX_MODELS_PER_CALL': 3,
+    'WINDOW': 50,
+    'MIN_SAMPLES': 5,
+    'FAILURE_RATE': 0.5,
+    'CONSECUTIVE_FAILURES': 3,
+    'OPEN_SECONDS': 30,
+}
+
+# Metrics
+# learning.metrics.MetricsMiddleware records per-route request latency and
+# query counts; upstream LLM latency, errors and in-flight calls and JSON
+# parse failures are recorded as they happen. /api/metrics serves them in
+# Prometheus text format. With METRICS_MULTIPROCESS_DIR set, every worker
+# writes its totals there each FLUSH_INTERVAL seconds and the endpoint sums
+# all workers; point it at a directory local to the host.
+
+LEARNING_METRICS = {
+    'ENABLED': os.getenv('LEARNING_METRICS', '1') == '1',
+    'MULTIPROCESS_DIR': os.getenv('METRICS_MULTIPROCESS_DIR') or None,
+    'FLUSH_INTERVAL': 5,
+    'GAUGE_STALE_AFTER': 60,
+}
+
+# Background LLM jobs
+# The LLM-bound endpoints run as background jobs when called with ?async=1
+# or a "Prefer: respond-async" header: they answer 202 with a job id to
+# poll at /api/jobs/<id>/. Jobs are run by `manage.py run_llm_jobs`
+# (THREADS per process, --processes to fork more). A running job's worker
+# renews its claim every VISIBILITY_TIMEOUT / 3 seconds; a job whose worker
+# died is claimed again once VISIBILITY_TIMEOUT passes. A job's database
+# writes commit together with its result, so failed or 5xx runs (which keep
+# nothing) are retried up to MAX_ATTEMPTS times, RETRY_BACKOFF seconds
+# apart and doubling. Past MAX_DEPTH pending jobs new ones get a 503 with
+# Retry-After. Finished jobs are deleted after KEEP_FINISHED seconds.
+
+LLM_JOBS = {
+    'ENABLED': os.getenv('LLM_JOBS', '1') == '1',
+    'MAX_DEPTH': 1000,
+    'MAX_ATTEMPTS': 3,
+    'VISIBILITY_TIMEOUT': 300,
+    'RETRY_BACKOFF': 5,
+    'THREADS': int(os.getenv('LLM_JOB_THREADS', '4')),
+    'KEEP_FINISHED': 7 * 24 * 60 * 60,
+}
+
+# Upstream rate limit
+# Off by default; LLM_RATE_LIMIT=1 turns it on. Every OpenRouter call then
+# takes a token from a bucket refilled at RATE calls per second up to BURST
+# (the free models allow 20 a minute). BURST and MAX_WAITERS_PER_CLIENT
+# match QUIZ_BATCH MAX_CONCURRENCY so one client's batch fits. With SHARED
+# the bucket lives in the database and is shared by all worker processes.
+# A call waits up to MAX_WAIT seconds for a token; at most MAX_WAITERS calls
+# per process, and MAX_WAITERS_PER_CLIENT per client, wait at once. Calls
+# that cannot be admitted get a 503 with Retry-After. Clients are told apart
+# by REMOTE_ADDR, or by CLIENT_HEADER (e.g. 'HTTP_X_FORWARDED_FOR') behind a
+# trusted proxy.
+
+LLM_RATE_LIMIT = {
+    'ENABLED': os.getenv('LLM_RATE_LIMIT', '0') == '1',
+    'RATE': float(os.getenv('LLM_RATE_PER_MINUTE', '20')) / 60,
+    'BURST': QUIZ_BATCH['MAX_CONCURRENCY'],
+    'SHARED': True,
+    'MAX_WAIT': 10,
+    'MAX_WAITERS': 32,
+    'MAX_WAITERS_PER_CLIENT': QUIZ_BATCH['MAX_CONCURRENCY'],
+    'CLIENT_HEADER': os.getenv('LLM_RATE_LIMIT_CLIENT_HEADER') or None,
+}
+
+# LLM usage ledger
+# Every OpenRouter call is recorded as an LLMUsage row with its endpoint,
+# model, prompt template, topic, token counts and cost (OpenRouter's reported
+# cost, else LLM_ROUTER COSTS). Rows are written behind the request by a
+# background thread in batches of BATCH_SIZE, at least every FLUSH_INTERVAL
+# seconds; past MAX_QUEUE pending rows new ones are dropped. /api/llm/usage/
+# summarises the ledger.
+
+LLM_USAGE = {
+    'ENABLED': os.getenv('LLM_USAGE', '1') == '1',
+    'MAX_QUEUE': 10000,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,
+}